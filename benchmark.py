@@ -0,0 +1,459 @@
+"""
+Copyright (C) [2024] [Fourier Intelligence Ltd.]
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA
+"""
+
+"""
+Headless benchmark of the control loops of the demos, and of the zenoh record / play path.
+
+Each benchmark runs its control cycle back to back (no wait for the control period), for `--cycles` cycles:
+- stand, move_position, rl_walk: get_state -> algorithm of the demo -> set_control,
+  the state comes from the simulated robot (`sim.py`, closed loop), a synthetic state stream,
+  or a recorded telemetry file (`--source sim|synthetic|<file.tlm>`)
+- zenoh_record: one `TrajectoryWriter.append()` per cycle
+- zenoh_play_msgpack: one resampled sample encoded per cycle, as sent to the robot server
+- estimator: one `FloatingBaseEstimator` step per cycle (`estimator.py`), on the state stream
+
+Reported per benchmark:
+- throughput [Hz]: cycles per second, the maximum control frequency of the loop
+- latency percentiles [us] of the cycle and of each stage (`LoopProfiler`)
+- allocations per cycle, in a second run under tracemalloc:
+  peak bytes allocated during a cycle (freed or not), and bytes still allocated after it
+
+The results are saved as JSON (`data/benchmark/` by default, gitignored), with the commit, to compare them across commits:
+
+    python benchmark.py
+    python benchmark.py --only stand,zenoh_record --cycles 5000
+    python benchmark.py --compare data/benchmark/benchmark_xxx.json
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy
+
+import sim
+from profiler import LoopProfiler
+from telemetry import read_telemetry
+from utils import JointIndex, State
+
+VERSION = 1
+
+DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_OUTPUT_DIR = os.path.join(DIR, "data", "benchmark")
+
+# the demos select their control system at import, the benchmarks never use the robot
+sim.force_simulation()
+sys.path.append(os.path.join(DIR, "zenoh"))
+
+LATENCY_PERCENTILES = [50, 90, 99, 99.9]
+
+
+class SkipBenchmark(Exception):
+    pass
+
+
+class NoProfiler:
+    """Stands for LoopProfiler in the allocation run, so that only the cycle itself is measured."""
+
+    def lap(self):
+        pass
+
+
+class StateStream:
+    """
+    Open loop control system: `robot_control_loop_get_state()` replays a stream of states (State buffers),
+    one per call and in a loop, `robot_control_loop_set_control()` keeps the last command.
+    """
+
+    def __init__(self, states: numpy.ndarray, num_joint: int = len(JointIndex)):
+        self.states = numpy.ascontiguousarray(states, dtype=numpy.float64)
+        self.index = 0
+        self.state = State(num_joint)
+        self.state_dict = self.state.as_state_dict()
+        self.control_dict = None
+
+    def robot_control_loop_get_state(self) -> dict:
+        numpy.copyto(self.state.buffer, self.states[self.index])
+        self.index = (self.index + 1) % len(self.states)
+        return self.state_dict
+
+    def robot_control_loop_set_control(self, control_dict: dict):
+        self.control_dict = control_dict
+
+
+def synthetic_states(count: int = 1000, num_joint: int = len(JointIndex), seed: int = 0) -> numpy.ndarray:
+    """Robot standing near the default position: slow joint oscillation, small IMU noise."""
+    rng = numpy.random.default_rng(seed)
+    state = State(num_joint)
+    states = numpy.zeros((count, len(state.buffer)))
+
+    t = numpy.arange(count) * 0.02
+    phase = rng.uniform(0, 2 * numpy.pi, num_joint)
+    for i in range(count):
+        state.imu_quat[:] = (0.0, 0.0, 0.0, 1.0)
+        state.imu_angular_velocity[:] = rng.normal(0.0, 0.5, 3)
+        state.imu_acceleration[:] = (0.0, 0.0, 9.81)
+        state.joint_position[:] = 5.0 * numpy.sin(2 * numpy.pi * 0.5 * t[i] + phase)
+        state.joint_velocity[:] = 5.0 * 2 * numpy.pi * 0.5 * numpy.cos(2 * numpy.pi * 0.5 * t[i] + phase)
+        states[i] = state.buffer
+    return states
+
+
+def control_system_of_source(source: str):
+    if source == "sim":
+        control_system = sim.SimControlSystem()
+        control_system.reset(realtime=False)
+        control_system.developer_mode(servo_on=True)
+        return control_system
+    if source == "synthetic":
+        return StateStream(synthetic_states())
+    return StateStream(read_telemetry(source)["state"])
+
+
+def git_commit() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=DIR, capture_output=True, text=True, check=True)
+        status = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"],
+                                cwd=DIR, capture_output=True, text=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return {"commit": None, "dirty": None}
+    return {"commit": commit.stdout.strip(), "dirty": bool(status.stdout.strip())}
+
+
+# --------------------------------------------------------------------------------------
+# benchmarks: each returns (stage names, cycle function), the cycle calls `profiler.lap()` after each stage
+
+
+def loop_cycle(control_system, control_template, algorithm):
+    def cycle(profiler):
+        state_dict = control_system.robot_control_loop_get_state()
+        profiler.lap()
+
+        joint_target_position = algorithm(state_dict)
+        profiler.lap()
+
+        control_template.set_position(joint_target_position)
+        control_system.robot_control_loop_set_control(control_template.control_dict)
+        profiler.lap()
+
+    return ["get_state", "algorithm", "set_control"], cycle
+
+
+def position_control_template():
+    from utils import ControlTemplate
+
+    # gains of demo_rl_stand.py / demo_rl_walk.py
+    return ControlTemplate(
+        control_mode=[4] * len(JointIndex),
+        kp=[0.583, 0.284, 0.583, 0.583, 0.283, 0.283] * 2 + [0.25] * 3 + [0.005] * 3
+        + ([0.2] * 5 + [0.005] * 2) * 2,
+        kd=[0.017, 0.013, 0.273, 0.273, 0.005, 0.005] * 2 + [0.14] * 3 + [0.005] * 3
+        + ([0.02] * 5 + [0.005] * 2) * 2,
+    )
+
+
+def benchmark_stand(source: str):
+    import demo_rl_stand
+
+    demo_rl_stand.move_count = 0
+    demo_rl_stand.joint_start_position = None
+
+    def algorithm(state_dict):
+        return demo_rl_stand.algorithm_stand(state_dict["joint_position"])[0]
+
+    return loop_cycle(control_system_of_source(source), position_control_template(), algorithm)
+
+
+def benchmark_move_position(source: str):
+    import demo_move_position
+
+    demo_move_position.move_count = 0
+    demo_move_position.joint_start_position = None
+
+    def algorithm(state_dict):
+        return demo_move_position.algorithm_move_position(state_dict["joint_position"])[0]
+
+    return loop_cycle(control_system_of_source(source), position_control_template(), algorithm)
+
+
+def benchmark_rl_walk(source: str):
+    try:
+        import demo_rl_walk
+    except ImportError as error:
+        raise SkipBenchmark(f"demo_rl_walk cannot be imported: {error}")
+
+    model_file_path = os.path.join(DIR, "data", "walk_model.pt")
+    if not os.path.exists(model_file_path):
+        raise SkipBenchmark(f"{model_file_path} not found")
+
+    if demo_rl_walk.actor is None:
+        demo_rl_walk.load_actor()
+        demo_rl_walk.actor.warm_up()
+    demo_rl_walk.last_action_initialized = False
+
+    def algorithm(state_dict):
+        return demo_rl_walk.algorithm_rl_walk(state_dict["imu_quat"],
+                                              state_dict["imu_angular_velocity"],
+                                              state_dict["joint_position"],
+                                              state_dict["joint_velocity"])
+
+    return loop_cycle(control_system_of_source(source), position_control_template(), algorithm)
+
+
+def recorded_states(source: str) -> numpy.ndarray:
+    """State stream of the source (synthetic for the simulated robot)."""
+    return read_telemetry(source)["state"] if source not in ("sim", "synthetic") else synthetic_states()
+
+
+def recorded_positions(source: str) -> numpy.ndarray:
+    """Joint positions of the state stream [deg]."""
+    states = recorded_states(source)
+    index = [key for _, key, _, _ in State.LAYOUT].index("joint_position")
+    return numpy.ascontiguousarray(states[:, State.layout_slices(len(JointIndex))[index]])
+
+
+def benchmark_zenoh_record(source: str, stack: contextlib.ExitStack):
+    from trajectory import TrajectoryWriter
+
+    positions = recorded_positions(source)
+    directory = stack.enter_context(tempfile.TemporaryDirectory())
+    writer = stack.enter_context(TrajectoryWriter(os.path.join(directory, "benchmark.traj"), positions.shape[1], 150))
+    index = 0
+
+    def cycle(profiler):
+        nonlocal index
+        writer.append(positions[index])
+        index = (index + 1) % len(positions)
+        profiler.lap()
+
+    return ["append"], cycle
+
+
+def zenoh_play_samples(source: str) -> numpy.ndarray:
+    from playback import resample
+
+    positions = recorded_positions(source)
+    timestamps = numpy.arange(len(positions)) / 150
+    return resample(timestamps, positions, 150)[1]
+
+
+def benchmark_zenoh_play_msgpack(source: str):
+    import wire
+
+    samples = zenoh_play_samples(source)
+    index = 0
+
+    def cycle(profiler):
+        nonlocal index
+        wire.encode_msgpack({"position": samples[index]})
+        index = (index + 1) % len(samples)
+        profiler.lap()
+
+    return ["encode"], cycle
+
+
+def benchmark_estimator(source: str):
+    from estimator import FloatingBaseEstimator
+
+    stream = StateStream(recorded_states(source))
+    estimator = FloatingBaseEstimator()
+    state = stream.state
+
+    def cycle(profiler):
+        stream.robot_control_loop_get_state()
+        estimator.update_from_state(state, 0.002)
+        estimator.write(state)
+        profiler.lap()
+
+    return ["estimator"], cycle
+
+
+BENCHMARKS = {
+    "stand": benchmark_stand,
+    "move_position": benchmark_move_position,
+    "rl_walk": benchmark_rl_walk,
+    "zenoh_record": benchmark_zenoh_record,
+    "zenoh_play_msgpack": benchmark_zenoh_play_msgpack,
+    "estimator": benchmark_estimator,
+}
+
+
+# --------------------------------------------------------------------------------------
+
+
+def setup_benchmark(name: str, source: str, stack: contextlib.ExitStack):
+    if name == "zenoh_record":
+        return BENCHMARKS[name](source, stack)
+    return BENCHMARKS[name](source)
+
+
+def run_benchmark(name: str, source: str, cycles: int, warm_up_cycles: int = 100) -> dict:
+    # the algorithms of the demos print every cycle
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        # timing run
+        with contextlib.ExitStack() as stack:
+            stage_names, cycle = setup_benchmark(name, source, stack)
+            no_profiler = NoProfiler()
+            for _ in range(warm_up_cycles):
+                cycle(no_profiler)
+
+            profiler = LoopProfiler(stage_names, period_in_s=1.0, capacity=cycles)
+            time_start_in_s = time.perf_counter()
+            for _ in range(cycles):
+                profiler.start()
+                cycle(profiler)
+                profiler.stop()
+            total_in_s = time.perf_counter() - time_start_in_s
+
+        # allocation run, separate since tracemalloc slows down every allocation
+        with contextlib.ExitStack() as stack:
+            stage_names, cycle = setup_benchmark(name, source, stack)
+            for _ in range(warm_up_cycles):
+                cycle(no_profiler)
+
+            allocated_in_bytes = numpy.zeros(cycles, dtype=numpy.int64)
+            tracemalloc.start()
+            try:
+                memory_start_in_bytes = tracemalloc.get_traced_memory()[0]
+                for i in range(cycles):
+                    current_in_bytes = tracemalloc.get_traced_memory()[0]
+                    tracemalloc.reset_peak()
+                    cycle(no_profiler)
+                    allocated_in_bytes[i] = tracemalloc.get_traced_memory()[1] - current_in_bytes
+                retained_in_bytes = tracemalloc.get_traced_memory()[0] - memory_start_in_bytes
+            finally:
+                tracemalloc.stop()
+
+    latency_in_us = {}
+    for column_name, histogram in zip(profiler.column_names, profiler.histograms):
+        if column_name == "period":
+            continue
+        latency_in_us[column_name] = {
+            "min": histogram.min_value / 1e3,
+            **{f"p{percentile:g}": histogram.percentile(percentile) / 1e3 for percentile in LATENCY_PERCENTILES},
+            "max": histogram.max_recorded_value / 1e3,
+        }
+
+    return {
+        "cycles": cycles,
+        "total_in_s": total_in_s,
+        "throughput_in_hz": cycles / total_in_s,
+        "latency_in_us": latency_in_us,
+        "allocated_bytes_per_cycle": {
+            "mean": float(allocated_in_bytes.mean()),
+            "p50": float(numpy.percentile(allocated_in_bytes, 50)),
+            "max": int(allocated_in_bytes.max()),
+        },
+        "retained_bytes_per_cycle": retained_in_bytes / cycles,
+    }
+
+
+def run(names: list[str], source: str, cycles: int) -> dict:
+    results = {
+        "version": VERSION,
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        **git_commit(),
+        "python": platform.python_version(),
+        "numpy": numpy.__version__,
+        "machine": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "source": source,
+        "benchmarks": {},
+        "skipped": {},
+    }
+
+    for name in names:
+        try:
+            results["benchmarks"][name] = run_benchmark(name, source, cycles)
+        except SkipBenchmark as error:
+            results["skipped"][name] = str(error)
+
+    return results
+
+
+def report(results: dict, baseline: dict = None) -> str:
+    lines = ["{:<22}{:>14}{:>12}{:>12}{:>12}{:>14}".format(
+        "benchmark", "throughput", "p50 [us]", "p99 [us]", "max [us]", "alloc [B]")]
+
+    for name, result in results["benchmarks"].items():
+        cycle = result["latency_in_us"]["cycle"]
+        lines.append("{:<22}{:>11.0f} Hz{:>12.1f}{:>12.1f}{:>12.1f}{:>14.0f}".format(
+            name, result["throughput_in_hz"], cycle["p50"], cycle["p99"], cycle["max"],
+            result["allocated_bytes_per_cycle"]["mean"]))
+
+        previous = (baseline or {}).get("benchmarks", {}).get(name)
+        if previous is not None:
+            previous_cycle = previous["latency_in_us"]["cycle"]
+            lines.append("{:<22}{:>13.2f}x{:>11.2f}x{:>11.2f}x{:>12}{:>13.2f}x".format(
+                "  vs " + str(baseline.get("commit") or "baseline")[:12],
+                result["throughput_in_hz"] / previous["throughput_in_hz"],
+                cycle["p50"] / max(previous_cycle["p50"], 1e-9),
+                cycle["p99"] / max(previous_cycle["p99"], 1e-9),
+                "",
+                (result["allocated_bytes_per_cycle"]["mean"] + 1)
+                / (previous["allocated_bytes_per_cycle"]["mean"] + 1)))
+
+    for name, reason in results["skipped"].items():
+        lines.append("{:<22}skipped: {}".format(name, reason))
+
+    return "\n".join(lines)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Headless benchmark of the control loops")
+    parser.add_argument("--only", type=str, default=",".join(BENCHMARKS),
+                        help="comma separated benchmarks, in: " + ", ".join(BENCHMARKS))
+    parser.add_argument("--source", type=str, default="sim",
+                        help="state source: sim, synthetic, or a telemetry file (.tlm)")
+    parser.add_argument("--cycles", type=int, default=2000)
+    parser.add_argument("--output", type=str, default=None, help="JSON result file")
+    parser.add_argument("--compare", type=str, default=None, help="JSON result file to compare with")
+    args = parser.parse_args(argv[1:])
+
+    names = [name for name in args.only.split(",") if name]
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        parser.error("unknown benchmarks: " + ", ".join(unknown))
+
+    results = run(names, args.source, args.cycles)
+
+    baseline = None
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print(report(results, baseline))
+
+    output = args.output
+    if output is None:
+        os.makedirs(DEFAULT_OUTPUT_DIR, exist_ok=True)
+        output = os.path.join(DEFAULT_OUTPUT_DIR, "benchmark_" + time.strftime("%Y%m%d_%H%M%S")
+                              + "_" + (results["commit"] or "unknown")[:8] + ".json")
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print("results saved to", output)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
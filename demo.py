@@ -17,9 +17,17 @@ Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA
 """
 
 import sys
-import time
 
-from robot_rcs_gr.control_system.fi_control_system_gr import ControlSystemGR as ControlSystem
+from profiler import LoopProfiler
+from scheduler import LoopScheduler
+from sim import select_control_system
+from startup import loop_live, profile_startup
+from utils import ControlTemplate
+
+# --profile-startup: hand over to the profiled child process before selecting the control system
+profile_startup(sys.argv)
+
+ControlSystem = select_control_system(sys.argv)
 
 
 def main(argv):
@@ -29,7 +37,9 @@ def main(argv):
     request : < 500Hz
     """
     target_control_frequency = 50  # 机器人控制频率, 50Hz
-    target_control_period_in_s = 1.0 / target_control_frequency  # 机器人控制周期
+
+    # everything is loaded, a --profile-startup run ends here (before servo on)
+    loop_live()
 
     # developer mode
     ControlSystem().developer_mode()
@@ -39,12 +49,83 @@ def main(argv):
     print(info_dict)
 
     state_dict = {}
-    control_dict = {}
+
+    # control command, control mode and gains are set only once, position is updated every control cycle
+    control_template = ControlTemplate(
+        # control mode:
+        # - 4: position control
+        # - 5: PD control
+        #
+        # kp, kd:
+        # - in position control mode: kp is position kp, kd is velocity kp
+        # - in PD control mode: kp is position kp, kd is velocity kd
+        control_mode=[
+            # left leg
+            5, 5, 5, 5, 5, 5,
+            # right leg
+            5, 5, 5, 5, 5, 5,
+            # waist
+            5, 5, 5,
+            # head
+            5, 5, 5,
+            # left arm
+            5, 5, 5, 5, 5, 5, 5,
+            # right arm
+            5, 5, 5, 5, 5, 5, 5,
+        ],
+        kp=[
+            # left leg
+            200, 200, 200, 200, 200, 200,
+            # right leg
+            200, 200, 200, 200, 200, 200,
+            # waist
+            200, 200, 200,
+            # head
+            200, 200, 200,
+            # left arm
+            200, 200, 200, 200, 200, 200, 200,
+            # right arm
+            200, 200, 200, 200, 200, 200, 200,
+        ],
+        kd=[
+            # left leg
+            10, 10, 10, 10, 10, 10,
+            # right leg
+            10, 10, 10, 10, 10, 10,
+            # waist
+            10, 10, 10,
+            # head
+            10, 10, 10,
+            # left arm
+            10, 10, 10, 10, 10, 10, 10,
+            # right arm
+            10, 10, 10, 10, 10, 10, 10,
+        ],
+        # position (in urdf):
+        # - unit: degree
+        position=[
+            # left leg
+            0, 0, 0, 0, 0, 0,
+            # right leg
+            0, 0, 0, 0, 0, 0,
+            # waist
+            0, 0, 0,
+            # head
+            0, 0, 0,
+            # left arm
+            0, 0, 0, 0, 0, 0, 0,
+            # right arm
+            0, 0, 0, 0, 0, 0, 0,
+        ],
+    )
 
     # control loop
+    scheduler = LoopScheduler(target_control_frequency)
+    profiler = LoopProfiler(["get_state", "algorithm", "set_control"], scheduler.period_in_s)
+    profiler.install_dump_handlers()
+
     while True:
-        # control loop start time
-        time_start_of_robot_control_loop_in_s = time.time()
+        profiler.start()
 
         # update state
         """
@@ -63,6 +144,7 @@ def main(argv):
           - linear velocity xyz [m/s]
         """
         state_dict = ControlSystem().robot_control_loop_get_state()
+        profiler.lap()
         # print("state_dict = \n", state_dict)
 
         # parse state
@@ -78,6 +160,7 @@ def main(argv):
 
         # algorithm (user customized...)
         algorithm_user_customized()
+        profiler.lap()
 
         """
         control:
@@ -86,97 +169,15 @@ def main(argv):
         - kp
         - kd
         """
-        control_dict.update({
-            # control mode:
-            # - 4: position control
-            # - 5: PD control
-            #
-            # kp, kd:
-            # - in position control mode: kp is position kp, kd is velocity kp
-            # - in PD control mode: kp is position kp, kd is velocity kd
-            "control_mode": [
-                # left leg
-                5, 5, 5, 5, 5, 5,
-                # right leg
-                5, 5, 5, 5, 5, 5,
-                # waist
-                5, 5, 5,
-                # head
-                5, 5, 5,
-                # left arm
-                5, 5, 5, 5, 5, 5, 5,
-                # right arm
-                5, 5, 5, 5, 5, 5, 5,
-            ],
-            "kp": [
-                # left leg
-                200, 200, 200, 200, 200, 200,
-                # right leg
-                200, 200, 200, 200, 200, 200,
-                # waist
-                200, 200, 200,
-                # head
-                200, 200, 200,
-                # left arm
-                200, 200, 200, 200, 200, 200, 200,
-                # right arm
-                200, 200, 200, 200, 200, 200, 200,
-            ],
-            "kd": [
-                # left leg
-                10, 10, 10, 10, 10, 10,
-                # right leg
-                10, 10, 10, 10, 10, 10,
-                # waist
-                10, 10, 10,
-                # head
-                10, 10, 10,
-                # left arm
-                10, 10, 10, 10, 10, 10, 10,
-                # right arm
-                10, 10, 10, 10, 10, 10, 10,
-            ],
-            # position (in urdf):
-            # - unit: degree
-            "position": [
-                # left leg
-                0, 0, 0, 0, 0, 0,
-                # right leg
-                0, 0, 0, 0, 0, 0,
-                # waist
-                0, 0, 0,
-                # head
-                0, 0, 0,
-                # left arm
-                0, 0, 0, 0, 0, 0, 0,
-                # right arm
-                0, 0, 0, 0, 0, 0, 0,
-            ],
-        })
+        control_dict = control_template.control_dict
 
         # output control
         ControlSystem().robot_control_loop_set_control(control_dict)
-
-        # control loop wait time
-        time_end_of_robot_control_loop_in_s = time.time()
-        time_of_robot_control_loop_in_s = time_end_of_robot_control_loop_in_s \
-                                          - time_start_of_robot_control_loop_in_s
+        profiler.lap()
+        profiler.stop()
 
         # wait for next control period
-        time_to_sleep_in_s = target_control_period_in_s - time_of_robot_control_loop_in_s
-        if time_to_sleep_in_s >= 0:
-            pass
-        else:
-            time_to_sleep_in_s = 0
-
-        time.sleep(time_to_sleep_in_s)
-
-        # TODO: allow use more accurate control frequency
-        # time_to_sleep_mark_in_s = time.time()
-        # while True:
-        #     time_offset_in_s = time.time() - time_to_sleep_mark_in_s
-        #     if time_offset_in_s >= time_to_sleep_in_s:
-        #         break
+        scheduler.wait()
 
 
 def algorithm_user_customized():
@@ -16,11 +16,44 @@ along with this program; if not, write to the Free Software
 Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA
 """
 
+import atexit
+import os
 import sys
 import time
 import numpy
 
-from robot_rcs_gr.control_system.fi_control_system_gr import ControlSystemGR as ControlSystem
+from profiler import LoopProfiler
+from rotation import projected_gravity
+from scheduler import LoopScheduler
+from sim import rcs_config_path, select_control_system
+from startup import loop_live, profile_startup
+from telemetry import TelemetryRecorder, state_columns
+from utils import State
+
+# --profile-startup: hand over to the profiled child process before selecting the control system
+profile_startup(sys.argv)
+
+# --estimator: estimate the base position and velocity in the loop (estimator.py),
+# taken out of argv, the SDK rejects the arguments it does not know
+ESTIMATOR_FLAG = "--estimator"
+use_estimator = ESTIMATOR_FLAG in sys.argv
+if use_estimator:
+    sys.argv.remove(ESTIMATOR_FLAG)
+
+# --record <dir>: record every cycle into telemetry files in <dir>, taken out of argv too
+RECORD_FLAG = "--record"
+record_dir = None
+if RECORD_FLAG in sys.argv:
+    index = sys.argv.index(RECORD_FLAG)
+    if index + 1 >= len(sys.argv):
+        sys.exit(f"{RECORD_FLAG} needs a directory")
+    record_dir = sys.argv[index + 1]
+    del sys.argv[index:index + 2]
+
+# telemetry retention: at most 8 files of 256MB (the last 1.3 hours at 500Hz)
+MAX_TELEMETRY_FILE_COUNT = 8
+
+ControlSystem = select_control_system(sys.argv)
 
 
 def main(argv):
@@ -29,8 +62,21 @@ def main(argv):
     control frequency
     request : < 500Hz
     """
-    target_control_frequency = 1  # 机器人控制频率, 1Hz
-    target_control_period_in_s = 1.0 / target_control_frequency  # 机器人控制周期
+    target_control_frequency = 500  # 机器人控制频率, 500Hz
+    print_period_in_s = 1.0  # state print period, every cycle is recorded with --record
+
+    # state estimator, with the model of the rcs config
+    estimator = None
+    if use_estimator:
+        from estimator import FloatingBaseEstimator
+        from robot_config import load_config
+
+        config_path = rcs_config_path(argv)
+        model = load_config(config_path).model if config_path is not None else None
+        estimator = FloatingBaseEstimator(model)
+
+    # everything is loaded, a --profile-startup run ends here (before servo on)
+    loop_live()
 
     # dev mode
     ControlSystem().developer_mode(servo_on=False)
@@ -41,11 +87,28 @@ def main(argv):
 
     state_dict = {}
     control_dict = {}
+    state = State()
+
+    # telemetry
+    telemetry = None
+    if record_dir is not None:
+        telemetry = TelemetryRecorder(os.path.join(record_dir, time.strftime("print_state_%Y%m%d_%H%M%S")),
+                                      state_columns(state.num_joint, with_command=False),
+                                      max_file_count=MAX_TELEMETRY_FILE_COUNT)
+        atexit.register(telemetry.close)
 
     # control loop
+    scheduler = LoopScheduler(target_control_frequency)
+    profiler = LoopProfiler(["get_state"]
+                            + (["estimator"] if estimator is not None else [])
+                            + (["record_state"] if telemetry is not None else []),
+                            scheduler.period_in_s)
+    profiler.install_dump_handlers()
+
+    print_period = max(int(round(print_period_in_s * target_control_frequency)), 1)
+
     while True:
-        # control loop start time
-        time_start_of_robot_control_loop_in_s = time.time()
+        profiler.start()
 
         # update state
         """
@@ -64,50 +127,39 @@ def main(argv):
           - linear velocity xyz [m/s]
         """
         state_dict = ControlSystem().robot_control_loop_get_state()
-
-        # parse state
-        imu_quat = state_dict["imu_quat"]
-        imu_euler_angle = state_dict["imu_euler_angle"]
-        imu_angular_velocity = state_dict["imu_angular_velocity"]
-        imu_acceleration = state_dict["imu_acceleration"]
-        joint_position = state_dict["joint_position"]
-        joint_velocity = state_dict["joint_velocity"]
-        joint_kinetic = state_dict["joint_kinetic"]
-        base_xyz = state_dict["base_estimate_xyz"]
-        base_vel_xyz = state_dict["base_estimate_xyz_vel"]
-
-        # print state
-        print("#################################################")
-        print("imu_quat = \n", numpy.round(imu_quat, 3))
-        print("imu_euler_angle = \n", numpy.round(imu_euler_angle, 3))
-        print("imu_angular_velocity = \n", numpy.round(imu_angular_velocity, 3))
-        print("imu_acceleration = \n", numpy.round(imu_acceleration, 3))
-        print("joint_position = \n", numpy.round(joint_position, 3))
-        print("joint_velocity = \n", numpy.round(joint_velocity, 3))
-        print("joint_kinetic = \n", numpy.round(joint_kinetic, 3))
-        print("base_xyz = \n", numpy.round(base_xyz, 3))
-        print("base_vel_xyz = \n", numpy.round(base_vel_xyz, 3))
-
-        # control loop wait time
-        time_end_of_robot_control_loop_in_s = time.time()
-        time_of_robot_control_loop_in_s = time_end_of_robot_control_loop_in_s \
-                                          - time_start_of_robot_control_loop_in_s
+        state.update(state_dict)
+        profiler.lap()
+
+        # estimate the base position and velocity, written into the base items of the state
+        if estimator is not None:
+            estimator.update_from_state(state, scheduler.period_in_s)
+            estimator.write(state)
+            profiler.lap()
+
+        # record state
+        if telemetry is not None:
+            telemetry.record(state.buffer)
+            profiler.lap()
+        profiler.stop()
+
+        # print state, rate limited (printing is slow and adds jitter to the loop)
+        if scheduler.cycle_count % print_period == 0:
+            print("#################################################")
+            print("imu_quat = \n", numpy.round(state.imu_quat, 3))
+            print("imu_euler_angle = \n", numpy.round(state.imu_euler_angle, 3))
+            print("imu_angular_velocity = \n", numpy.round(state.imu_angular_velocity, 3))
+            print("imu_acceleration = \n", numpy.round(state.imu_acceleration, 3))
+            print("imu_projected_gravity = \n", numpy.round(projected_gravity(state.imu_quat), 3))
+            print("joint_position = \n", numpy.round(state.joint_position, 3))
+            print("joint_velocity = \n", numpy.round(state.joint_velocity, 3))
+            print("joint_kinetic = \n", numpy.round(state.joint_kinetic, 3))
+            print("base_xyz = \n", numpy.round(state.base_xyz, 3))
+            print("base_vel_xyz = \n", numpy.round(state.base_vel_xyz, 3))
+            if telemetry is not None:
+                print("telemetry dropped records = ", telemetry.dropped_count)
 
         # wait for next control period
-        time_to_sleep_in_s = target_control_period_in_s - time_of_robot_control_loop_in_s
-        if time_to_sleep_in_s >= 0:
-            pass
-        else:
-            time_to_sleep_in_s = 0
-
-        time.sleep(time_to_sleep_in_s)
-
-        # TODO: allow use more accurate control frequency
-        # time_to_sleep_mark_in_s = time.time()
-        # while True:
-        #     time_offset_in_s = time.time() - time_to_sleep_mark_in_s
-        #     if time_offset_in_s >= time_to_sleep_in_s:
-        #         break
+        scheduler.wait()
 
 
 if __name__ == "__main__":
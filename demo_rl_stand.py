@@ -20,7 +20,16 @@ import sys
 import time
 import numpy
 
-from robot_rcs_gr.control_system.fi_control_system_gr import ControlSystemGR as ControlSystem
+from profiler import LoopProfiler
+from scheduler import LoopScheduler
+from sim import select_control_system
+from startup import loop_live, profile_startup
+from utils import ControlTemplate
+
+# --profile-startup: hand over to the profiled child process before selecting the control system
+profile_startup(sys.argv)
+
+ControlSystem = select_control_system(sys.argv)
 
 """
 Current policy is still under development, and the robot may not be able to stand stably.
@@ -34,19 +43,76 @@ def main(argv):
     request : < 500Hz
     """
     target_control_frequency = 50  # 机器人控制频率, 50Hz
-    target_control_period_in_s = 1.0 / target_control_frequency  # 机器人控制周期
+
+    # everything is loaded, a --profile-startup run ends here (before servo on)
+    loop_live()
 
     # dev mode
     ControlSystem().developer_mode(servo_on=True)
 
     # prepare dict
     state_dict = {}
-    control_dict = {}
+
+    # control command, control mode and gains are set only once, position is updated every control cycle
+    control_template = ControlTemplate(
+        # control mode:
+        # - 4: position control
+        # - 5: PD control
+        #
+        # kp, kd:
+        # - in position control mode: kp is position kp, kd is velocity kp
+        # - in PD control mode: kp is position kp, kd is velocity kd
+        control_mode=[
+            # left leg
+            4, 4, 4, 4, 4, 4,
+            # right leg
+            4, 4, 4, 4, 4, 4,
+            # waist
+            4, 4, 4,
+            # head
+            4, 4, 4,
+            # left arm
+            4, 4, 4, 4, 4, 4, 4,
+            # right arm
+            4, 4, 4, 4, 4, 4, 4,
+        ],
+        kp=[
+            # left leg
+            0.583, 0.284, 0.583, 0.583, 0.283, 0.283,
+            # right leg
+            0.583, 0.284, 0.583, 0.583, 0.283, 0.283,
+            # waist
+            0.25, 0.25, 0.25,
+            # head
+            0.005, 0.005, 0.005,
+            # left arm
+            0.2, 0.2, 0.2, 0.2, 0.2, 0.005, 0.005,
+            # right arm
+            0.2, 0.2, 0.2, 0.2, 0.2, 0.005, 0.005,
+        ],
+        kd=[
+            # left leg
+            0.017, 0.013, 0.273, 0.273, 0.005, 0.005,
+            # right leg
+            0.017, 0.013, 0.273, 0.273, 0.005, 0.005,
+            # waist
+            0.14, 0.14, 0.14,
+            # head
+            0.005, 0.005, 0.005,
+            # left arm
+            0.02, 0.02, 0.02, 0.02, 0.02, 0.005, 0.005,
+            # right arm
+            0.02, 0.02, 0.02, 0.02, 0.02, 0.005, 0.005,
+        ],
+    )
 
     # control loop
+    scheduler = LoopScheduler(target_control_frequency)
+    profiler = LoopProfiler(["get_state", "algorithm", "set_control"], scheduler.period_in_s)
+    profiler.install_dump_handlers()
+
     while True:
-        # control loop start time
-        time_start_of_robot_control_loop_in_s = time.time()
+        profiler.start()
 
         # update state
         """
@@ -65,6 +131,7 @@ def main(argv):
           - linear velocity xyz [m/s]
         """
         state_dict = ControlSystem().robot_control_loop_get_state()
+        profiler.lap()
         # print("state_dict = \n", state_dict)
 
         # parse state
@@ -82,6 +149,7 @@ def main(argv):
 
         # algorithm (user customized...)
         joint_target_position, finish_flag = algorithm_stand(joint_measured_position)
+        profiler.lap()
 
         """
         control:
@@ -90,65 +158,17 @@ def main(argv):
         - kp
         - kd
         """
-        control_dict.update({
-            # control mode:
-            # - 4: position control
-            # - 5: PD control
-            #
-            # kp, kd:
-            # - in position control mode: kp is position kp, kd is velocity kp
-            # - in PD control mode: kp is position kp, kd is velocity kd
-            "control_mode": [
-                # left leg
-                4, 4, 4, 4, 4, 4,
-                # right leg
-                4, 4, 4, 4, 4, 4,
-                # waist
-                4, 4, 4,
-                # head
-                4, 4, 4,
-                # left arm
-                4, 4, 4, 4, 4, 4, 4,
-                # right arm
-                4, 4, 4, 4, 4, 4, 4,
-            ],
-            "kp": [
-                # left leg
-                0.583, 0.284, 0.583, 0.583, 0.283, 0.283,
-                # right leg
-                0.583, 0.284, 0.583, 0.583, 0.283, 0.283,
-                # waist
-                0.25, 0.25, 0.25,
-                # head
-                0.005, 0.005, 0.005,
-                # left arm
-                0.2, 0.2, 0.2, 0.2, 0.2, 0.005, 0.005,
-                # right arm
-                0.2, 0.2, 0.2, 0.2, 0.2, 0.005, 0.005,
-            ],
-            "kd": [
-                # left leg
-                0.017, 0.013, 0.273, 0.273, 0.005, 0.005,
-                # right leg
-                0.017, 0.013, 0.273, 0.273, 0.005, 0.005,
-                # waist
-                0.14, 0.14, 0.14,
-                # head
-                0.005, 0.005, 0.005,
-                # left arm
-                0.02, 0.02, 0.02, 0.02, 0.02, 0.005, 0.005,
-                # right arm
-                0.02, 0.02, 0.02, 0.02, 0.02, 0.005, 0.005,
-            ],
-            # position (in urdf):
-            # - unit: deg
-            "position": joint_target_position
-        })
+        # position (in urdf):
+        # - unit: deg
+        control_template.set_position(joint_target_position)
+        control_dict = control_template.control_dict
 
         # print(numpy.round(joint_target_position, 1))
 
         # output control
         ControlSystem().robot_control_loop_set_control(control_dict)
+        profiler.lap()
+        profiler.stop()
 
         # finish process
         if finish_flag is True:
@@ -159,19 +179,8 @@ def main(argv):
 
             break
 
-        # control loop wait time
-        time_end_of_robot_control_loop_in_s = time.time()
-        time_of_robot_control_loop_in_s = time_end_of_robot_control_loop_in_s \
-                                          - time_start_of_robot_control_loop_in_s
-
         # wait for next control period
-        time_to_sleep_in_s = target_control_period_in_s - time_of_robot_control_loop_in_s
-        if time_to_sleep_in_s >= 0:
-            pass
-        else:
-            time_to_sleep_in_s = 0
-
-        time.sleep(time_to_sleep_in_s)
+        scheduler.wait()
 
 
 move_count = 0
@@ -22,7 +22,18 @@ import time
 import numpy
 import torch
 
-from robot_rcs_gr.control_system.fi_control_system_gr import ControlSystemGR as ControlSystem
+from observation import WalkObservation
+from policy_runtime import PolicyEnsemble, PolicyRuntime
+from profiler import LoopProfiler
+from scheduler import LoopScheduler
+from sim import select_control_system
+from startup import loop_live, profile_startup
+from utils import ControlTemplate
+
+# --profile-startup: hand over to the profiled child process before selecting the control system
+profile_startup(sys.argv)
+
+ControlSystem = select_control_system(sys.argv)
 
 """
 Current policy is still under development, and the robot may not be able to walk stably.
@@ -35,19 +46,79 @@ def main(argv):
     request : < 500Hz
     """
     target_control_frequency = 50  # 机器人控制频率, 50Hz
-    target_control_period_in_s = 1.0 / target_control_frequency  # 机器人控制周期
+
+    # load and warm up the actor before servo on, so that the first control cycle is as fast as the following ones
+    warm_up_rl_walk()
+
+    # everything is loaded, a --profile-startup run ends here (before servo on)
+    loop_live()
 
     # dev mode
     ControlSystem().developer_mode(servo_on=True)
 
     # prepare dict
     state_dict = {}
-    control_dict = {}
+
+    # control command, control mode and gains are set only once, position is updated every control cycle
+    control_template = ControlTemplate(
+        # control mode:
+        # - 4: position control
+        # - 5: PD control
+        #
+        # kp, kd:
+        # - in position control mode: kp is position kp, kd is velocity kp
+        # - in PD control mode: kp is position kp, kd is velocity kd
+        control_mode=[
+            # left leg
+            4, 4, 4, 4, 4, 4,
+            # right leg
+            4, 4, 4, 4, 4, 4,
+            # waist
+            4, 4, 4,
+            # head
+            4, 4, 4,
+            # left arm
+            4, 4, 4, 4, 4, 4, 4,
+            # right arm
+            4, 4, 4, 4, 4, 4, 4,
+        ],
+        kp=[
+            # left leg
+            0.583, 0.284, 0.583, 0.583, 0.283, 0.283,
+            # right leg
+            0.583, 0.284, 0.583, 0.583, 0.283, 0.283,
+            # waist
+            0.25, 0.25, 0.25,
+            # head
+            0.005, 0.005, 0.005,
+            # left arm
+            0.2, 0.2, 0.2, 0.2, 0.2, 0.005, 0.005,
+            # right arm
+            0.2, 0.2, 0.2, 0.2, 0.2, 0.005, 0.005,
+        ],
+        kd=[
+            # left leg
+            0.017, 0.013, 0.273, 0.273, 0.005, 0.005,
+            # right leg
+            0.017, 0.013, 0.273, 0.273, 0.005, 0.005,
+            # waist
+            0.14, 0.14, 0.14,
+            # head
+            0.005, 0.005, 0.005,
+            # left arm
+            0.02, 0.02, 0.02, 0.02, 0.02, 0.005, 0.005,
+            # right arm
+            0.02, 0.02, 0.02, 0.02, 0.02, 0.005, 0.005,
+        ],
+    )
 
     # control loop
+    scheduler = LoopScheduler(target_control_frequency)
+    profiler = LoopProfiler(["get_state", "algorithm", "set_control"], scheduler.period_in_s)
+    profiler.install_dump_handlers()
+
     while True:
-        # control loop start time
-        time_start_of_robot_control_loop_in_s = time.time()
+        profiler.start()
 
         # update state
         """
@@ -66,6 +137,7 @@ def main(argv):
           - linear velocity xyz [m/s]
         """
         state_dict = ControlSystem().robot_control_loop_get_state()
+        profiler.lap()
         # print("state_dict = \n", state_dict)
 
         # parse state
@@ -92,6 +164,7 @@ def main(argv):
                                                   imu_angular_velocity,
                                                   joint_measured_position,
                                                   joint_measured_velocity)
+        profiler.lap()
 
         """
         control:
@@ -100,91 +173,23 @@ def main(argv):
         - kp
         - kd
         """
-        control_dict.update({
-            # control mode:
-            # - 4: position control
-            # - 5: PD control
-            #
-            # kp, kd:
-            # - in position control mode: kp is position kp, kd is velocity kp
-            # - in PD control mode: kp is position kp, kd is velocity kd
-            "control_mode": [
-                # left leg
-                4, 4, 4, 4, 4, 4,
-                # right leg
-                4, 4, 4, 4, 4, 4,
-                # waist
-                4, 4, 4,
-                # head
-                4, 4, 4,
-                # left arm
-                4, 4, 4, 4, 4, 4, 4,
-                # right arm
-                4, 4, 4, 4, 4, 4, 4,
-            ],
-            "kp": [
-                # left leg
-                0.583, 0.284, 0.583, 0.583, 0.283, 0.283,
-                # right leg
-                0.583, 0.284, 0.583, 0.583, 0.283, 0.283,
-                # waist
-                0.25, 0.25, 0.25,
-                # head
-                0.005, 0.005, 0.005,
-                # left arm
-                0.2, 0.2, 0.2, 0.2, 0.2, 0.005, 0.005,
-                # right arm
-                0.2, 0.2, 0.2, 0.2, 0.2, 0.005, 0.005,
-            ],
-            "kd": [
-                # left leg
-                0.017, 0.013, 0.273, 0.273, 0.005, 0.005,
-                # right leg
-                0.017, 0.013, 0.273, 0.273, 0.005, 0.005,
-                # waist
-                0.14, 0.14, 0.14,
-                # head
-                0.005, 0.005, 0.005,
-                # left arm
-                0.02, 0.02, 0.02, 0.02, 0.02, 0.005, 0.005,
-                # right arm
-                0.02, 0.02, 0.02, 0.02, 0.02, 0.005, 0.005,
-            ],
-            # position (in urdf):
-            # - unit: degree
-            "position": joint_target_position
-        })
+        # position (in urdf):
+        # - unit: degree
+        control_template.set_position(joint_target_position)
+        control_dict = control_template.control_dict
 
         # output control
         ControlSystem().robot_control_loop_set_control(control_dict)
-
-        # control loop wait time
-        time_end_of_robot_control_loop_in_s = time.time()
-        time_of_robot_control_loop_in_s = time_end_of_robot_control_loop_in_s \
-                                          - time_start_of_robot_control_loop_in_s
+        profiler.lap()
+        profiler.stop()
 
         # wait for next control period
-        time_to_sleep_in_s = target_control_period_in_s - time_of_robot_control_loop_in_s
-        if time_to_sleep_in_s >= 0:
-            pass
-        else:
-            time_to_sleep_in_s = 0
-
-        time.sleep(time_to_sleep_in_s)
-
-        # TODO: allow use more accurate control frequency
-        # time_to_sleep_mark_in_s = time.time()
-        # while True:
-        #     time_offset_in_s = time.time() - time_to_sleep_mark_in_s
-        #     if time_offset_in_s >= time_to_sleep_in_s:
-        #         break
+        scheduler.wait()
 
 
 # --------------------------------------------------------------------------------------
 
-command = torch.tensor([[0.0, 0.0, 0.0]])
 actor = None
-last_action = None
 action_max = torch.tensor([[
     0.79, 0.7, 0.7, 1.92, 0.52,  # left leg (5), no ankle roll, more simple state_estimator
     0.09, 0.7, 0.7, 1.92, 0.52,  # left leg (5), no ankle roll, more simple state_estimator
@@ -201,7 +206,6 @@ joint_default_position = torch.tensor([[
     0.0, 0.2, 0.0, -0.3, 0.0, 0.0, 0.0,  # left arm (7)
     0.0, -0.2, 0.0, -0.3, 0.0, 0.0, 0.0,  # right arm (7)
 ]], dtype=torch.float32)
-gravity_vector = torch.tensor([[0.0, 0.0, -1.0]])
 
 num_joint = 32
 num_actor_obs = 39
@@ -210,103 +214,127 @@ num_actions = 10
 index_joint_controlled = [0, 1, 2, 3, 4,
                           6, 7, 8, 9, 10]
 
+# additional policies (in data folder) evaluated together with the walk policy for shadow testing,
+# e.g. ["walk_model_new.pt"], they must have the same actor architecture as the walk policy
+shadow_model_file_names = []
 
-def quat_rotate_inverse(q, v):
-    shape = q.shape
-    q_w = q[:, -1]
-    q_vec = q[:, :3]
-    a = v * (2.0 * q_w ** 2 - 1.0).unsqueeze(-1)
-    b = torch.cross(q_vec, v, dim=-1) * q_w.unsqueeze(-1) * 2.0
-    c = q_vec * torch.bmm(q_vec.view(shape[0], 1, 3), v.view(shape[0], 3, 1)).squeeze(-1) * 2.0
-    return a - b + c
+# preallocated buffers, reused every control cycle
+observation = WalkObservation(index_joint_controlled, joint_default_position, num_joint=num_joint)
+observation.set_command([0.0, 0.0, 0.0])
+last_action_initialized = False
 
+action_clipped = torch.zeros((1, num_actions), dtype=torch.float32)
+index_joint_controlled_tensor = torch.tensor(index_joint_controlled, dtype=torch.long)
+joint_target_position_tensor = torch.zeros(num_joint, dtype=torch.float32)
+joint_target_position_in_deg = numpy.zeros(num_joint, dtype=numpy.float64)
 
-def algorithm_rl_walk(imu_quat,
-                      imu_angular_velocity,
-                      joint_measured_position,
-                      joint_measured_velocity) -> list:
-    global command
-    global actor, last_action
 
-    # parse to torch
-    imu_quat_tensor = torch.tensor(imu_quat, dtype=torch.float32).unsqueeze(0)
-    imu_angular_velocity_tensor = torch.tensor(imu_angular_velocity, dtype=torch.float32).unsqueeze(0)
-    joint_measured_position_tensor = torch.tensor(joint_measured_position, dtype=torch.float32).unsqueeze(0)
-    joint_measured_velocity_tensor = torch.tensor(joint_measured_velocity, dtype=torch.float32).unsqueeze(0)
+def load_actor():
+    global actor
 
-    imu_angular_velocity_tensor = imu_angular_velocity_tensor / 180.0 * torch.pi  # unit : rad/s
-    joint_measured_position_tensor = joint_measured_position_tensor / 180.0 * torch.pi  # unit : rad
-    joint_measured_velocity_tensor = joint_measured_velocity_tensor / 180.0 * torch.pi  # unit : rad/s
+    model_file_dir = os.path.dirname(os.path.abspath(__file__)) + "/data/"
+    model_file_names = ["walk_model.pt"] + shadow_model_file_names
 
-    joint_offset_position_tensor = joint_measured_position_tensor - joint_default_position
+    runtimes = []
+    for model_file_name in model_file_names:
+        model_file_path = model_file_dir + model_file_name
+        print("algorithm_rl_walk model_file_path = ", model_file_path)
 
-    # load actor
-    if actor is None:
-        from robot_rcs.rl.rl_actor_critic_mlp import ActorCriticMLP
+        runtimes.append(PolicyRuntime(model_file_path,
+                                      num_actor_obs=num_actor_obs,
+                                      num_critic_obs=num_critic_obs,
+                                      num_actions=num_actions,
+                                      actor_hidden_dims=[512, 256, 128],
+                                      critic_hidden_dims=[512, 256, 128]))
+
+    if len(runtimes) == 1:
+        actor = runtimes[0]
+    else:
+        # all policies in one batched forward pass, the walk policy drives the robot,
+        # actions of the shadow policies are available in actor.actions
+        actor = PolicyEnsemble(runtimes)
+        actor.select(0)
 
-        model_file_path = os.path.dirname(os.path.abspath(__file__)) + "/data/walk_model.pt"
-        print("algorithm_rl_walk model_file_path = ", model_file_path)
 
-        model = torch.load(model_file_path, map_location=torch.device("cpu"))
-        model_actor_dict = model["model_state_dict"]
+def warm_up_rl_walk(num_iterations=50):
+    """
+    Load the actor, and run the whole algorithm on a dummy state (robot standing upright at default position),
+    so that model loading, compilation and buffer initialization are done before the control loop starts.
+    """
+    global last_action_initialized
+
+    load_actor()
+    print("warm up: actor load time = ", numpy.round(actor.load_time_in_s * 1000, 3), "ms",
+          ", backend = ", actor.backend)
+
+    time_of_actor_in_s = actor.warm_up(num_iterations)
+    print("warm up: actor inference time (first / mean / max) = ",
+          numpy.round(time_of_actor_in_s[0] * 1000, 3), "/",
+          numpy.round(time_of_actor_in_s.mean() * 1000, 3), "/",
+          numpy.round(time_of_actor_in_s.max() * 1000, 3), "ms")
+
+    dummy_state_dict = {
+        "imu_quat": numpy.array([0.0, 0.0, 0.0, 1.0]),
+        "imu_angular_velocity": numpy.zeros(3),
+        "joint_position": joint_default_position[0].numpy() / numpy.pi * 180.0,
+        "joint_velocity": numpy.zeros(num_joint),
+    }
+
+    time_of_algorithm_in_s = numpy.zeros(num_iterations)
+    for i in range(num_iterations):
+        time_start_in_s = time.perf_counter()
+        algorithm_rl_walk(dummy_state_dict["imu_quat"],
+                          dummy_state_dict["imu_angular_velocity"],
+                          dummy_state_dict["joint_position"],
+                          dummy_state_dict["joint_velocity"])
+        time_of_algorithm_in_s[i] = time.perf_counter() - time_start_in_s
+
+    print("warm up: algorithm_rl_walk time (first / mean / max) = ",
+          numpy.round(time_of_algorithm_in_s[0] * 1000, 3), "/",
+          numpy.round(time_of_algorithm_in_s.mean() * 1000, 3), "/",
+          numpy.round(time_of_algorithm_in_s.max() * 1000, 3), "ms")
+
+    # the first real cycle starts from the measured joint position again
+    last_action_initialized = False
 
-        actor = ActorCriticMLP(num_actor_obs=39,
-                               num_critic_obs=168,
-                               num_actions=10,
-                               actor_hidden_dims=[512, 256, 128],
-                               critic_hidden_dims=[512, 256, 128])
 
-        actor.load_state_dict(model_actor_dict)
+def algorithm_rl_walk(imu_quat,
+                      imu_angular_velocity,
+                      joint_measured_position,
+                      joint_measured_velocity) -> list:
+    global actor, last_action_initialized
+
+    # load actor
+    if actor is None:
+        load_actor()
+
+    # parse to torch, unit : rad, rad/s
+    observation.update(imu_quat,
+                       imu_angular_velocity,
+                       joint_measured_position,
+                       joint_measured_velocity)
 
     # when first run, last_action is set to measured joint position
-    if last_action is None:
-        last_action = torch.zeros((1, num_actions), dtype=torch.float32)
-        for i in range(len(index_joint_controlled)):
-            index = index_joint_controlled[i]
-            last_action[0, i] = joint_offset_position_tensor[0, index]
-
-    # command
-    command = torch.tensor([[0.0, 0.0, 0.0]], dtype=torch.float32)
-
-    # project gravity
-    project_gravity_tensor = quat_rotate_inverse(imu_quat_tensor, gravity_vector)
-
-    # joint position and velocity
-    joint_controlled_position_tensor = torch.zeros((1, num_actions), dtype=torch.float32)
-    joint_controlled_velocity_tensor = torch.zeros((1, num_actions), dtype=torch.float32)
-    for i in range(len(index_joint_controlled)):
-        index = index_joint_controlled[i]
-        joint_controlled_position_tensor[0, i] = joint_offset_position_tensor[0, index]
-        joint_controlled_velocity_tensor[0, i] = joint_measured_velocity_tensor[0, index]
-
-    # actor-critic
-    observation = torch.cat((
-        imu_angular_velocity_tensor,
-        project_gravity_tensor,
-        command,
-        joint_controlled_position_tensor,
-        joint_controlled_velocity_tensor,
-        last_action), dim=1)
-
-    action = actor(observation)
+    if last_action_initialized is False:
+        observation.reset_last_action()
+        last_action_initialized = True
+
+    # actor
+    action = actor(observation.observation)
 
     # clip action
-    action = torch.max(action, action_min)
-    action = torch.min(action, action_max)
+    torch.maximum(action, action_min, out=action_clipped)
+    torch.minimum(action_clipped, action_max, out=action_clipped)
 
     # record action
-    last_action = action
-
-    joint_target_position = torch.zeros((1, num_joint), dtype=torch.float32)
-    for i in range(len(index_joint_controlled)):
-        index = index_joint_controlled[i]
-        joint_target_position[0, index] = action[0, i]
-    joint_target_position += joint_default_position
-
-    # parse to numpy
-    joint_target_position = joint_target_position.detach().numpy()
-    joint_target_position = joint_target_position / numpy.pi * 180.0
-    joint_target_position = joint_target_position[0]
+    observation.update_last_action(action_clipped)
+
+    joint_target_position_tensor.copy_(joint_default_position[0])
+    joint_target_position_tensor.index_add_(0, index_joint_controlled_tensor, action_clipped[0])
+
+    # parse to numpy, unit : deg
+    numpy.multiply(joint_target_position_tensor.numpy(), 180.0 / numpy.pi, out=joint_target_position_in_deg)
+    joint_target_position = joint_target_position_in_deg
 
     # print("algorithm_rl_walk joint_target_position = \n", joint_target_position)
 
@@ -0,0 +1,225 @@
+"""
+Copyright (C) [2024] [Fourier Intelligence Ltd.]
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA
+"""
+
+"""
+Rigid body dynamics of the state estimator models, in numpy, on top of `kinematics.py`.
+
+The base is fixed (legs in the air, or the swing leg): the joint torques are those of the legs
+holding their own links, with gravity in the base frame (from the IMU orientation).
+Joint positions in rad, torques in Nm.
+
+Spatial vector algebra, with every spatial quantity expressed in the base frame at the base origin,
+so that the recursions over the tree become sums over the ancestors / the descendants of each link (one matmul each):
+- gravity torques: S_i . (sum of the link spatial inertias below joint i) a_gravity
+- mass matrix: composite rigid body algorithm (CRBA), plus the rotor inertia reflected through the gear ratio
+- inverse dynamics: recursive Newton-Euler algorithm (RNEA)
+
+The link spatial inertias in the link frame (mass, com, rotational inertia) are precomputed,
+and moved to the base frame only when the joints change.
+"""
+
+import numpy
+
+from kinematics import Kinematics, RobotModel, cross, load_model, skew
+from rotation import quat_rotate_inverse
+
+
+def motion_cross(v: numpy.ndarray, m: numpy.ndarray) -> numpy.ndarray:
+    """Spatial motion cross product v x m, (..., 6) = (angular, linear)."""
+    return numpy.concatenate([
+        cross(v[..., :3], m[..., :3]),
+        cross(v[..., :3], m[..., 3:]) + cross(v[..., 3:], m[..., :3]),
+    ], axis=-1)
+
+
+def force_cross(v: numpy.ndarray, f: numpy.ndarray) -> numpy.ndarray:
+    """Spatial force cross product v x* f, (..., 6) = (moment, force)."""
+    return numpy.concatenate([
+        cross(v[..., :3], f[..., :3]) + cross(v[..., 3:], f[..., 3:]),
+        cross(v[..., :3], f[..., 3:]),
+    ], axis=-1)
+
+
+def compensate_position(position_in_deg: numpy.ndarray,
+                        kp: numpy.ndarray,
+                        torque: numpy.ndarray,
+                        out: numpy.ndarray = None) -> numpy.ndarray:
+    """
+    PD control mode (`ControlMode.PD`) has no torque input: add a feedforward torque [Nm]
+    by moving the target position [deg] by torque / kp (kp in Nm/rad), joints with kp = 0 are not moved.
+    """
+    offset_in_rad = numpy.divide(torque, kp, out=numpy.zeros(numpy.shape(torque)), where=numpy.asarray(kp) > 0)
+    return numpy.add(position_in_deg, numpy.rad2deg(offset_in_rad), out=out)
+
+
+class Dynamics:
+    """
+    Gravity torques, mass matrix and inverse dynamics of the current configuration.
+
+    `update()` recomputes the kinematics of the joints that changed (see `Kinematics`),
+    and the gravity torques and mass matrix only if a joint or the gravity changed.
+    """
+
+    def __init__(self, model: RobotModel = None, kinematics: Kinematics = None):
+        self.model = model = model if model is not None else load_model()
+        self.kinematics = kinematics if kinematics is not None else Kinematics(model)
+
+        num_joint = model.num_joint
+        link_count = model.link_count
+
+        # link_ancestor[k, i]: joint i is at link k or above it, joint_ancestor[i, j]: joint j is joint i or above it
+        self.link_ancestor = model.ancestor[:, model.joint_links].astype(numpy.float64)
+        self.subtree = self.link_ancestor.T.copy()
+        self.joint_ancestor = model.ancestor[model.joint_links][:, model.joint_links]
+
+        # reflected rotor inertia
+        self.armature = model.rotor_inertia * model.gear_ratio ** 2
+
+        self.gravity = model.gravity.copy()
+        self._dirty = True
+
+        # outputs
+        self.gravity_torque = numpy.zeros(num_joint)
+        self.mass_matrix = numpy.zeros((num_joint, num_joint))
+
+        # current configuration: joint spatial axes (joint, 6), link spatial inertias (link, 6, 6)
+        self.joint_axis = numpy.zeros((num_joint, 6))
+        self.spatial_inertia = numpy.zeros((link_count, 6, 6))
+        self.composite_inertia = numpy.zeros((num_joint, 6, 6))
+
+    def set_gravity_from_imu(self, imu_quat: numpy.ndarray):
+        """Gravity in the base frame, for the IMU orientation (x, y, z, w), the IMU being aligned with the base."""
+        gravity = quat_rotate_inverse(numpy.asarray(imu_quat, dtype=numpy.float64), self.model.gravity)
+        if not numpy.array_equal(gravity, self.gravity):
+            self.gravity[:] = gravity
+            self._dirty = True
+
+    def gravity_acceleration(self) -> numpy.ndarray:
+        """Spatial acceleration of the fixed base, standing for gravity."""
+        return numpy.concatenate([numpy.zeros(3), -self.gravity])
+
+    def update(self, joint_position: numpy.ndarray) -> bool:
+        """Update for the joint positions [rad], returns False if nothing changed."""
+        if self.kinematics.update(joint_position):
+            self._update_links()
+            self._dirty = True
+
+        if not self._dirty:
+            return False
+
+        # composite inertias do not depend on gravity, gravity torques do
+        self.gravity_torque[:] = numpy.einsum("ia,iab,b->i", self.joint_axis, self.composite_inertia,
+                                              self.gravity_acceleration())
+        self._dirty = False
+        return True
+
+    def _update_links(self):
+        model = self.model
+        rotations = self.kinematics.rotations
+        positions = self.kinematics.positions
+
+        # joint spatial axes: (axis, origin x axis)
+        axis = (rotations[model.joint_links] @ model.joint_axis[:, :, None])[..., 0]
+        self.joint_axis[:, :3] = axis
+        self.joint_axis[:, 3:] = cross(positions[model.joint_links], axis)
+
+        # link spatial inertias at the base origin: [[I_c + m cx cx^T, m cx], [m cx^T, m 1]]
+        com = positions + (rotations @ model.com[:, :, None])[..., 0]
+        mass = model.mass[:, None, None]
+        com_skew = skew(com)
+        inertia = self.spatial_inertia
+        inertia[:, :3, :3] = rotations @ model.inertia @ rotations.transpose(0, 2, 1) \
+            - mass * (com_skew @ com_skew)
+        inertia[:, :3, 3:] = mass * com_skew
+        inertia[:, 3:, :3] = -mass * com_skew
+        inertia[:, 3:, 3:] = mass * numpy.eye(3)
+
+        # composite inertia of the links below each joint
+        self.composite_inertia[:] = (self.subtree @ inertia.reshape(model.link_count, 36)).reshape(-1, 6, 6)
+
+        # CRBA: H[i, j] = S_i . Ic_i S_j, for joint j above joint i
+        lower = (numpy.einsum("ia,iab->ib", self.joint_axis, self.composite_inertia) @ self.joint_axis.T) \
+            * self.joint_ancestor
+        numpy.add(lower, lower.T, out=self.mass_matrix)
+        self.mass_matrix[numpy.diag_indices_from(self.mass_matrix)] = numpy.diag(lower) + self.armature
+
+    def inverse_dynamics(self,
+                         joint_velocity: numpy.ndarray,
+                         joint_acceleration: numpy.ndarray,
+                         friction: bool = False) -> numpy.ndarray:
+        """
+        RNEA: joint torques for the joint velocities [rad/s] and accelerations [rad/s^2] at the current configuration
+        (call `update()` first), with gravity, and optionally the joint friction of the model.
+        """
+        joint_velocity = numpy.asarray(joint_velocity, dtype=numpy.float64)
+        joint_acceleration = numpy.asarray(joint_acceleration, dtype=numpy.float64)
+        link_ancestor = self.link_ancestor
+
+        # link spatial velocities: sum of the joint motions above each link
+        joint_motion = self.joint_axis * joint_velocity[:, None]
+        velocity = link_ancestor @ joint_motion
+
+        # link spatial accelerations, from the base acceleration (gravity), the joint accelerations
+        # and the velocity product terms (the joint axis moves with the link above it)
+        joint_link_velocity = velocity[self.model.joint_links]
+        acceleration = self.gravity_acceleration() + link_ancestor @ (
+            self.joint_axis * joint_acceleration[:, None] + motion_cross(joint_link_velocity, joint_motion))
+
+        # link spatial forces, summed over the links below each joint
+        momentum = (self.spatial_inertia @ velocity[:, :, None])[..., 0]
+        force = (self.spatial_inertia @ acceleration[:, :, None])[..., 0] + force_cross(velocity, momentum)
+        joint_force = self.subtree @ force
+
+        torque = numpy.einsum("ia,ia->i", self.joint_axis, joint_force) + self.armature * joint_acceleration
+        if friction:
+            torque += self.model.viscous_friction * joint_velocity \
+                + self.model.coulomb_friction * numpy.sign(joint_velocity)
+        return torque
+
+
+if __name__ == "__main__":
+    import timeit
+
+    from kinematics import leg_joint_position
+
+    dynamics = Dynamics()
+    model = dynamics.model
+
+    # standing position of the demos [deg]
+    joint_position_in_deg = numpy.zeros(32)
+    joint_position_in_deg[:12] = numpy.rad2deg([0.0, 0.0, -0.2618, 0.5236, -0.2618, 0.0] * 2)
+    joint_position = leg_joint_position(joint_position_in_deg)
+
+    dynamics.set_gravity_from_imu([0.0, 0.0, 0.0, 1.0])
+    dynamics.update(joint_position)
+    print("gravity torque [Nm] = \n", numpy.round(dynamics.gravity_torque, 3))
+    print("mass matrix diagonal = \n", numpy.round(numpy.diag(dynamics.mass_matrix), 4))
+
+    def update_all_joints():
+        joint_position[:] += 1e-4
+        dynamics.update(joint_position)
+
+    number = 2000
+    print("Dynamics.update (gravity torque + mass matrix) = ",
+          round(timeit.timeit(update_all_joints, number=number) / number * 1e6, 1), "us")
+
+    joint_velocity = numpy.ones(model.num_joint)
+    joint_acceleration = numpy.ones(model.num_joint)
+    print("Dynamics.inverse_dynamics = ",
+          round(timeit.timeit(lambda: dynamics.inverse_dynamics(joint_velocity, joint_acceleration),
+                              number=number) / number * 1e6, 1), "us")
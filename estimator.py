@@ -0,0 +1,267 @@
+"""
+Copyright (C) [2024] [Fourier Intelligence Ltd.]
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA
+"""
+
+"""
+Floating base state estimator: IMU and leg kinematics fused by a linear Kalman filter, in the control cycle.
+
+The orientation is the one of the IMU (`imu_quat`, the IMU being aligned with the base).
+Filter state (world frame): base position, base velocity, left foot position, right foot position.
+- prediction: the base is moved by the IMU acceleration (`imu_acceleration` rotated to the world frame, plus gravity),
+  the feet stay in place, with a large process noise for the feet not in contact
+- correction:
+  - foot position relative to the base, from the leg kinematics (`kinematics.py`)
+  - base velocity, from each foot in contact (the foot does not move: v_base = -R (J dq + w x r))
+  - foot height 0 for the feet in contact (flat ground)
+  the measurements of the feet not in contact get a large noise, so all matrices keep a fixed size
+
+Contact detection: a foot is in contact when it is within `contact_height_in_m` of the lowest foot (with hysteresis),
+the lowest foot is always in contact.
+
+The estimate has the layout of `base_estimate_xyz` / `base_estimate_xyz_vel` and can be written into a `State`.
+"""
+
+import numpy
+
+from kinematics import SKEW_BASIS, Kinematics, leg_joint_position, load_model
+from rotation import quat_to_matrix
+from utils import State
+
+NUM_FEET = 2
+NUM_STATE = 3 + 3 + 3 * NUM_FEET
+NUM_MEASUREMENT = 3 * NUM_FEET + 3 * NUM_FEET + NUM_FEET
+
+# noise of the feet not in contact
+LARGE_VARIANCE = 1e6
+
+
+class FloatingBaseEstimator:
+    def __init__(self,
+                 model=None,
+                 foot_offset: numpy.ndarray = (0.0, 0.0, 0.0),
+                 accelerometer_noise: float = 0.5,
+                 base_position_noise: float = 1e-3,
+                 foot_noise: float = 1e-3,
+                 kinematics_noise: float = 5e-3,
+                 velocity_noise: float = 0.05,
+                 height_noise: float = 0.01,
+                 contact_height_in_m: float = 0.03,
+                 contact_hysteresis_in_m: float = 0.01):
+        """
+        foot_offset: sole point in the ankle (leaf link) frame [m]
+        noise: standard deviations, process noise per second [m/s^2, m, m], measurement noise [m, m/s, m]
+        """
+        self.model = model if model is not None else load_model()
+        self.kinematics = Kinematics(self.model, foot_offset)
+        if len(self.kinematics.foot_links) != NUM_FEET:
+            raise ValueError(f"the model should have {NUM_FEET} feet, got {len(self.kinematics.foot_links)}")
+
+        self.accelerometer_noise = accelerometer_noise
+        self.base_position_noise = base_position_noise
+        self.foot_noise = foot_noise
+        self.contact_height_in_m = contact_height_in_m
+        self.contact_hysteresis_in_m = contact_hysteresis_in_m
+
+        # filter, all preallocated
+        self.x = numpy.zeros(NUM_STATE)
+        self.P = numpy.eye(NUM_STATE)
+        self.Q = numpy.zeros(NUM_STATE)
+        self.R = numpy.zeros(NUM_MEASUREMENT)
+        self.z = numpy.zeros(NUM_MEASUREMENT)
+        self.S = numpy.zeros((NUM_MEASUREMENT, NUM_MEASUREMENT))
+        # diagonals as views, to add the noise in place
+        self.P_diagonal = self.P.reshape(-1)[::NUM_STATE + 1]
+        self.S_diagonal = self.S.reshape(-1)[::NUM_MEASUREMENT + 1]
+
+        # measurement matrix, constant: (foot - base position), base velocity per foot, foot height
+        self.H = numpy.zeros((NUM_MEASUREMENT, NUM_STATE))
+        for foot in range(NUM_FEET):
+            row = 3 * foot
+            self.H[row:row + 3, 0:3] = -numpy.eye(3)
+            self.H[row:row + 3, 6 + row:9 + row] = numpy.eye(3)
+            row = 3 * NUM_FEET + 3 * foot
+            self.H[row:row + 3, 3:6] = numpy.eye(3)
+            self.H[6 * NUM_FEET + foot, 6 + 3 * foot + 2] = 1.0
+
+        self.kinematics_variance = kinematics_noise ** 2
+        self.velocity_variance = velocity_noise ** 2
+        self.height_variance = height_noise ** 2
+
+        # views of the estimate
+        self.position = self.x[0:3]
+        self.velocity = self.x[3:6]
+        self.foot_positions = self.x[6:].reshape(NUM_FEET, 3)
+
+        self.contact = numpy.ones(NUM_FEET, dtype=bool)
+        self.initialized = False
+
+        # per cycle buffers
+        self.rotation = numpy.eye(3)
+        self.joint_position = numpy.zeros(self.model.num_joint)
+        self.joint_velocity = numpy.zeros(self.model.num_joint)
+        self.acceleration = numpy.zeros(3)
+        self.foot_relative = numpy.zeros((NUM_FEET, 3))
+        self.foot_jacobians = numpy.zeros((NUM_FEET, 3, self.model.num_joint))
+        self.foot_velocity = numpy.zeros((NUM_FEET, 3))
+        # world frame measurements, written in place into z (the foot heights stay 0)
+        self.foot_relative_world = self.z[0:3 * NUM_FEET].reshape(NUM_FEET, 3)
+        self.base_velocity_of_foot = self.z[3 * NUM_FEET:6 * NUM_FEET].reshape(NUM_FEET, 3)
+
+    def reset(self):
+        self.initialized = False
+
+    def update_from_state(self, state: State, dt: float):
+        self.update(state.imu_quat, state.imu_angular_velocity, state.imu_acceleration,
+                    state.joint_position, state.joint_velocity, dt)
+
+    def update(self,
+               imu_quat: numpy.ndarray,
+               imu_angular_velocity_in_deg: numpy.ndarray,
+               imu_acceleration: numpy.ndarray,
+               joint_position_in_deg: numpy.ndarray,
+               joint_velocity_in_deg: numpy.ndarray,
+               dt: float):
+        """One estimation step, with the units of `robot_control_loop_get_state()` (deg, deg/s, m/s^2)."""
+        rotation = quat_to_matrix(numpy.asarray(imu_quat, dtype=numpy.float64), out=self.rotation)
+        angular_velocity_skew = (numpy.deg2rad(imu_angular_velocity_in_deg) @ SKEW_BASIS).reshape(3, 3)
+        leg_joint_position(joint_position_in_deg, out=self.joint_position)
+        leg_joint_position(joint_velocity_in_deg, out=self.joint_velocity)
+
+        # leg kinematics, in the base frame, into the preallocated buffers when a joint moved
+        kinematics = self.kinematics
+        if kinematics.update(self.joint_position):
+            kinematics.foot_positions(out=self.foot_relative)
+            kinematics.foot_jacobians(out=self.foot_jacobians)
+        foot_relative = self.foot_relative
+        foot_velocity = numpy.matmul(self.foot_jacobians, self.joint_velocity, out=self.foot_velocity)
+        # + w x r
+        foot_velocity += foot_relative @ angular_velocity_skew.T
+
+        # to the world frame (base position excluded)
+        foot_relative_world = numpy.matmul(foot_relative, rotation.T, out=self.foot_relative_world)
+        base_velocity_of_foot = numpy.matmul(foot_velocity, rotation.T, out=self.base_velocity_of_foot)
+        numpy.negative(base_velocity_of_foot, out=base_velocity_of_foot)
+
+        self._detect_contact(foot_relative_world[:, 2])
+
+        if not self.initialized:
+            self._initialize(foot_relative_world)
+            return
+
+        self._predict(rotation, imu_acceleration, dt)
+        self._correct()
+
+    def _detect_contact(self, foot_height: numpy.ndarray):
+        height_above_lowest = foot_height - foot_height.min()
+        threshold = numpy.where(self.contact,
+                                self.contact_height_in_m + self.contact_hysteresis_in_m,
+                                self.contact_height_in_m)
+        numpy.less_equal(height_above_lowest, threshold, out=self.contact)
+
+    def _initialize(self, foot_relative_world: numpy.ndarray):
+        # lowest foot on the ground, at the origin of x and y
+        self.x[:] = 0.0
+        self.position[2] = -foot_relative_world[:, 2].min()
+        self.foot_positions[:] = self.position + foot_relative_world
+        self.P[:] = 0.0
+        self.P_diagonal[:] = 1e-4
+        self.initialized = True
+
+    def _predict(self, rotation: numpy.ndarray, imu_acceleration: numpy.ndarray, dt: float):
+        numpy.matmul(rotation, imu_acceleration, out=self.acceleration)
+        self.acceleration += self.model.gravity
+
+        self.position += self.velocity * dt + 0.5 * dt * dt * self.acceleration
+        self.velocity += self.acceleration * dt
+
+        Q = self.Q
+        Q[0:3] = self.base_position_noise ** 2 * dt
+        Q[3:6] = self.accelerometer_noise ** 2 * dt
+        Q[6:].reshape(NUM_FEET, 3)[:] = numpy.where(self.contact, self.foot_noise ** 2 * dt, LARGE_VARIANCE * dt)[:, None]
+
+        # P = F P F^T, F = identity but the position / velocity block (dt): rows then columns, in place
+        P = self.P
+        P[0:3] += dt * P[3:6]
+        P[:, 0:3] += dt * P[:, 3:6]
+        self.P_diagonal += Q
+
+    def _correct(self):
+        contact = self.contact
+        z = self.z
+
+        R = self.R
+        R[0:3 * NUM_FEET] = self.kinematics_variance
+        R[3 * NUM_FEET:6 * NUM_FEET] = numpy.repeat(numpy.where(contact, self.velocity_variance, LARGE_VARIANCE), 3)
+        R[6 * NUM_FEET:] = numpy.where(contact, self.height_variance, LARGE_VARIANCE)
+
+        H = self.H
+        P = self.P
+        PHt = P @ H.T
+        numpy.matmul(H, PHt, out=self.S)
+        self.S_diagonal += R
+
+        # K = P H^T S^-1, S is symmetric
+        K = numpy.linalg.solve(self.S, PHt.T).T
+        self.x += K @ (z - H @ self.x)
+
+        # P = (I - K H) P = P - K (P H^T)^T, P is symmetric, then kept symmetric
+        P -= K @ PHt.T
+        P += P.T
+        P *= 0.5
+
+    def write(self, state: State):
+        """Write the estimate into the base items of a state (`base_estimate_xyz`, `base_estimate_xyz_vel`)."""
+        state.base_xyz[:] = self.position
+        state.base_vel_xyz[:] = self.velocity
+
+
+if __name__ == "__main__":
+    import time
+    import timeit
+
+    # robot standing still at the default position of the demos, 500Hz
+    dt = 0.002
+    state = State()
+    state.imu_quat[:] = (0.0, 0.0, 0.0, 1.0)
+    state.imu_acceleration[:] = (0.0, 0.0, 9.81)
+    state.joint_position[:12] = numpy.rad2deg([0.0, 0.0, -0.2618, 0.5236, -0.2618, 0.0] * 2)
+
+    estimator = FloatingBaseEstimator()
+    rng = numpy.random.default_rng(0)
+    for _ in range(1000):
+        state.imu_acceleration[:] = (0.0, 0.0, 9.81) + rng.normal(0.0, 0.05, 3)
+        estimator.update_from_state(state, dt)
+
+    print("base position [m] = ", numpy.round(estimator.position, 4))
+    print("base velocity [m/s] = ", numpy.round(estimator.velocity, 4))
+    print("contact = ", estimator.contact)
+
+    number = 2000
+    time_in_s = timeit.timeit(lambda: estimator.update_from_state(state, dt), number=number) / number
+    print("FloatingBaseEstimator.update (no joint moved) = ", round(time_in_s * 1e6, 1), "us",
+          ", ", round(time_in_s / dt * 100, 1), "% of a 2ms cycle")
+
+    # walking: all the leg joints move every cycle, the kinematics are updated every cycle
+    times_in_s = numpy.empty(number)
+    for index in range(number):
+        state.joint_position[:12] += 1e-3
+        start = time.perf_counter()
+        estimator.update_from_state(state, dt)
+        times_in_s[index] = time.perf_counter() - start
+    p50_in_s, p99_in_s = numpy.percentile(times_in_s, [50, 99])
+    print("FloatingBaseEstimator.update (all joints moved) = p50", round(p50_in_s * 1e6, 1), "us, p99",
+          round(p99_in_s * 1e6, 1), "us, ", round(p99_in_s / dt * 100, 1), "% of a 2ms cycle")
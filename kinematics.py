@@ -0,0 +1,354 @@
+"""
+Copyright (C) [2024] [Fourier Intelligence Ltd.]
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA
+"""
+
+"""
+Forward kinematics of the state estimator models (`state_estimator/model_gr1_t*.json`), in numpy.
+
+The model is a tree of links, link 0 is the floating base (pelvis), the other links each have one revolute joint.
+The transform from the parent link frame to the link frame is:
+- TransArray (joint origin in the parent frame), then RotArray (fixed rotation),
+- then the DH parameters (rotation z by theta, translation d along z and a along x, rotation x by alpha),
+- then the joint rotation about `Rotation_Axis` ("+x", "-y", ...) by the joint position.
+
+All poses are in the base frame, joint positions in rad, in the order of the links (left leg then right leg for GR1).
+"""
+
+import functools
+import json
+import os
+
+import numpy
+
+from utils import JointIndex
+
+DIR = os.path.dirname(os.path.abspath(__file__))
+
+# joints of the model, in link order, and their index in the state of `robot_control_loop_get_state()`
+LEG_JOINT_INDEX = numpy.array([
+    JointIndex.L_LEG_0, JointIndex.L_LEG_1, JointIndex.L_LEG_2,
+    JointIndex.L_LEG_3, JointIndex.L_LEG_4, JointIndex.L_LEG_5,
+    JointIndex.R_LEG_0, JointIndex.R_LEG_1, JointIndex.R_LEG_2,
+    JointIndex.R_LEG_3, JointIndex.R_LEG_4, JointIndex.R_LEG_5,
+])
+
+AXES = {
+    "x": numpy.array([1.0, 0.0, 0.0]),
+    "y": numpy.array([0.0, 1.0, 0.0]),
+    "z": numpy.array([0.0, 0.0, 1.0]),
+}
+
+
+def skew(vector: numpy.ndarray) -> numpy.ndarray:
+    """Cross product matrices of vectors (..., 3) -> (..., 3, 3)."""
+    matrix = numpy.zeros(vector.shape + (3,))
+    matrix[..., 0, 1] = -vector[..., 2]
+    matrix[..., 0, 2] = vector[..., 1]
+    matrix[..., 1, 0] = vector[..., 2]
+    matrix[..., 1, 2] = -vector[..., 0]
+    matrix[..., 2, 0] = -vector[..., 1]
+    matrix[..., 2, 1] = vector[..., 0]
+    return matrix
+
+
+# skew(v).ravel() = v @ SKEW_BASIS
+SKEW_BASIS = skew(numpy.eye(3)).reshape(3, 9)
+
+
+def cross(a: numpy.ndarray, b: numpy.ndarray) -> numpy.ndarray:
+    """Cross product of vectors (..., 3), cheaper than numpy.cross on small arrays."""
+    return numpy.stack([
+        a[..., 1] * b[..., 2] - a[..., 2] * b[..., 1],
+        a[..., 2] * b[..., 0] - a[..., 0] * b[..., 2],
+        a[..., 0] * b[..., 1] - a[..., 1] * b[..., 0],
+    ], axis=-1)
+
+
+def joint_axis(rotation_axis: str) -> numpy.ndarray | None:
+    """Unit axis of a revolute joint ("+x", "-z", ...), None for the floating or fixed joints."""
+    if len(rotation_axis) != 2 or rotation_axis[0] not in "+-" or rotation_axis[1] not in AXES:
+        return None
+    return AXES[rotation_axis[1]] * (1.0 if rotation_axis[0] == "+" else -1.0)
+
+
+def dh_transform(a: float, alpha: float, d: float, theta: float) -> tuple[numpy.ndarray, numpy.ndarray]:
+    ct, st, ca, sa = numpy.cos(theta), numpy.sin(theta), numpy.cos(alpha), numpy.sin(alpha)
+    rotation = numpy.array([
+        [ct, -st * ca, st * sa],
+        [st, ct * ca, -ct * sa],
+        [0.0, sa, ca],
+    ])
+    translation = numpy.array([a * ct, a * st, d])
+    return rotation, translation
+
+
+class RobotModel:
+    """
+    Model of a state estimator JSON, parsed once into contiguous arrays (one row per link, in link id order).
+    """
+
+    def __init__(self, model_dict: dict):
+        links = sorted(model_dict["robot_linkArray"], key=lambda link: link["current_ID"])
+        if [link["current_ID"] for link in links] != list(range(len(links))):
+            raise ValueError("link ids should be 0 .. link count - 1")
+
+        self.link_count = link_count = len(links)
+        self.gravity = numpy.array(model_dict.get("gravityArray", [0.0, 0.0, -9.81]), dtype=numpy.float64)
+
+        # tree, parents before children
+        self.parent = numpy.array([-1] + [link["Parent_ID"] for link in links[1:]], dtype=numpy.intp)
+        if numpy.any(self.parent[1:] >= numpy.arange(1, link_count)):
+            raise ValueError("the parent of a link should have a smaller id")
+
+        depth = numpy.zeros(link_count, dtype=numpy.intp)
+        for link in range(1, link_count):
+            depth[link] = depth[self.parent[link]] + 1
+        self.levels = [numpy.flatnonzero(depth == level) for level in range(1, depth.max() + 1)]
+
+        # ancestor[i, j]: link j is link i or one of its ancestors
+        self.ancestor = numpy.eye(link_count, dtype=bool)
+        for link in range(1, link_count):
+            self.ancestor[link] |= self.ancestor[self.parent[link]]
+        self.leaf_links = numpy.setdiff1d(numpy.arange(link_count), self.parent[1:])
+
+        # fixed transform of each link in its parent frame
+        self.fixed_rotation = numpy.zeros((link_count, 3, 3))
+        self.fixed_translation = numpy.zeros((link_count, 3))
+        for index, link in enumerate(links):
+            rotation = numpy.array(link["RotArray"], dtype=numpy.float64).reshape(3, 3)
+            dh_rotation, dh_translation = dh_transform(link["a"], link["alpha"], link["d"], link["theta"])
+            self.fixed_rotation[index] = rotation @ dh_rotation
+            self.fixed_translation[index] = numpy.array(link["TransArray"], dtype=numpy.float64) \
+                + rotation @ dh_translation
+
+        # revolute joints
+        axes = [joint_axis(link["Rotation_Axis"]) for link in links]
+        self.joint_links = numpy.array([index for index, axis in enumerate(axes) if axis is not None],
+                                       dtype=numpy.intp)
+        self.num_joint = len(self.joint_links)
+        self.joint_of_link = numpy.full(link_count, -1, dtype=numpy.intp)
+        self.joint_of_link[self.joint_links] = numpy.arange(self.num_joint)
+
+        self.joint_axis = numpy.array([axes[link] for link in self.joint_links])
+        self.joint_axis_skew = skew(self.joint_axis)
+        self.joint_axis_skew_square = self.joint_axis_skew @ self.joint_axis_skew
+
+        # inertial and joint parameters
+        self.mass = numpy.array([link["mass"] for link in links], dtype=numpy.float64)
+        self.com = numpy.array([[link["COM_x"], link["COM_y"], link["COM_z"]] for link in links],
+                               dtype=numpy.float64)
+        self.inertia = numpy.array([
+            [[link["Inertia_xx"], link["Inertia_xy"], link["Inertia_xz"]],
+             [link["Inertia_xy"], link["Inertia_yy"], link["Inertia_yz"]],
+             [link["Inertia_xz"], link["Inertia_yz"], link["Inertia_zz"]]]
+            for link in links
+        ], dtype=numpy.float64)
+
+        joint_parameter = lambda key: numpy.array([links[link][key] for link in self.joint_links],
+                                                  dtype=numpy.float64)
+        self.joint_position_min = joint_parameter("Minimum_Joint_position")
+        self.joint_position_max = joint_parameter("Maxmum_Joint_position")
+        self.joint_speed_limit = joint_parameter("Joint_Speed_Limit")
+        self.torque_limit = joint_parameter("Torque_Limit")
+        self.gear_ratio = joint_parameter("Gear_Ratio")
+        self.rotor_inertia = joint_parameter("Motor_Rotor_Inertia")
+        self.viscous_friction = joint_parameter("Visous_Friction")
+        self.coulomb_friction = joint_parameter("Coulommb_Friction")
+
+    @classmethod
+    def from_file(cls, file_path: str):
+        with open(file_path) as f:
+            return cls(json.load(f))
+
+    def joint_rotations(self, joint_position: numpy.ndarray, joints: numpy.ndarray = slice(None)) -> numpy.ndarray:
+        """Rotations of the joints (..., joints) -> (..., joints, 3, 3), Rodrigues formula."""
+        s = numpy.sin(joint_position)[..., None, None]
+        c = numpy.cos(joint_position)[..., None, None]
+        return numpy.eye(3) + s * self.joint_axis_skew[joints] + (1 - c) * self.joint_axis_skew_square[joints]
+
+    def forward_kinematics(self, joint_position: numpy.ndarray) -> tuple[numpy.ndarray, numpy.ndarray]:
+        """
+        Poses of all links for a batch of joint positions (batch, num_joint) [rad], in the base frame.
+        Returns rotations (batch, link_count, 3, 3) and positions (batch, link_count, 3).
+        """
+        joint_position = numpy.atleast_2d(numpy.asarray(joint_position, dtype=numpy.float64))
+        batch = joint_position.shape[0]
+
+        local_rotation = numpy.broadcast_to(self.fixed_rotation, (batch, self.link_count, 3, 3)).copy()
+        local_rotation[:, self.joint_links] = self.fixed_rotation[self.joint_links] \
+            @ self.joint_rotations(joint_position)
+
+        rotations = numpy.empty((batch, self.link_count, 3, 3))
+        positions = numpy.empty((batch, self.link_count, 3))
+        rotations[:, 0] = local_rotation[:, 0]
+        positions[:, 0] = self.fixed_translation[0]
+
+        # one level of the tree at a time, all links of a level and all configurations at once
+        for level in self.levels:
+            parent = self.parent[level]
+            rotations[:, level] = rotations[:, parent] @ local_rotation[:, level]
+            positions[:, level] = positions[:, parent] \
+                + (rotations[:, parent] @ self.fixed_translation[level, :, None])[..., 0]
+
+        return rotations, positions
+
+
+@functools.lru_cache(maxsize=None)
+def load_model(file_path: str = os.path.join(DIR, "state_estimator", "model_gr1_t2.json")) -> RobotModel:
+    """Parse a model file once per process."""
+    return RobotModel.from_file(file_path)
+
+
+def leg_joint_position(joint_position_in_deg: numpy.ndarray, out: numpy.ndarray = None) -> numpy.ndarray:
+    """Joint positions of the model [rad] from the state joint positions [deg]."""
+    if out is None:
+        out = numpy.empty(len(LEG_JOINT_INDEX))
+    return numpy.deg2rad(numpy.take(joint_position_in_deg, LEG_JOINT_INDEX), out=out)
+
+
+class Kinematics:
+    """
+    Link poses of one configuration, updated every control cycle.
+
+    `update()` only recomputes the joint rotations of the joints that changed (by more than `tolerance`),
+    and the poses of the links below them, the other transforms are kept from the previous cycle.
+    All arrays are preallocated.
+    """
+
+    def __init__(self, model: RobotModel, foot_offset: numpy.ndarray = (0.0, 0.0, 0.0), tolerance: float = 0.0):
+        """foot_offset: sole point in the frame of the leaf (ankle) links"""
+        self.model = model
+        self.tolerance = tolerance
+        self.foot_links = model.leaf_links
+        self.foot_offset = numpy.array(foot_offset, dtype=numpy.float64)
+
+        self.joint_position = numpy.full(model.num_joint, numpy.nan)
+
+        # homogeneous transforms: one product per link, rotations and positions are views of them
+        self.local_transforms = numpy.zeros((model.link_count, 4, 4))
+        self.local_transforms[:, :3, :3] = model.fixed_rotation
+        self.local_transforms[:, :3, 3] = model.fixed_translation
+        self.local_transforms[:, 3, 3] = 1.0
+        self.local_rotation = self.local_transforms[:, :3, :3]
+        self.transforms = self.local_transforms.copy()
+        self.rotations = self.transforms[:, :3, :3]
+        self.positions = self.transforms[:, :3, 3]
+
+        # joint_descendant[i, j]: link j is the link of joint i or one of its descendants
+        self.joint_descendant = model.ancestor.T[model.joint_links].astype(numpy.float64)
+        self.changed_links = numpy.zeros(model.link_count, dtype=bool)
+        self._parent = model.parent.tolist()
+        self.update_count = 0
+
+        # one view per link, made once: indexing the arrays in the link loop costs more than the 4x4 products
+        self._transform_views = list(self.transforms)
+        self._local_transform_views = list(self.local_transforms)
+
+        # feet: joints moving each sole point, and the sole points of the jacobians
+        self._foot_joint_mask = model.ancestor[self.foot_links][:, model.joint_links].astype(numpy.float64)
+        self._foot_points = numpy.empty((len(self.foot_links), 3))
+
+    def update(self, joint_position: numpy.ndarray) -> bool:
+        """Update the poses for the joint positions [rad], returns False if no joint changed."""
+        model = self.model
+        changed = ~(numpy.abs(joint_position - self.joint_position) <= self.tolerance)
+        if not changed.any():
+            return False
+
+        self.joint_position[changed] = joint_position[changed]
+        changed_joint_links = model.joint_links[changed]
+        self.local_rotation[changed_joint_links] = model.fixed_rotation[changed_joint_links] \
+            @ model.joint_rotations(self.joint_position[changed], changed)
+
+        # the changed links and their descendants
+        numpy.greater(changed @ self.joint_descendant, 0, out=self.changed_links)
+        # link by link on views, cheaper than fancy indexing for a few links
+        transforms = self._transform_views
+        local_transforms = self._local_transform_views
+        parent = self._parent
+        for link in numpy.flatnonzero(self.changed_links).tolist():
+            numpy.matmul(transforms[parent[link]], local_transforms[link], out=transforms[link])
+
+        self.update_count += 1
+        return True
+
+    def foot_positions(self, out: numpy.ndarray = None) -> numpy.ndarray:
+        """Sole points of the feet in the base frame (feet, 3), written into `out` if given."""
+        out = numpy.matmul(self.rotations[self.foot_links], self.foot_offset, out=out)
+        out += self.positions[self.foot_links]
+        return out
+
+    def point_jacobians(self, links: numpy.ndarray, offset: numpy.ndarray = None,
+                        out: numpy.ndarray = None) -> numpy.ndarray:
+        """
+        Jacobians (links, 3, num_joint) of the velocity of a point of each link (offset in the link frame)
+        in the base frame, with respect to the joint velocities, written into `out` if given.
+        """
+        model = self.model
+        points = self.positions[links]
+        if offset is not None:
+            points += self.rotations[links] @ offset
+        return self._point_jacobians(points, model.ancestor[links][:, model.joint_links], out)
+
+    def _point_jacobians(self, points: numpy.ndarray, joint_mask: numpy.ndarray, out: numpy.ndarray = None):
+        # column j: axis_j x (point - origin_j), for the joints moving the point (joint_mask)
+        model = self.model
+        axes = (self.rotations[model.joint_links] @ model.joint_axis[:, :, None])[..., 0]
+        axes_skew = (axes @ SKEW_BASIS).reshape(model.num_joint, 3, 3)
+        lever = points[:, None, :, None] - self.positions[model.joint_links][:, :, None]
+        velocities = (axes_skew @ lever)[..., 0].transpose(0, 2, 1)
+        return numpy.multiply(velocities, joint_mask[:, None, :], out=out)
+
+    def point_jacobian(self, link: int, offset: numpy.ndarray = None) -> numpy.ndarray:
+        """Jacobian (3, num_joint) of a point of one link, see `point_jacobians()`."""
+        return self.point_jacobians(numpy.array([link]), offset)[0]
+
+    def foot_jacobians(self, out: numpy.ndarray = None) -> numpy.ndarray:
+        """Jacobians of the sole points (feet, 3, num_joint), written into `out` if given."""
+        return self._point_jacobians(self.foot_positions(out=self._foot_points), self._foot_joint_mask, out)
+
+
+if __name__ == "__main__":
+    import timeit
+
+    model = load_model()
+    kinematics = Kinematics(model)
+
+    # standing position of the demos
+    joint_position = numpy.array([0.0, 0.0, -0.2618, 0.5236, -0.2618, 0.0] * 2)
+    kinematics.update(joint_position)
+    print("foot positions [m] = \n", numpy.round(kinematics.foot_positions(), 4))
+
+    batch = numpy.random.default_rng(0).uniform(model.joint_position_min, model.joint_position_max,
+                                                (1000, model.num_joint))
+    number = 20
+    print("forward_kinematics (batch 1000) = ",
+          round(timeit.timeit(lambda: model.forward_kinematics(batch), number=number) / number * 1e3, 3), "ms")
+
+    def update_one_joint():
+        joint_position[3] += 1e-3
+        kinematics.update(joint_position)
+
+    def update_all_joints():
+        joint_position[:] += 1e-3
+        kinematics.update(joint_position)
+
+    number = 10000
+    print("Kinematics.update (1 joint changed) = ",
+          round(timeit.timeit(update_one_joint, number=number) / number * 1e6, 1), "us")
+    print("Kinematics.update (all joints changed) = ",
+          round(timeit.timeit(update_all_joints, number=number) / number * 1e6, 1), "us")
@@ -0,0 +1,126 @@
+"""
+Copyright (C) [2024] [Fourier Intelligence Ltd.]
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA
+"""
+
+import numpy
+import torch
+
+from rotation import projected_gravity
+
+
+class WalkObservation:
+    """
+    Preallocated actor observation of the walk policy.
+
+    All buffers are allocated once, `update()` writes the state of each cycle
+    into fixed slices of `observation` in-place, without allocating new tensors.
+
+    observation layout (num_actions = len(index_joint_controlled)):
+    - imu angular velocity [rad/s] (3)
+    - projected gravity (3)
+    - command (3)
+    - controlled joint position offset from default position [rad] (num_actions)
+    - controlled joint velocity [rad/s] (num_actions)
+    - last action (num_actions)
+    """
+
+    def __init__(self, index_joint_controlled: list[int], joint_default_position: torch.Tensor, num_joint: int = 32):
+        self.num_joint = num_joint
+        self.num_actions = len(index_joint_controlled)
+        self.num_obs = 9 + 3 * self.num_actions
+
+        self.index_joint_controlled = torch.tensor(index_joint_controlled, dtype=torch.long)
+        self.joint_default_position = joint_default_position.reshape(num_joint).to(torch.float32)
+        self.joint_default_position_controlled = \
+            torch.index_select(self.joint_default_position, 0, self.index_joint_controlled)
+
+        self.deg_to_rad = torch.pi / 180.0
+
+        # observation
+        self.observation = torch.zeros((1, self.num_obs), dtype=torch.float32)
+
+        observation = self.observation[0]
+        self.imu_angular_velocity = observation[0:3]
+        self.project_gravity = observation[3:6]
+        self.command = observation[6:9]
+        self.joint_position = observation[9:9 + self.num_actions]
+        self.joint_velocity = observation[9 + self.num_actions:9 + 2 * self.num_actions]
+        self.last_action = observation[9 + 2 * self.num_actions:9 + 3 * self.num_actions]
+
+        # numpy views share memory with the tensors, used to write python lists / numpy arrays without conversion
+        self._imu_angular_velocity_numpy = self.imu_angular_velocity.numpy()
+        self._project_gravity_numpy = self.project_gravity.numpy()
+        self._command_numpy = self.command.numpy()
+
+        self._imu_quat = numpy.array([0.0, 0.0, 0.0, 1.0])
+
+        self._joint_measured_position = torch.zeros(num_joint, dtype=torch.float32)
+        self._joint_measured_velocity = torch.zeros(num_joint, dtype=torch.float32)
+        self._joint_measured_position_numpy = self._joint_measured_position.numpy()
+        self._joint_measured_velocity_numpy = self._joint_measured_velocity.numpy()
+
+    def set_command(self, command: list[float]):
+        """Set the command (vx, vy, yaw rate), kept until set again."""
+        self._command_numpy[:] = command
+
+    def update(self,
+               imu_quat,
+               imu_angular_velocity,
+               joint_measured_position,
+               joint_measured_velocity) -> torch.Tensor:
+        """
+        Write the measured state into the observation.
+
+        Inputs are in the units of `robot_control_loop_get_state()`:
+        - imu_quat: (x, y, z, w)
+        - imu_angular_velocity: [deg/s]
+        - joint_measured_position: [deg]
+        - joint_measured_velocity: [deg/s]
+        """
+        # imu angular velocity, unit : rad/s
+        self._imu_angular_velocity_numpy[:] = imu_angular_velocity
+        self.imu_angular_velocity.mul_(self.deg_to_rad)
+
+        # project gravity
+        self._imu_quat[:] = imu_quat
+        projected_gravity(self._imu_quat, out=self._project_gravity_numpy)
+
+        # joint position offset, unit : rad
+        self._joint_measured_position_numpy[:] = joint_measured_position
+        torch.index_select(self._joint_measured_position, 0, self.index_joint_controlled, out=self.joint_position)
+        self.joint_position.mul_(self.deg_to_rad).sub_(self.joint_default_position_controlled)
+
+        # joint velocity, unit : rad/s
+        self._joint_measured_velocity_numpy[:] = joint_measured_velocity
+        torch.index_select(self._joint_measured_velocity, 0, self.index_joint_controlled, out=self.joint_velocity)
+        self.joint_velocity.mul_(self.deg_to_rad)
+
+        return self.observation
+
+    def update_from_state_dict(self, state_dict: dict) -> torch.Tensor:
+        """Write the state returned by `robot_control_loop_get_state()` into the observation."""
+        return self.update(state_dict["imu_quat"],
+                           state_dict["imu_angular_velocity"],
+                           state_dict["joint_position"],
+                           state_dict["joint_velocity"])
+
+    def reset_last_action(self):
+        """Set the last action to the current joint position offset, used before the first action."""
+        self.last_action.copy_(self.joint_position)
+
+    def update_last_action(self, action: torch.Tensor):
+        self.last_action.copy_(action.reshape(self.num_actions))
@@ -0,0 +1,416 @@
+"""
+Copyright (C) [2024] [Fourier Intelligence Ltd.]
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA
+"""
+
+import hashlib
+import os
+import tempfile
+import time
+
+import numpy
+
+from startup import lazy_import
+
+# imported on first use: loading a policy, not importing this module
+try:
+    torch = lazy_import("torch")
+except ImportError:
+    torch = None
+
+
+def file_hash(file_path: str) -> str:
+    """sha256 of the file content, used as cache key of the exported policy"""
+    sha256 = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def save_atomic(file_path: str, save):
+    """
+    Write a file with `save(f)` into a temporary file of the same directory, then rename it:
+    concurrent runs and interrupted exports never leave a partial file at `file_path`.
+    """
+    with tempfile.NamedTemporaryFile("wb", dir=os.path.dirname(file_path) or ".", delete=False) as f:
+        try:
+            save(f)
+        except BaseException:
+            f.close()
+            os.remove(f.name)
+            raise
+    os.replace(f.name, file_path)
+
+
+def numpy_elu_(x: numpy.ndarray, buffer: numpy.ndarray):
+    """in-place elu: x if x > 0 else exp(x) - 1, buffer has the shape of x"""
+    numpy.minimum(x, 0.0, out=buffer)
+    numpy.expm1(buffer, out=buffer)
+    numpy.maximum(x, 0.0, out=x)
+    x += buffer
+
+
+class NumpyMLP:
+    """
+    Pure numpy evaluator of an MLP actor: Linear -> ELU -> ... -> Linear.
+
+    Buffers are preallocated for `batch_size` rows, calling with the same batch size does not allocate.
+    """
+
+    def __init__(self, weights: list[numpy.ndarray], biases: list[numpy.ndarray], batch_size: int = 1):
+        # weights are stored transposed, so that y = x @ w + b
+        self.weights = [numpy.ascontiguousarray(w.T, dtype=numpy.float32) for w in weights]
+        self.biases = [numpy.ascontiguousarray(b, dtype=numpy.float32) for b in biases]
+        self.num_obs = self.weights[0].shape[0]
+        self.num_actions = self.weights[-1].shape[1]
+
+        self._allocate(batch_size)
+
+    def _allocate(self, batch_size: int):
+        self.batch_size = batch_size
+        self._outputs = [numpy.zeros((batch_size, w.shape[1]), dtype=numpy.float32) for w in self.weights]
+        self._negatives = [numpy.zeros((batch_size, w.shape[1]), dtype=numpy.float32) for w in self.weights[:-1]]
+
+    @classmethod
+    def load(cls, file_path: str, batch_size: int = 1):
+        data = numpy.load(file_path)
+        num_layers = len([key for key in data.files if key.startswith("weight_")])
+        return cls([data[f"weight_{i}"] for i in range(num_layers)],
+                   [data[f"bias_{i}"] for i in range(num_layers)],
+                   batch_size=batch_size)
+
+    def save(self, file_path: str):
+        arrays = {}
+        for i, (w, b) in enumerate(zip(self.weights, self.biases)):
+            arrays[f"weight_{i}"] = w.T
+            arrays[f"bias_{i}"] = b
+        save_atomic(file_path, lambda f: numpy.savez(f, **arrays))
+
+    def __call__(self, observation) -> numpy.ndarray:
+        x = numpy.asarray(observation, dtype=numpy.float32).reshape(-1, self.num_obs)
+        if x.shape[0] != self.batch_size:
+            self._allocate(x.shape[0])
+
+        num_layers = len(self.weights)
+        for i in range(num_layers):
+            y = self._outputs[i]
+            numpy.matmul(x, self.weights[i], out=y)
+            y += self.biases[i]
+
+            if i < num_layers - 1:
+                numpy_elu_(y, self._negatives[i])
+
+            x = y
+
+        return x
+
+
+def actor_layers_from_state_dict(state_dict: dict, prefix: str = "actor.") -> tuple[list, list]:
+    """Collect the linear layers of the actor from an ActorCriticMLP state dict, in module order."""
+    weights = []
+    biases = []
+    for key, value in state_dict.items():
+        if not key.startswith(prefix) or not key.endswith(".weight") or value.dim() != 2:
+            continue
+
+        bias_key = key[:-len(".weight")] + ".bias"
+        weights.append(value.detach().cpu().numpy())
+        biases.append(state_dict[bias_key].detach().cpu().numpy())
+
+    return weights, biases
+
+
+class PolicyRuntime:
+    """
+    Inference runtime of the actor of an ActorCriticMLP checkpoint.
+
+    On first use, only the actor is exported to TorchScript (traced and frozen, so the critic is dropped),
+    together with its weights as `.npz` for the numpy evaluator and PolicyEnsemble, each one exported again if missing.
+    The exported files are cached in `cache_dir`, keyed by the sha256 of the checkpoint and the architecture,
+    so later runs skip `torch.load()` and the model construction.
+
+    Inference runs under `torch.inference_mode()` with a fixed number of threads.
+    Without torch, an already exported `.npz` is evaluated by `NumpyMLP`: this is for tools that do not need torch,
+    the demos do need it (robot_rcs and `observation.py` import torch).
+    """
+
+    def __init__(self,
+                 model_file_path: str,
+                 num_actor_obs: int = 39,
+                 num_critic_obs: int = 168,
+                 num_actions: int = 10,
+                 actor_hidden_dims: list[int] = (512, 256, 128),
+                 critic_hidden_dims: list[int] = (512, 256, 128),
+                 num_threads: int = 1,
+                 cache_dir: str = None):
+        self.model_file_path = model_file_path
+        self.num_actor_obs = num_actor_obs
+        self.num_critic_obs = num_critic_obs
+        self.num_actions = num_actions
+        self.actor_hidden_dims = list(actor_hidden_dims)
+        self.critic_hidden_dims = list(critic_hidden_dims)
+        self.num_threads = num_threads
+
+        if cache_dir is None:
+            cache_dir = os.path.join(os.path.dirname(os.path.abspath(model_file_path)), ".policy_cache")
+        self.cache_dir = cache_dir
+
+        self.backend = None
+        self.module = None
+
+        time_start_of_load_in_s = time.perf_counter()
+        self.load()
+        self.load_time_in_s = time.perf_counter() - time_start_of_load_in_s
+
+    def _cache_file_path(self, extension: str) -> str:
+        model_name = os.path.splitext(os.path.basename(self.model_file_path))[0]
+        return os.path.join(self.cache_dir, model_name + "_" + self.cache_key[:16] + extension)
+
+    def load(self):
+        self.model_hash = file_hash(self.model_file_path)
+        # the same checkpoint exported with another architecture is another cached policy
+        architecture = (self.num_actor_obs, self.num_critic_obs, self.num_actions,
+                        tuple(self.actor_hidden_dims), tuple(self.critic_hidden_dims))
+        self.cache_key = hashlib.sha256((self.model_hash + repr(architecture)).encode()).hexdigest()
+        self.torchscript_file_path = torchscript_file_path = self._cache_file_path(".ts")
+        self.numpy_file_path = numpy_file_path = self._cache_file_path(".npz")
+
+        if torch is None:
+            if not os.path.exists(numpy_file_path):
+                raise RuntimeError(f"torch is not installed, and no exported policy found at {numpy_file_path}")
+
+            self.module = NumpyMLP.load(numpy_file_path)
+            self.backend = "numpy"
+            return
+
+        torch.set_num_threads(self.num_threads)
+
+        if not os.path.exists(torchscript_file_path):
+            self.export(torchscript_file_path, numpy_file_path)
+
+        self.module = torch.jit.load(torchscript_file_path, map_location=torch.device("cpu"))
+        self.module.eval()
+        self.backend = "torchscript"
+
+        # a cache without the numpy weights (deleted, or exported by an older version) is completed,
+        # with the checkpoint only, the TorchScript module is not exported again
+        if not os.path.exists(numpy_file_path):
+            model = torch.load(self.model_file_path, map_location=torch.device("cpu"))
+            self.export_numpy(model["model_state_dict"], self.module, numpy_file_path)
+
+    def export(self, torchscript_file_path: str, numpy_file_path: str):
+        from robot_rcs.rl.rl_actor_critic_mlp import ActorCriticMLP
+
+        print("PolicyRuntime export model_file_path = ", self.model_file_path)
+
+        model = torch.load(self.model_file_path, map_location=torch.device("cpu"))
+        model_actor_dict = model["model_state_dict"]
+
+        actor_critic = ActorCriticMLP(num_actor_obs=self.num_actor_obs,
+                                      num_critic_obs=self.num_critic_obs,
+                                      num_actions=self.num_actions,
+                                      actor_hidden_dims=self.actor_hidden_dims,
+                                      critic_hidden_dims=self.critic_hidden_dims)
+        actor_critic.load_state_dict(model_actor_dict)
+        actor_critic.eval()
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        # torchscript, only the ops of the forward pass (the actor) are kept after freezing
+        example_observation = torch.zeros((1, self.num_actor_obs), dtype=torch.float32)
+        with torch.no_grad():
+            traced = torch.jit.trace(actor_critic, example_observation)
+            frozen = torch.jit.freeze(traced)
+        save_atomic(torchscript_file_path, lambda f: torch.jit.save(frozen, f))
+
+        self.export_numpy(model_actor_dict, frozen, numpy_file_path)
+
+    def export_numpy(self, model_actor_dict: dict, module, numpy_file_path: str):
+        """Export the numpy weights of the actor, only saved if they reproduce the output of the torch module."""
+        weights, biases = actor_layers_from_state_dict(model_actor_dict)
+        if len(weights) == 0:
+            print("PolicyRuntime actor layers not found, numpy weights are not exported")
+            return
+
+        numpy_actor = NumpyMLP(weights, biases)
+        test_observation = torch.randn((1, self.num_actor_obs), dtype=torch.float32)
+        with torch.no_grad():
+            torch_action = module(test_observation).numpy()
+
+        numpy_action = numpy_actor(test_observation.numpy())
+        if numpy.allclose(torch_action, numpy_action, atol=1e-4):
+            numpy_actor.save(numpy_file_path)
+        else:
+            print("PolicyRuntime numpy actor does not match the torch actor, numpy weights are not exported")
+
+    def __call__(self, observation):
+        if self.backend == "numpy":
+            if torch is not None and isinstance(observation, torch.Tensor):
+                observation = observation.numpy()
+            return self.module(observation)
+
+        with torch.inference_mode():
+            return self.module(observation)
+
+    def warm_up(self, num_iterations: int = 50) -> numpy.ndarray:
+        """
+        Run inference on dummy observations, so that lazy initialization (TorchScript profiling and optimization,
+        thread pools, memory allocation) is done before the control loop starts.
+
+        Return the duration of each warm-up inference [s].
+        """
+        return warm_up(self, self.backend, self.num_actor_obs, num_iterations)
+
+
+def warm_up(policy, backend: str, num_actor_obs: int, num_iterations: int) -> numpy.ndarray:
+    if backend == "numpy":
+        observation = numpy.zeros((1, num_actor_obs), dtype=numpy.float32)
+    else:
+        observation = torch.zeros((1, num_actor_obs), dtype=torch.float32)
+
+    durations_in_s = numpy.zeros(num_iterations)
+    for i in range(num_iterations):
+        time_start_in_s = time.perf_counter()
+        policy(observation)
+        durations_in_s[i] = time.perf_counter() - time_start_in_s
+
+    return durations_in_s
+
+
+class PolicyEnsemble:
+    """
+    Several actors evaluated in one batched forward pass per control cycle.
+
+    The actors must share the same MLP architecture, their exported weights (see `PolicyRuntime`)
+    are stacked into (num_policies, num_input, num_output) arrays, and all actions are computed with one
+    batched matmul per layer, instead of one forward pass per policy.
+
+    `__call__()` returns the action that drives the robot, chosen by `select()` or mixed by `blend()`,
+    all actions of the last call are kept in `actions`, e.g. for shadow testing a new policy.
+    """
+
+    def __init__(self, runtimes: list[PolicyRuntime]):
+        if len(runtimes) == 0:
+            raise ValueError("PolicyEnsemble needs at least one policy")
+
+        self.runtimes = list(runtimes)
+        self.num_policies = len(self.runtimes)
+        self.load_time_in_s = sum(runtime.load_time_in_s for runtime in self.runtimes)
+        self.num_actor_obs = self.runtimes[0].num_actor_obs
+        self.num_actions = self.runtimes[0].num_actions
+
+        for runtime in self.runtimes:
+            if not os.path.exists(runtime.numpy_file_path):
+                raise RuntimeError(f"PolicyEnsemble exported actor weights not found for {runtime.model_file_path} "
+                                   f"(the actor could not be exported to numpy, see the export messages)")
+
+        layers = [NumpyMLP.load(runtime.numpy_file_path) for runtime in self.runtimes]
+        for layer in layers[1:]:
+            if [w.shape for w in layer.weights] != [w.shape for w in layers[0].weights]:
+                raise ValueError("PolicyEnsemble policies should have the same actor architecture")
+
+        # (num_policies, num_input, num_output) and (num_policies, 1, num_output)
+        weights = [numpy.stack([layer.weights[i] for layer in layers])
+                   for i in range(len(layers[0].weights))]
+        biases = [numpy.stack([layer.biases[i] for layer in layers])[:, None, :]
+                  for i in range(len(layers[0].biases))]
+
+        self.backend = "numpy" if torch is None else "torch"
+        if self.backend == "torch":
+            self.weights = [torch.from_numpy(w) for w in weights]
+            self.biases = [torch.from_numpy(b) for b in biases]
+            self.observations = torch.zeros((self.num_policies, 1, self.num_actor_obs), dtype=torch.float32)
+            self._outputs = [torch.zeros((self.num_policies, 1, w.shape[2]), dtype=torch.float32)
+                             for w in self.weights]
+            self.blend_weights = torch.zeros((self.num_policies, 1, 1), dtype=torch.float32)
+            self._weighted_actions = torch.zeros((self.num_policies, 1, self.num_actions), dtype=torch.float32)
+            self.action = torch.zeros((1, self.num_actions), dtype=torch.float32)
+        else:
+            self.weights = weights
+            self.biases = biases
+            self.observations = numpy.zeros((self.num_policies, 1, self.num_actor_obs), dtype=numpy.float32)
+            self._outputs = [numpy.zeros((self.num_policies, 1, w.shape[2]), dtype=numpy.float32)
+                             for w in self.weights]
+            self._negatives = [numpy.zeros_like(output) for output in self._outputs[:-1]]
+            self.blend_weights = numpy.zeros((self.num_policies, 1, 1), dtype=numpy.float32)
+            self._weighted_actions = numpy.zeros((self.num_policies, 1, self.num_actions), dtype=numpy.float32)
+            self.action = numpy.zeros((1, self.num_actions), dtype=numpy.float32)
+
+        self.actions = self._outputs[-1]
+        self.select(0)
+
+    def warm_up(self, num_iterations: int = 50) -> numpy.ndarray:
+        """Run the batched inference on dummy observations, return the duration of each inference [s]."""
+        return warm_up(self, self.backend, self.num_actor_obs, num_iterations)
+
+    def select(self, index: int):
+        """Drive the robot with the action of one policy."""
+        self.blend_weights[:] = 0.0
+        self.blend_weights[index] = 1.0
+
+    def blend(self, weights: list[float]):
+        """Drive the robot with the weighted sum of the actions of all policies."""
+        if len(weights) != self.num_policies:
+            raise ValueError(f"blend weights should have {self.num_policies} values, got {len(weights)}")
+
+        for i, weight in enumerate(weights):
+            self.blend_weights[i] = weight
+
+    def evaluate(self, observation):
+        """
+        Compute the actions of all policies.
+
+        observation is (1, num_actor_obs), shared by all policies,
+        or (num_policies, 1, num_actor_obs), one per policy.
+        """
+        if self.backend == "torch":
+            with torch.inference_mode():
+                self.observations.copy_(observation.reshape(-1, 1, self.num_actor_obs).expand_as(self.observations))
+
+                x = self.observations
+                for i in range(len(self.weights)):
+                    y = self._outputs[i]
+                    torch.baddbmm(self.biases[i], x, self.weights[i], out=y)
+                    if i < len(self.weights) - 1:
+                        torch.nn.functional.elu_(y)
+                    x = y
+        else:
+            self.observations[:] = numpy.asarray(observation).reshape(-1, 1, self.num_actor_obs)
+
+            x = self.observations
+            for i in range(len(self.weights)):
+                y = self._outputs[i]
+                numpy.matmul(x, self.weights[i], out=y)
+                y += self.biases[i]
+                if i < len(self.weights) - 1:
+                    numpy_elu_(y, self._negatives[i])
+                x = y
+
+        return self.actions
+
+    def __call__(self, observation):
+        actions = self.evaluate(observation)
+
+        if self.backend == "torch":
+            with torch.inference_mode():
+                torch.mul(actions, self.blend_weights, out=self._weighted_actions)
+                torch.sum(self._weighted_actions, dim=0, out=self.action)
+        else:
+            numpy.multiply(actions, self.blend_weights, out=self._weighted_actions)
+            numpy.sum(self._weighted_actions, axis=0, out=self.action)
+
+        return self.action
@@ -0,0 +1,212 @@
+"""
+Copyright (C) [2024] [Fourier Intelligence Ltd.]
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA
+"""
+
+import atexit
+import signal
+import sys
+import time
+
+import numpy
+
+
+class LatencyHistogram:
+    """
+    HDR style histogram of durations in nanoseconds.
+
+    Values below 2 ** sub_bucket_bits are counted exactly,
+    larger values are counted in log-linear buckets with a relative error below 2 ** -(sub_bucket_bits - 1).
+    All memory is allocated at construction, `record()` never allocates.
+    """
+
+    def __init__(self, sub_bucket_bits: int = 7, max_value_bits: int = 40):
+        self.sub_bucket_bits = sub_bucket_bits
+        self.sub_bucket_count = 1 << sub_bucket_bits
+        self.sub_bucket_half_count = self.sub_bucket_count >> 1
+        self.max_value = (1 << max_value_bits) - 1
+
+        bucket_count = max_value_bits - sub_bucket_bits
+        self.counts = numpy.zeros(self.sub_bucket_count + bucket_count * self.sub_bucket_half_count,
+                                  dtype=numpy.int64)
+        self.total_count = 0
+        self.min_value = 0
+        self.max_recorded_value = 0
+
+    def reset(self):
+        self.counts[:] = 0
+        self.total_count = 0
+        self.min_value = 0
+        self.max_recorded_value = 0
+
+    def _index_of(self, value: int) -> int:
+        if value < self.sub_bucket_count:
+            return value
+
+        shift = value.bit_length() - self.sub_bucket_bits
+        return self.sub_bucket_count \
+            + (shift - 1) * self.sub_bucket_half_count \
+            + (value >> shift) - self.sub_bucket_half_count
+
+    def _value_of(self, index: int) -> int:
+        """Return the highest value counted in the bucket at index."""
+        if index < self.sub_bucket_count:
+            return index
+
+        shift = (index - self.sub_bucket_count) // self.sub_bucket_half_count + 1
+        sub_index = (index - self.sub_bucket_count) % self.sub_bucket_half_count + self.sub_bucket_half_count
+        return ((sub_index + 1) << shift) - 1
+
+    def record(self, value: int):
+        if value < 0:
+            value = 0
+        elif value > self.max_value:
+            value = self.max_value
+
+        self.counts[self._index_of(value)] += 1
+
+        if self.total_count == 0 or value < self.min_value:
+            self.min_value = value
+        if value > self.max_recorded_value:
+            self.max_recorded_value = value
+
+        self.total_count += 1
+
+    def percentile(self, percentile: float) -> int:
+        if self.total_count == 0:
+            return 0
+
+        count_at_percentile = max(int(numpy.ceil(percentile / 100.0 * self.total_count)), 1)
+        index = int(numpy.searchsorted(numpy.cumsum(self.counts), count_at_percentile))
+        return min(self._value_of(index), self.max_recorded_value)
+
+
+class LoopProfiler:
+    """
+    Per cycle latency instrumentation for the robot control loop.
+
+    Each cycle is split into stages by calling `lap()` after every stage:
+
+        profiler.start()
+        state_dict = ControlSystem().robot_control_loop_get_state()
+        profiler.lap()  # stage 0
+        joint_target_position = algorithm(...)
+        profiler.lap()  # stage 1
+        ControlSystem().robot_control_loop_set_control(control_dict)
+        profiler.lap()  # stage 2
+        profiler.stop()
+
+    Stage durations, the cycle duration and the start-to-start period of the last `capacity` cycles
+    are kept in a preallocated ring buffer, and every value is counted in a `LatencyHistogram`.
+    A cycle longer than `period_in_s` is counted as a deadline miss.
+    """
+
+    def __init__(self, stage_names: list[str], period_in_s: float, capacity: int = 10000):
+        self.stage_names = list(stage_names)
+        self.period_in_ns = int(round(period_in_s * 1e9))
+        self.capacity = capacity
+
+        # columns: stages..., cycle, period
+        self.column_names = self.stage_names + ["cycle", "period"]
+        self.index_cycle = len(self.stage_names)
+        self.index_period = len(self.stage_names) + 1
+
+        self.ring_buffer = numpy.zeros((capacity, len(self.column_names)), dtype=numpy.int64)
+        self.histograms = [LatencyHistogram() for _ in self.column_names]
+
+        self.cycle_count = 0
+        self.deadline_miss_count = 0
+
+        self._row = self.ring_buffer[0]
+        self._stage_index = 0
+        self._time_start_in_ns = 0
+        self._time_lap_in_ns = 0
+        self._time_last_start_in_ns = None
+
+    def start(self):
+        time_now_in_ns = time.perf_counter_ns()
+
+        self._row = self.ring_buffer[self.cycle_count % self.capacity]
+        self._stage_index = 0
+
+        if self._time_last_start_in_ns is not None:
+            period_in_ns = time_now_in_ns - self._time_last_start_in_ns
+            self._row[self.index_period] = period_in_ns
+            self.histograms[self.index_period].record(period_in_ns)
+        else:
+            self._row[self.index_period] = 0
+
+        self._time_last_start_in_ns = time_now_in_ns
+        self._time_start_in_ns = time_now_in_ns
+        self._time_lap_in_ns = time_now_in_ns
+
+    def lap(self):
+        time_now_in_ns = time.perf_counter_ns()
+
+        stage_in_ns = time_now_in_ns - self._time_lap_in_ns
+        self._row[self._stage_index] = stage_in_ns
+        self.histograms[self._stage_index].record(stage_in_ns)
+
+        self._stage_index += 1
+        self._time_lap_in_ns = time_now_in_ns
+
+    def stop(self):
+        cycle_in_ns = time.perf_counter_ns() - self._time_start_in_ns
+        self._row[self.index_cycle] = cycle_in_ns
+        self.histograms[self.index_cycle].record(cycle_in_ns)
+
+        if cycle_in_ns > self.period_in_ns:
+            self.deadline_miss_count += 1
+
+        self.cycle_count += 1
+
+    def recent(self) -> numpy.ndarray:
+        """Return a copy of the ring buffer rows, from the oldest to the newest cycle."""
+        if self.cycle_count < self.capacity:
+            return self.ring_buffer[:self.cycle_count].copy()
+
+        index = self.cycle_count % self.capacity
+        return numpy.concatenate((self.ring_buffer[index:], self.ring_buffer[:index]))
+
+    def report(self) -> str:
+        lines = [
+            "LoopProfiler: cycles = " + str(self.cycle_count)
+            + ", period = " + str(round(self.period_in_ns / 1e6, 3)) + " ms"
+            + ", deadline miss = " + str(self.deadline_miss_count),
+            "{:<16}{:>12}{:>12}{:>12}{:>12}{:>12}".format("[ms]", "min", "p50", "p99", "p99.9", "max"),
+        ]
+
+        for name, histogram in zip(self.column_names, self.histograms):
+            values_in_ns = [
+                histogram.min_value,
+                histogram.percentile(50),
+                histogram.percentile(99),
+                histogram.percentile(99.9),
+                histogram.max_recorded_value,
+            ]
+            lines.append("{:<16}".format(name) + "".join("{:>12.3f}".format(v / 1e6) for v in values_in_ns))
+
+        return "\n".join(lines)
+
+    def dump(self, *args):
+        print(self.report(), file=sys.stderr, flush=True)
+
+    def install_dump_handlers(self):
+        """Dump the report at exit, and on SIGUSR1 (`kill -USR1 <pid>`) where supported."""
+        atexit.register(self.dump)
+
+        if hasattr(signal, "SIGUSR1"):
+            signal.signal(signal.SIGUSR1, self.dump)
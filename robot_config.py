@@ -0,0 +1,333 @@
+"""
+Copyright (C) [2024] [Fourier Intelligence Ltd.]
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA
+"""
+
+"""
+Parsed, validated and cached robot config: the rcs config (`config/config_GR1_T*.yaml`),
+the sensor offsets of its absolute encoders (`sensor_offset.json`) and its state estimator model (`state_estimator/`).
+
+`load_config()` returns an immutable `RobotConfig`, validated against `JointIndex`:
+- one actuator IP (and comm flag) per joint, no duplicate
+- one absolute encoder IP per leg and waist joint, and one sensor offset per encoder
+- one model joint per leg joint
+
+The first load parses the files, and saves a pickle snapshot in `data/.config_cache` (gitignored),
+keyed by the config path and the working directory, and checked against the modification time and size
+of every source file, and against a hash of the code that parses and holds the config (CODE_SOURCES).
+The next processes load the snapshot instead, without importing yaml nor parsing anything.
+
+This is for the demos of the repository root (state estimator model, and `--check-config` to fail fast
+on an invalid config). The control system selection only reads a few items with `read_control_system()`,
+without any validation, so that a demo never stops on a check it does not need.
+The robot_rcs SDK still reads the config by itself,
+and so do the zenoh scripts, which are self-contained and have their own config directory.
+"""
+
+import dataclasses
+import functools
+import hashlib
+import os
+import pickle
+import tempfile
+
+import numpy
+
+from kinematics import LEG_JOINT_INDEX, RobotModel
+from utils import JointIndex
+
+DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.path.join(DIR, "data", ".config_cache")
+
+# format of the snapshot file
+CACHE_VERSION = 2
+
+# the snapshot holds instances of their classes, validated by their code: a change of their source discards it
+CODE_SOURCES = [os.path.join(DIR, name) for name in ("robot_config.py", "kinematics.py", "utils.py")]
+
+ENCODER_JOINT_INDEX = [joint for joint in JointIndex if joint.name.startswith(("L_LEG", "R_LEG", "WAIST"))]
+
+
+@dataclasses.dataclass(frozen=True)
+class RobotConfig:
+    file_path: str
+    name: str
+    mechanism: str
+    control_period: float
+    device_connected: bool
+    use_sim: bool
+
+    # one per joint, in JointIndex order
+    actuator_ip: tuple[str, ...]
+    actuator_comm_enable: tuple[bool, ...]
+    actuator_comm_use_fast: tuple[bool, ...]
+
+    # one per leg and waist joint, sensor offsets [deg] in the same order (None without a sensor offset file)
+    encoder_ip: tuple[str, ...]
+    sensor_offset_path: str
+    sensor_offset: tuple[float, ...] | None
+
+    state_estimator_enable: bool
+    state_estimator_path: str | None
+    model: RobotModel | None
+
+    @property
+    def simulated(self) -> bool:
+        """The config selects the simulation (`device_connected: false` or `comm.use_sim: true`)."""
+        return not self.device_connected or self.use_sim
+
+    def sensor_offset_dict(self) -> dict:
+        """Sensor offsets keyed by encoder IP, as in `sensor_offset.json`."""
+        return dict(zip(self.encoder_ip, self.sensor_offset)) if self.sensor_offset is not None else {}
+
+
+@dataclasses.dataclass(frozen=True)
+class ControlSystemConfig:
+    """The items of the rcs config that select and set up the control system, not validated."""
+
+    file_path: str
+    name: str
+    mechanism: str
+    control_period: float
+    simulated: bool
+
+
+def read_control_system(file_path: str) -> ControlSystemConfig:
+    """Read the control system items of the config, without the cache nor any validation."""
+    import yaml
+
+    file_path = os.path.abspath(file_path)
+    with open(file_path) as f:
+        raw = yaml.safe_load(f) or {}
+
+    robot = raw.get("robot", {})
+    return ControlSystemConfig(
+        file_path=file_path,
+        name=str(robot.get("name", "GR1")),
+        mechanism=str(robot.get("mechanism", "T2")),
+        control_period=float(robot.get("control_period", 0.01)),
+        simulated=not raw.get("device_connected", True) or bool(raw.get("comm", {}).get("use_sim", False)),
+    )
+
+
+def _resolve(path: str) -> str:
+    # relative paths: to the working directory (as the SDK), else to the repository root, even with a leading "/"
+    for candidate in (os.path.abspath(path), os.path.abspath(path.lstrip("/"))):
+        if os.path.exists(candidate):
+            return candidate
+    return os.path.join(DIR, path.lstrip("/"))
+
+
+def _freeze(model: RobotModel) -> RobotModel:
+    for value in vars(model).values():
+        if isinstance(value, numpy.ndarray):
+            value.flags.writeable = False
+    return model
+
+
+def _check_ips(name: str, ips: list, count: int, errors: list[str]):
+    if len(ips) != count:
+        errors.append(f"{name} should have {count} items, got {len(ips)}")
+    duplicates = sorted({ip for ip in ips if ips.count(ip) > 1})
+    if duplicates:
+        errors.append(f"{name} has duplicate IPs: {', '.join(duplicates)}")
+
+
+def parse_config(file_path: str) -> tuple[RobotConfig, list[str]]:
+    """
+    Parse and validate the config and the files it refers to, without the cache.
+    Returns the config and the source files, raises ValueError listing every problem found.
+    """
+    import json
+
+    import yaml
+
+    file_path = os.path.abspath(file_path)
+    with open(file_path) as f:
+        raw = yaml.safe_load(f) or {}
+
+    errors = []
+    sources = [file_path]
+
+    robot = raw.get("robot", {})
+    actuator = raw.get("actuator", {})
+    encoder = raw.get("sensor_abs_encoder", {})
+    state_estimator = robot.get("state_estimator", {})
+
+    control_period = float(robot.get("control_period", 0.01))
+    if not control_period > 0:
+        errors.append(f"robot.control_period should be positive, got {control_period}")
+
+    actuator_ip = [str(ip) for ip in actuator.get("ip", [])]
+    _check_ips("actuator.ip", actuator_ip, len(JointIndex), errors)
+    actuator_comm_enable = [bool(value) for value in actuator.get("comm_enable", [True] * len(actuator_ip))]
+    actuator_comm_use_fast = [bool(value) for value in actuator.get("comm_use_fast", [False] * len(actuator_ip))]
+    for name, values in (("actuator.comm_enable", actuator_comm_enable),
+                         ("actuator.comm_use_fast", actuator_comm_use_fast)):
+        if len(values) != len(actuator_ip):
+            errors.append(f"{name} should have one item per actuator IP ({len(actuator_ip)}), got {len(values)}")
+
+    encoder_ip = [str(ip) for ip in encoder.get("ip", [])]
+    _check_ips("sensor_abs_encoder.ip", encoder_ip, len(ENCODER_JOINT_INDEX), errors)
+
+    # sensor offsets: optional, written by demo_set_home.py
+    sensor_offset_path = _resolve(encoder.get("data_path", "sensor_offset.json"))
+    sensor_offset = None
+    if os.path.exists(sensor_offset_path):
+        sources.append(sensor_offset_path)
+        with open(sensor_offset_path) as f:
+            offset_dict = json.load(f)
+        missing = [ip for ip in encoder_ip if ip not in offset_dict]
+        if missing:
+            errors.append(f"{sensor_offset_path} has no offset for the encoders {', '.join(missing)}")
+        else:
+            sensor_offset = tuple(float(offset_dict[ip]) for ip in encoder_ip)
+            if not numpy.all(numpy.isfinite(sensor_offset)):
+                errors.append(f"{sensor_offset_path} has non finite offsets")
+
+    # state estimator model
+    state_estimator_path = None
+    model = None
+    if state_estimator.get("path"):
+        state_estimator_path = _resolve(state_estimator["path"])
+        if not os.path.exists(state_estimator_path):
+            errors.append(f"robot.state_estimator.path {state_estimator_path} does not exist")
+        else:
+            sources.append(state_estimator_path)
+            model = _freeze(RobotModel.from_file(state_estimator_path))
+            if model.num_joint != len(LEG_JOINT_INDEX):
+                errors.append(f"{state_estimator_path} should have {len(LEG_JOINT_INDEX)} joints, "
+                              f"got {model.num_joint}")
+
+    if errors:
+        raise ValueError(f"invalid config {file_path}:\n" + "\n".join("- " + error for error in errors))
+
+    config = RobotConfig(
+        file_path=file_path,
+        name=str(robot.get("name", "GR1")),
+        mechanism=str(robot.get("mechanism", "T2")),
+        control_period=control_period,
+        device_connected=bool(raw.get("device_connected", True)),
+        use_sim=bool(raw.get("comm", {}).get("use_sim", False)),
+        actuator_ip=tuple(actuator_ip),
+        actuator_comm_enable=tuple(actuator_comm_enable),
+        actuator_comm_use_fast=tuple(actuator_comm_use_fast),
+        encoder_ip=tuple(encoder_ip),
+        sensor_offset_path=sensor_offset_path,
+        sensor_offset=sensor_offset,
+        state_estimator_enable=bool(state_estimator.get("enable", False)),
+        state_estimator_path=state_estimator_path,
+        model=model,
+    )
+    return config, sources
+
+
+def _source_keys(sources: list[str]) -> list[tuple] | None:
+    try:
+        stats = [os.stat(path) for path in sources]
+    except OSError:
+        return None
+    return [(path, stat.st_mtime_ns, stat.st_size) for path, stat in zip(sources, stats)]
+
+
+@functools.lru_cache(maxsize=None)
+def _code_hash() -> str:
+    digest = hashlib.sha256()
+    for path in CODE_SOURCES:
+        with open(path, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def _cache_file_path(file_path: str, cache_dir: str) -> str:
+    # the relative paths of the config depend on the working directory
+    key = hashlib.sha256((file_path + "\n" + os.getcwd()).encode()).hexdigest()[:16]
+    return os.path.join(cache_dir, os.path.splitext(os.path.basename(file_path))[0] + "_" + key + ".pickle")
+
+
+def _load_snapshot(cache_file_path: str) -> RobotConfig | None:
+    try:
+        with open(cache_file_path, "rb") as f:
+            snapshot = pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+        return None
+
+    if snapshot.get("version") != CACHE_VERSION or snapshot.get("code") != _code_hash():
+        return None
+    # a new or removed sensor offset file changes the sources too: the config lists it
+    sources = [key[0] for key in snapshot["sources"]]
+    if _source_keys(sources) != snapshot["sources"] \
+            or (snapshot["config"].sensor_offset is None and os.path.exists(snapshot["config"].sensor_offset_path)):
+        return None
+
+    config = snapshot["config"]
+    if config.model is not None:
+        _freeze(config.model)
+    return config
+
+
+def _save_snapshot(cache_file_path: str, config: RobotConfig, sources: list[str]):
+    keys = _source_keys(sources)
+    if keys is None:
+        return
+    snapshot = {"version": CACHE_VERSION, "code": _code_hash(), "sources": keys, "config": config}
+
+    # atomic, so that concurrent processes never read half a snapshot,
+    # and a read-only file system only costs the parsing
+    try:
+        os.makedirs(os.path.dirname(cache_file_path), exist_ok=True)
+        with tempfile.NamedTemporaryFile("wb", dir=os.path.dirname(cache_file_path), delete=False) as f:
+            pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(f.name, cache_file_path)
+    except OSError:
+        pass
+
+
+@functools.lru_cache(maxsize=None)
+def load_config(file_path: str, cache_dir: str = CACHE_DIR) -> RobotConfig:
+    """Parsed and validated config, from the snapshot if it is up to date, once per process."""
+    file_path = os.path.abspath(file_path)
+    cache_file_path = _cache_file_path(file_path, cache_dir)
+
+    config = _load_snapshot(cache_file_path)
+    if config is None:
+        config, sources = parse_config(file_path)
+        _save_snapshot(cache_file_path, config, sources)
+    return config
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    file_path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(DIR, "config", "config_GR1_T2.yaml")
+
+    start = time.perf_counter()
+    config, _ = parse_config(file_path)
+    parse_time_in_s = time.perf_counter() - start
+
+    load_config(file_path)
+    load_config.cache_clear()
+    start = time.perf_counter()
+    load_config(file_path)
+    snapshot_time_in_s = time.perf_counter() - start
+
+    print(f"{config.name}-{config.mechanism}: control period = {config.control_period}s, "
+          f"{len(config.actuator_ip)} actuators, {len(config.encoder_ip)} encoders, "
+          f"sensor offsets = {config.sensor_offset is not None}, "
+          f"model joints = {config.model.num_joint if config.model is not None else None}")
+    print("parse = ", round(parse_time_in_s * 1e3, 2), "ms (yaml already imported)")
+    print("load from the snapshot = ", round(snapshot_time_in_s * 1e3, 2), "ms")
@@ -0,0 +1,288 @@
+"""
+Copyright (C) [2024] [Fourier Intelligence Ltd.]
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA
+"""
+
+"""
+Batched quaternion and rotation math, for numpy arrays and torch tensors.
+
+Convention:
+- quaternion: (x, y, z, w), same as `imu_quat` from `robot_control_loop_get_state()`, shape (..., 4)
+- vector: shape (..., 3)
+- euler angle: (roll, pitch, yaw) [rad], rotation order z-y-x (yaw, then pitch, then roll), shape (..., 3)
+
+All functions accept an optional preallocated `out` (which may be one of the inputs),
+and work the same on numpy arrays and torch tensors.
+"""
+
+import sys
+
+import numpy
+
+
+def _is_torch(value) -> bool:
+    # by the type of the value only: torch is never imported here (slow startup),
+    # nor touched, it may be a lazy module (policy_runtime.py) that would import on first access
+    module = type(value).__module__
+    return module == "torch" or module.startswith("torch.")
+
+
+def _empty(like, shape):
+    if _is_torch(like):
+        return sys.modules["torch"].empty(shape, dtype=like.dtype, device=like.device)
+    return numpy.empty(shape, dtype=numpy.result_type(like, numpy.float32))
+
+
+def _check_shape(value, size: int, name: str):
+    if value.shape[-1] != size:
+        raise ValueError(f"{name} should have shape (..., {size}), got {tuple(value.shape)}")
+
+
+def check_quat(q, atol: float = 1e-3):
+    """
+    Check that q is a batch of unit quaternions in (x, y, z, w) convention.
+
+    A quaternion from a (w, x, y, z) source is also a unit quaternion, so this can not catch every swap,
+    but it catches wrong shapes, non-normalized and non-finite values.
+    """
+    _check_shape(q, 4, "quaternion")
+
+    if _is_torch(q):
+        torch = sys.modules["torch"]
+        norm = torch.linalg.norm(q, dim=-1)
+        finite = bool(torch.isfinite(q).all())
+        normalized = bool(torch.all(torch.abs(norm - 1.0) <= atol))
+    else:
+        q = numpy.asarray(q)
+        norm = numpy.linalg.norm(q, axis=-1)
+        finite = bool(numpy.isfinite(q).all())
+        normalized = bool(numpy.all(numpy.abs(norm - 1.0) <= atol))
+
+    if not finite:
+        raise ValueError("quaternion should be finite")
+    if not normalized:
+        raise ValueError(f"quaternion should be normalized (x, y, z, w), got norm {norm}")
+
+
+def quat_multiply(a, b, out=None):
+    """Hamilton product a * b."""
+    _check_shape(a, 4, "quaternion")
+    _check_shape(b, 4, "quaternion")
+
+    ax, ay, az, aw = a[..., 0], a[..., 1], a[..., 2], a[..., 3]
+    bx, by, bz, bw = b[..., 0], b[..., 1], b[..., 2], b[..., 3]
+
+    x = aw * bx + ax * bw + ay * bz - az * by
+    y = aw * by - ax * bz + ay * bw + az * bx
+    z = aw * bz + ax * by - ay * bx + az * bw
+    w = aw * bw - ax * bx - ay * by - az * bz
+
+    if out is None:
+        out = _empty(a, tuple(x.shape) + (4,))
+    out[..., 0] = x
+    out[..., 1] = y
+    out[..., 2] = z
+    out[..., 3] = w
+    return out
+
+
+def quat_conjugate(q, out=None):
+    _check_shape(q, 4, "quaternion")
+
+    if out is None:
+        out = _empty(q, tuple(q.shape))
+    out[..., 0:3] = -q[..., 0:3]
+    out[..., 3] = q[..., 3]
+    return out
+
+
+def _rotate(q, v, sign: float, out):
+    _check_shape(q, 4, "quaternion")
+    _check_shape(v, 3, "vector")
+
+    qx, qy, qz, qw = sign * q[..., 0], sign * q[..., 1], sign * q[..., 2], q[..., 3]
+    vx, vy, vz = v[..., 0], v[..., 1], v[..., 2]
+
+    # v' = v + w * t + q_vec x t, with t = 2 * q_vec x v
+    tx = 2.0 * (qy * vz - qz * vy)
+    ty = 2.0 * (qz * vx - qx * vz)
+    tz = 2.0 * (qx * vy - qy * vx)
+
+    x = vx + qw * tx + (qy * tz - qz * ty)
+    y = vy + qw * ty + (qz * tx - qx * tz)
+    z = vz + qw * tz + (qx * ty - qy * tx)
+
+    if out is None:
+        out = _empty(v, tuple(x.shape) + (3,))
+    out[..., 0] = x
+    out[..., 1] = y
+    out[..., 2] = z
+    return out
+
+
+def quat_rotate(q, v, out=None):
+    """Rotate v from the body frame to the world frame."""
+    return _rotate(q, v, 1.0, out)
+
+
+def quat_rotate_inverse(q, v, out=None):
+    """Rotate v from the world frame to the body frame."""
+    return _rotate(q, v, -1.0, out)
+
+
+def projected_gravity(q, out=None):
+    """Gravity direction (0, 0, -1) in the body frame, same as quat_rotate_inverse(q, (0, 0, -1))."""
+    _check_shape(q, 4, "quaternion")
+
+    if q.ndim == 1:
+        # single quaternion, python float math is much faster than array math
+        x, y, z, w = q.tolist()
+    else:
+        x, y, z, w = q[..., 0], q[..., 1], q[..., 2], q[..., 3]
+
+    gx = 2.0 * (w * y - x * z)
+    gy = -2.0 * (w * x + y * z)
+    gz = 1.0 - 2.0 * (w * w + z * z)
+
+    if out is None:
+        out = _empty(q, tuple(q.shape[:-1]) + (3,))
+    out[..., 0] = gx
+    out[..., 1] = gy
+    out[..., 2] = gz
+    return out
+
+
+def quat_to_euler(q, out=None):
+    """Quaternion to euler angle (roll, pitch, yaw) [rad]."""
+    _check_shape(q, 4, "quaternion")
+
+    x, y, z, w = q[..., 0], q[..., 1], q[..., 2], q[..., 3]
+
+    if _is_torch(q):
+        torch = sys.modules["torch"]
+        atan2, asin, clip = torch.atan2, torch.asin, torch.clamp
+    else:
+        atan2, asin, clip = numpy.arctan2, numpy.arcsin, numpy.clip
+
+    roll = atan2(2.0 * (w * x + y * z), 1.0 - 2.0 * (x * x + y * y))
+    pitch = asin(clip(2.0 * (w * y - z * x), -1.0, 1.0))
+    yaw = atan2(2.0 * (w * z + x * y), 1.0 - 2.0 * (y * y + z * z))
+
+    if out is None:
+        out = _empty(q, tuple(q.shape[:-1]) + (3,))
+    out[..., 0] = roll
+    out[..., 1] = pitch
+    out[..., 2] = yaw
+    return out
+
+
+def euler_to_quat(euler, out=None):
+    """Euler angle (roll, pitch, yaw) [rad] to quaternion (x, y, z, w)."""
+    _check_shape(euler, 3, "euler angle")
+
+    if _is_torch(euler):
+        torch = sys.modules["torch"]
+        sin, cos = torch.sin, torch.cos
+    else:
+        sin, cos = numpy.sin, numpy.cos
+
+    half_roll, half_pitch, half_yaw = 0.5 * euler[..., 0], 0.5 * euler[..., 1], 0.5 * euler[..., 2]
+    sr, cr = sin(half_roll), cos(half_roll)
+    sp, cp = sin(half_pitch), cos(half_pitch)
+    sy, cy = sin(half_yaw), cos(half_yaw)
+
+    x = sr * cp * cy - cr * sp * sy
+    y = cr * sp * cy + sr * cp * sy
+    z = cr * cp * sy - sr * sp * cy
+    w = cr * cp * cy + sr * sp * sy
+
+    if out is None:
+        out = _empty(euler, tuple(euler.shape[:-1]) + (4,))
+    out[..., 0] = x
+    out[..., 1] = y
+    out[..., 2] = z
+    out[..., 3] = w
+    return out
+
+
+def quat_to_matrix(q, out=None):
+    """Quaternion to rotation matrix (body frame to world frame), shape (..., 3, 3)."""
+    _check_shape(q, 4, "quaternion")
+
+    x, y, z, w = q[..., 0], q[..., 1], q[..., 2], q[..., 3]
+
+    if out is None:
+        out = _empty(q, tuple(q.shape[:-1]) + (3, 3))
+    out[..., 0, 0] = 1.0 - 2.0 * (y * y + z * z)
+    out[..., 0, 1] = 2.0 * (x * y - w * z)
+    out[..., 0, 2] = 2.0 * (x * z + w * y)
+    out[..., 1, 0] = 2.0 * (x * y + w * z)
+    out[..., 1, 1] = 1.0 - 2.0 * (x * x + z * z)
+    out[..., 1, 2] = 2.0 * (y * z - w * x)
+    out[..., 2, 0] = 2.0 * (x * z - w * y)
+    out[..., 2, 1] = 2.0 * (y * z + w * x)
+    out[..., 2, 2] = 1.0 - 2.0 * (x * x + y * y)
+    return out
+
+
+if __name__ == "__main__":
+    # benchmark against the torch implementation previously used in demo_rl_walk.py
+    import timeit
+
+    try:
+        import torch
+    except ImportError:
+        torch = None
+
+    def quat_rotate_inverse_legacy(q, v):
+        shape = q.shape
+        q_w = q[:, -1]
+        q_vec = q[:, :3]
+        a = v * (2.0 * q_w ** 2 - 1.0).unsqueeze(-1)
+        b = torch.cross(q_vec, v, dim=-1) * q_w.unsqueeze(-1) * 2.0
+        c = q_vec * torch.bmm(q_vec.view(shape[0], 1, 3), v.view(shape[0], 3, 1)).squeeze(-1) * 2.0
+        return a - b + c
+
+    number = 10000
+
+    quat_numpy = numpy.array([[0.1, -0.2, 0.05, 0.97]])
+    quat_numpy /= numpy.linalg.norm(quat_numpy, axis=-1, keepdims=True)
+    gravity_numpy = numpy.array([[0.0, 0.0, -1.0]])
+    out_numpy = numpy.zeros((1, 3))
+
+    check_quat(quat_numpy)
+
+    results = {
+        "numpy quat_rotate_inverse": lambda: quat_rotate_inverse(quat_numpy, gravity_numpy, out=out_numpy),
+        "numpy projected_gravity": lambda: projected_gravity(quat_numpy, out=out_numpy),
+    }
+
+    if torch is not None:
+        quat_torch = torch.tensor(quat_numpy, dtype=torch.float32)
+        gravity_torch = torch.tensor(gravity_numpy, dtype=torch.float32)
+        out_torch = torch.zeros((1, 3), dtype=torch.float32)
+
+        error = torch.abs(quat_rotate_inverse_legacy(quat_torch, gravity_torch)
+                          - projected_gravity(quat_torch)).max().item()
+        print("max error against legacy quat_rotate_inverse = ", error)
+
+        results["torch quat_rotate_inverse (legacy)"] = lambda: quat_rotate_inverse_legacy(quat_torch, gravity_torch)
+        results["torch quat_rotate_inverse"] = lambda: quat_rotate_inverse(quat_torch, gravity_torch, out=out_torch)
+        results["torch projected_gravity"] = lambda: projected_gravity(quat_torch, out=out_torch)
+
+    for name, function in results.items():
+        time_in_s = timeit.timeit(function, number=number) / number
+        print(f"{name:<40}{time_in_s * 1e6:>10.2f} us")
@@ -0,0 +1,128 @@
+"""
+Copyright (C) [2024] [Fourier Intelligence Ltd.]
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA
+"""
+
+import time
+from enum import Enum
+
+
+class OverrunPolicy(str, Enum):
+    """what to do when a control cycle finishes after its deadline"""
+
+    # drop the missed periods, and wait for the next deadline on the original time grid
+    SKIP = "skip"
+    # keep the missed deadlines, run the following cycles back-to-back until caught up
+    CATCH_UP = "catch_up"
+    # print a warning, and restart the time grid from now
+    LOG = "log"
+
+
+class LoopScheduler:
+    """
+    Fixed frequency scheduler for the robot control loop.
+
+    Deadlines are absolute (k * period from the first call to `wait()`),
+    so the loop period does not drift with the execution time of the cycle.
+    Waiting is done in two phases:
+    - sleep: `time.sleep()` until `spin_window_in_s` before the deadline
+    - spin: busy wait on `time.perf_counter_ns()` until the deadline
+
+    A larger spin window gives lower jitter, at the cost of more CPU time.
+    """
+
+    def __init__(self,
+                 target_control_frequency: float,
+                 spin_window_in_s: float = 0.0005,
+                 overrun_policy: OverrunPolicy = OverrunPolicy.SKIP):
+        if target_control_frequency <= 0:
+            raise ValueError(f"target_control_frequency={target_control_frequency} should be positive")
+        if spin_window_in_s < 0:
+            raise ValueError(f"spin_window_in_s={spin_window_in_s} should not be negative")
+
+        self.target_control_frequency = target_control_frequency
+        self.period_in_ns = int(round(1e9 / target_control_frequency))
+        self.spin_window_in_ns = int(round(spin_window_in_s * 1e9))
+        self.overrun_policy = OverrunPolicy(overrun_policy)
+
+        self.deadline_in_ns = None
+        self.cycle_count = 0
+        self.overrun_count = 0
+        self.skipped_period_count = 0
+
+    @property
+    def period_in_s(self) -> float:
+        return self.period_in_ns / 1e9
+
+    def reset(self):
+        """Restart the time grid, the next `wait()` will return after one period."""
+        self.deadline_in_ns = time.perf_counter_ns() + self.period_in_ns
+
+    def wait(self) -> bool:
+        """
+        Wait until the deadline of the current cycle.
+
+        Return False if the cycle overran its deadline, True otherwise.
+        """
+        if self.deadline_in_ns is None:
+            self.reset()
+
+        self.cycle_count += 1
+
+        time_now_in_ns = time.perf_counter_ns()
+        time_to_deadline_in_ns = self.deadline_in_ns - time_now_in_ns
+
+        if time_to_deadline_in_ns < 0:
+            self.overrun_count += 1
+            self._handle_overrun(time_now_in_ns, -time_to_deadline_in_ns)
+
+            if self.overrun_policy != OverrunPolicy.SKIP:
+                return False
+
+            time_to_deadline_in_ns = self.deadline_in_ns - time_now_in_ns
+            on_time = False
+        else:
+            on_time = True
+
+        # sleep phase
+        time_to_sleep_in_ns = time_to_deadline_in_ns - self.spin_window_in_ns
+        if time_to_sleep_in_ns > 0:
+            time.sleep(time_to_sleep_in_ns / 1e9)
+
+        # spin phase
+        deadline_in_ns = self.deadline_in_ns
+        while time.perf_counter_ns() < deadline_in_ns:
+            pass
+
+        self.deadline_in_ns += self.period_in_ns
+
+        return on_time
+
+    def _handle_overrun(self, time_now_in_ns: int, time_overrun_in_ns: int):
+        if self.overrun_policy == OverrunPolicy.SKIP:
+            # move the deadline to the next point on the time grid
+            missed_period_count = time_overrun_in_ns // self.period_in_ns + 1
+            self.skipped_period_count += missed_period_count
+            self.deadline_in_ns += missed_period_count * self.period_in_ns
+
+        elif self.overrun_policy == OverrunPolicy.CATCH_UP:
+            # run the next cycle immediately, the deadline stays on the time grid
+            self.deadline_in_ns += self.period_in_ns
+
+        elif self.overrun_policy == OverrunPolicy.LOG:
+            print("LoopScheduler overrun: cycle =", self.cycle_count,
+                  ", overrun =", round(time_overrun_in_ns / 1e6, 3), "ms")
+            self.deadline_in_ns = time_now_in_ns + self.period_in_ns
@@ -0,0 +1,260 @@
+"""
+Copyright (C) [2024] [Fourier Intelligence Ltd.]
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA
+"""
+
+"""
+Simulated control system, a drop-in replacement of `ControlSystemGR` to run the demos without the robot.
+
+Selected by the rcs config (`--rcs_config`): `device_connected: false` or `comm.use_sim: true`.
+`--check-config` also validates the whole config (see `robot_config.py`) before the demo starts.
+
+Each joint is an independent inertia driven by the command of `robot_control_loop_set_control()`:
+- control mode 5 (PD): torque = kp * (target - q) - kd * dq, kp [Nm/rad], kd [Nm.s/rad]
+- control mode 4 (position): the actuator position loop is modelled as a critically damped tracking
+  at `POSITION_BANDWIDTH_IN_HZ` (its gains are in actuator units, not in Nm/rad)
+- any other mode, or servo off: no torque
+plus viscous friction, integrated at 1ms steps (semi-implicit Euler, damping implicit) up to the current time.
+
+The base is fixed and upright: the IMU reads gravity only, the base estimate stays at 0.
+The state dict has the same keys and units as `robot_control_loop_get_state()` (deg, deg/s, Nm, m).
+"""
+
+import time
+
+import numpy
+
+from utils import JointIndex
+
+CONTROL_MODE_POSITION = 4
+CONTROL_MODE_PD = 5
+
+POSITION_BANDWIDTH_IN_HZ = 10.0
+STEP_PERIOD_IN_S = 0.001
+MAX_CATCH_UP_IN_S = 0.1
+GRAVITY = 9.81
+
+# joint inertia seen at the output, including the reflected rotor inertia [kg.m^2]
+JOINT_INERTIA = {
+    "LEG": 0.2,
+    "WAIST": 0.5,
+    "HEAD": 0.01,
+    "ARM": 0.05,
+}
+JOINT_FRICTION = 0.5  # viscous friction [Nm.s/rad]
+JOINT_TORQUE_LIMIT = 300.0  # [Nm]
+
+# set by force_simulation(), e.g. for the benchmarks
+simulation_forced = False
+
+CHECK_CONFIG_FLAG = "--check-config"
+
+
+def rcs_config_path(argv: list[str]) -> str | None:
+    """Path of the rcs config from the command line (`--rcs_config=path` or `--rcs_config path`)."""
+    for index, arg in enumerate(argv):
+        if arg.startswith("--rcs_config="):
+            return arg.split("=", 1)[1]
+        if arg == "--rcs_config" and index + 1 < len(argv):
+            return argv[index + 1]
+    return None
+
+
+def force_simulation():
+    """Select SimControlSystem whatever the rcs config, for the demos imported after this call."""
+    global simulation_forced
+    simulation_forced = True
+
+
+def select_control_system(argv: list[str]):
+    """
+    Control system class for the rcs config of the command line:
+    SimControlSystem if the config selects the simulation, else ControlSystemGR (robot_rcs_gr).
+
+    Only the items selecting the control system are read. With `--check-config` (removed from argv,
+    the SDK rejects unknown arguments), the whole config is validated first, and ValueError lists its problems.
+    """
+    check_config = CHECK_CONFIG_FLAG in argv
+    if check_config:
+        argv.remove(CHECK_CONFIG_FLAG)
+
+    config_path = rcs_config_path(argv)
+    if config_path is not None and check_config:
+        from robot_config import load_config
+
+        # validated before the SDK reads it, and from the snapshot after the first run
+        load_config(config_path)
+
+    if simulation_forced:
+        return SimControlSystem
+
+    if config_path is not None:
+        from robot_config import read_control_system
+
+        config = read_control_system(config_path)
+        if config.simulated:
+            SimControlSystem.config = config
+            return SimControlSystem
+
+    from robot_rcs_gr.control_system.fi_control_system_gr import ControlSystemGR
+
+    return ControlSystemGR
+
+
+class SimControlSystem:
+    """Singleton, same as ControlSystemGR: every `SimControlSystem()` is the same simulated robot."""
+
+    config = None
+
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+            cls._instance._init()
+        return cls._instance
+
+    def _init(self, realtime: bool = True):
+        config = self.config
+        self.name = config.name if config is not None else "GR1"
+        self.mechanism = config.mechanism if config is not None else "T2"
+        self.control_period = config.control_period if config is not None else 0.01
+
+        # realtime: the simulation follows the wall clock,
+        # else each `robot_control_loop_get_state()` advances it by one control period
+        self.realtime = realtime
+
+        self.num_joint = len(JointIndex)
+        self.inertia = numpy.array([
+            next(value for group, value in JOINT_INERTIA.items() if group in joint.name) for joint in JointIndex
+        ])
+        self.friction = numpy.full(self.num_joint, JOINT_FRICTION)
+        self.torque_limit = numpy.full(self.num_joint, JOINT_TORQUE_LIMIT)
+
+        # joint state [rad, rad/s, Nm]
+        self.q = numpy.zeros(self.num_joint)
+        self.dq = numpy.zeros(self.num_joint)
+        self.torque = numpy.zeros(self.num_joint)
+
+        # command
+        self.control_mode = numpy.zeros(self.num_joint, dtype=numpy.int64)
+        self.kp = numpy.zeros(self.num_joint)
+        self.kd = numpy.zeros(self.num_joint)
+        self.target = numpy.zeros(self.num_joint)
+
+        self.servo_on = False
+        self.task_command = None
+        self.sim_time = 0.0
+        self._last_time = None
+
+    def reset(self, realtime: bool = True):
+        self._init(realtime)
+
+    # control system interface
+
+    def developer_mode(self, servo_on: bool = True):
+        self.servo_on = servo_on
+
+    def dev_mode(self):
+        self.developer_mode()
+
+    def get_info(self) -> dict:
+        return {
+            "robot_name": self.name,
+            "robot_mechanism": self.mechanism,
+            "control_period": self.control_period,
+            "simulation": True,
+        }
+
+    def robot_control_set_task_command(self, task_command):
+        self.task_command = task_command
+        name = getattr(task_command, "name", str(task_command))
+        if name.endswith("SERVO_ON"):
+            self.servo_on = True
+        elif name.endswith("SERVO_OFF"):
+            self.servo_on = False
+        elif name.endswith("SET_HOME"):
+            self.q[:] = 0.0
+            self.dq[:] = 0.0
+
+    def robot_control_loop_set_control(self, control_dict: dict):
+        # simulator choice: a missing item keeps its previous value
+        if "control_mode" in control_dict:
+            self.control_mode[:] = control_dict["control_mode"]
+        if "kp" in control_dict:
+            self.kp[:] = control_dict["kp"]
+        if "kd" in control_dict:
+            self.kd[:] = control_dict["kd"]
+        if "position" in control_dict:
+            self.target[:] = numpy.deg2rad(control_dict["position"])
+
+    def robot_control_loop_get_state(self) -> dict:
+        self.advance()
+
+        return {
+            "imu_quat": numpy.array([0.0, 0.0, 0.0, 1.0]),
+            "imu_euler_angle": numpy.zeros(3),
+            "imu_angular_velocity": numpy.zeros(3),
+            "imu_acceleration": numpy.array([0.0, 0.0, GRAVITY]),
+            "joint_position": numpy.rad2deg(self.q),
+            "joint_velocity": numpy.rad2deg(self.dq),
+            "joint_kinetic": self.torque.copy(),
+            "base_estimate_xyz": numpy.zeros(3),
+            "base_estimate_xyz_vel": numpy.zeros(3),
+        }
+
+    # simulation
+
+    def advance(self):
+        """Integrate up to the current time (realtime), or by one control period."""
+        if not self.realtime:
+            self.step(self.control_period)
+            return
+
+        now = time.perf_counter()
+        if self._last_time is not None:
+            # a stalled caller does not make the simulation run for seconds
+            self.step(min(now - self._last_time, MAX_CATCH_UP_IN_S))
+        self._last_time = now
+
+    def step(self, duration_in_s: float):
+        step_count = int(numpy.ceil(duration_in_s / STEP_PERIOD_IN_S - 1e-9))
+        if step_count <= 0:
+            return
+        dt = duration_in_s / step_count
+
+        # stiffness and damping of each joint for the current command
+        stiffness = numpy.zeros(self.num_joint)
+        damping = numpy.zeros(self.num_joint)
+        if self.servo_on:
+            pd = self.control_mode == CONTROL_MODE_PD
+            stiffness[pd] = self.kp[pd]
+            damping[pd] = self.kd[pd]
+
+            position = self.control_mode == CONTROL_MODE_POSITION
+            omega = 2 * numpy.pi * POSITION_BANDWIDTH_IN_HZ
+            stiffness[position] = self.inertia[position] * omega ** 2
+            damping[position] = 2 * self.inertia[position] * omega
+        total_damping = damping + self.friction
+
+        for _ in range(step_count):
+            spring = numpy.clip(stiffness * (self.target - self.q), -self.torque_limit, self.torque_limit)
+            # the damping is integrated implicitly, stable for any kd
+            self.dq = (self.dq + dt * spring / self.inertia) / (1 + dt * total_damping / self.inertia)
+            self.q = self.q + dt * self.dq
+            self.torque = spring - damping * self.dq
+
+        self.sim_time += duration_in_s
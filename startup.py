@@ -0,0 +1,105 @@
+"""
+Copyright (C) [2024] [Fourier Intelligence Ltd.]
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA
+"""
+
+"""
+Startup of the demos: lazy imports, and the `--profile-startup` option.
+
+`python demo_xxx.py --profile-startup --rcs_config=...` runs the demo again in a child process under `python -X importtime`,
+up to `loop_live()` (called by the demos before servo on and their control loop), then reports the time to reach it
+and the import time of each top level import and of the slowest modules. The robot is never servo on in a profile run.
+"""
+
+import importlib.util
+import os
+import sys
+import time
+
+PROFILE_STARTUP_FLAG = "--profile-startup"
+PROFILE_STARTUP_ENV = "GRX_PROFILE_STARTUP"
+
+
+def lazy_import(name: str):
+    """Module imported on first attribute access, e.g. for a package only used by some code paths."""
+    if name in sys.modules:
+        return sys.modules[name]
+
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ImportError(f"No module named '{name}'", name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+def parse_import_time(text: str) -> list[tuple[str, int, int, int]]:
+    """Lines of `-X importtime` -> (module, depth, self [us], cumulative [us]), in import order."""
+    imports = []
+    for line in text.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_in_us, cumulative_in_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip(" "))) // 2
+        imports.append((name.strip(), depth, int(self_in_us), int(cumulative_in_us)))
+    return imports
+
+
+def profile_startup(argv: list[str], count: int = 15):
+    """With `--profile-startup` in argv: profile the startup of the script in a child process, report and exit."""
+    if PROFILE_STARTUP_FLAG not in argv:
+        return
+
+    import subprocess
+
+    argv = [arg for arg in argv if arg != PROFILE_STARTUP_FLAG]
+    environment = dict(os.environ, **{PROFILE_STARTUP_ENV: "1"})
+
+    time_start_in_s = time.perf_counter()
+    process = subprocess.run([sys.executable, "-X", "importtime"] + argv,
+                             env=environment, stderr=subprocess.PIPE, text=True)
+    time_to_live_in_s = time.perf_counter() - time_start_in_s
+
+    imports = parse_import_time(process.stderr)
+    errors = [line for line in process.stderr.splitlines() if not line.startswith("import time:")]
+    if process.returncode != 0:
+        print("\n".join(errors), file=sys.stderr)
+        print(f"startup profile: {argv[0]} exited with code {process.returncode} before its loop was live")
+        sys.exit(process.returncode)
+
+    # top level imports only: their cumulative times add up to the total
+    top_level = [item for item in imports if item[1] == 0]
+    total_import_in_us = sum(item[3] for item in top_level)
+
+    print(f"startup profile: {argv[0]}")
+    print(f"time to loop live (interpreter start included) = {time_to_live_in_s * 1e3:.1f} ms")
+    print(f"import time = {total_import_in_us / 1e3:.1f} ms, {len(imports)} modules")
+    print(f"{'top level import':<40}{'cumulative [ms]':>18}")
+    for name, _, _, cumulative_in_us in sorted(top_level, key=lambda item: -item[3])[:count]:
+        print(f"{name:<40}{cumulative_in_us / 1e3:>18.1f}")
+    print(f"{'module':<40}{'self [ms]':>18}")
+    for name, _, self_in_us, _ in sorted(imports, key=lambda item: -item[2])[:count]:
+        print(f"{name:<40}{self_in_us / 1e3:>18.1f}")
+    sys.exit(0)
+
+
+def loop_live():
+    """Called by the demos once started, before servo on: ends the child process of a `--profile-startup` run."""
+    if os.environ.get(PROFILE_STARTUP_ENV):
+        sys.exit(0)
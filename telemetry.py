@@ -0,0 +1,284 @@
+"""
+Copyright (C) [2024] [Fourier Intelligence Ltd.]
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA
+"""
+
+"""
+High rate telemetry of the control loop.
+
+File format (one file per rotation, `<prefix>_<index>.tlm`):
+- header, HEADER_SIZE bytes:
+  - magic (8 bytes)
+  - record count (int64), updated by the writer as records are flushed
+  - json length (int64)
+  - json: version, capacity, columns (name, dtype, shape, offset)
+- columns, one contiguous block of `capacity` records per column,
+  the first column is always `timestamp_in_ns` (int64, time.time_ns())
+"""
+
+import json
+import os
+import threading
+import time
+
+import numpy
+
+from utils import State
+
+MAGIC = b"GRXTLM01"
+VERSION = 1
+HEADER_SIZE = 4096
+
+
+class TelemetryFile:
+    """One memory-mapped columnar telemetry file, with a fixed capacity of records."""
+
+    def __init__(self, file_path: str, columns: list[tuple], capacity: int = None):
+        """
+        Open an existing file (capacity is None), or create a new one with columns [(name, dtype, shape), ...].
+        """
+        self.file_path = file_path
+
+        if capacity is None:
+            self._open()
+        else:
+            self._create(columns, capacity)
+
+        self.header_record_count = numpy.ndarray((1,), dtype=numpy.int64, buffer=self.memmap, offset=8)
+        self.columns = {}
+        for name, dtype, shape, offset in self.column_layout:
+            self.columns[name] = numpy.ndarray((self.capacity,) + tuple(shape), dtype=numpy.dtype(dtype),
+                                               buffer=self.memmap, offset=offset)
+
+    def _create(self, columns: list[tuple], capacity: int):
+        self.capacity = capacity
+        self.column_layout = []
+
+        offset = HEADER_SIZE
+        for name, dtype, shape in columns:
+            dtype = numpy.dtype(dtype)
+            shape = tuple(shape)
+            self.column_layout.append((name, dtype.str, shape, offset))
+
+            size = capacity * dtype.itemsize * int(numpy.prod(shape, dtype=numpy.int64))
+            offset += (size + 63) // 64 * 64
+
+        header_json = json.dumps({
+            "version": VERSION,
+            "capacity": capacity,
+            "columns": self.column_layout,
+        }).encode()
+        if 24 + len(header_json) > HEADER_SIZE:
+            raise ValueError("TelemetryFile too many columns for the header")
+
+        with open(self.file_path, "wb") as f:
+            f.truncate(offset)
+
+        self.memmap = numpy.memmap(self.file_path, dtype=numpy.uint8, mode="r+", shape=(offset,))
+        self.memmap[0:8] = numpy.frombuffer(MAGIC, dtype=numpy.uint8)
+        self.memmap[8:24].view(numpy.int64)[:] = [0, len(header_json)]
+        self.memmap[24:24 + len(header_json)] = numpy.frombuffer(header_json, dtype=numpy.uint8)
+
+    def _open(self):
+        self.memmap = numpy.memmap(self.file_path, dtype=numpy.uint8, mode="r")
+
+        if bytes(self.memmap[0:8]) != MAGIC:
+            raise ValueError(f"{self.file_path} is not a telemetry file")
+
+        header_json_length = int(self.memmap[16:24].view(numpy.int64)[0])
+        header = json.loads(bytes(self.memmap[24:24 + header_json_length]))
+        if header["version"] != VERSION:
+            raise ValueError(f"{self.file_path} telemetry version {header['version']} is not supported")
+
+        self.capacity = header["capacity"]
+        self.column_layout = [(name, dtype, tuple(shape), offset) for name, dtype, shape, offset in header["columns"]]
+
+    @property
+    def record_count(self) -> int:
+        return int(self.header_record_count[0])
+
+    def records(self) -> dict:
+        """Return the recorded part of each column, as memory-mapped arrays."""
+        count = self.record_count
+        return {name: column[:count] for name, column in self.columns.items()}
+
+    def flush(self):
+        self.memmap.flush()
+
+
+def read_telemetry(file_path: str) -> dict:
+    """Return the columns of a telemetry file as memory-mapped arrays (not loaded into memory)."""
+    return TelemetryFile(file_path, columns=None).records()
+
+
+def state_columns(num_joint: int = 32, with_command: bool = True) -> list[tuple]:
+    """
+    Columns of the full state (`State.buffer`) and optionally the command (`ControlDict.control_mode`, `ControlDict.buffer`),
+    recorded with `recorder.record(state.buffer)` or `recorder.record(state.buffer, command.control_mode, command.buffer)`.
+    """
+    columns = [("state", numpy.float64, (State.layout_slices(num_joint)[-1].stop,))]
+    if with_command:
+        columns.append(("control_mode", numpy.int64, (num_joint,)))
+        columns.append(("command", numpy.float64, (3, num_joint)))
+    return columns
+
+
+class TelemetryRecorder:
+    """
+    Record one row per control cycle into rotating memory-mapped telemetry files.
+
+    `record()` runs in the control loop: it only copies the values into a preallocated ring buffer,
+    never blocks and never allocates. A background thread moves the records from the ring buffer to the file.
+
+    The ring buffer is single-producer (the control loop) / single-consumer (the writer thread):
+    the producer only advances `_head` after the slot is written, the consumer only advances `_tail`
+    after the slot is copied, so no lock is needed. When the ring buffer is full, the record is dropped
+    and counted in `dropped_count`, the control loop is never delayed.
+
+    A new file is started when `max_file_size_in_bytes` is reached, and with `max_file_count`,
+    the oldest files are deleted so that at most `max_file_count` files are kept (None: all are kept).
+    """
+
+    def __init__(self,
+                 file_prefix: str,
+                 columns: list[tuple],
+                 ring_capacity: int = 4096,
+                 max_file_size_in_bytes: int = 256 * 1024 * 1024,
+                 max_file_count: int = None,
+                 writer_period_in_s: float = 0.05):
+        """columns: [(name, dtype, shape), ...], `timestamp_in_ns` is added as the first column"""
+        self.file_prefix = file_prefix
+        self.columns = [("timestamp_in_ns", numpy.int64, ())] + [
+            (name, numpy.dtype(dtype), tuple(shape)) for name, dtype, shape in columns]
+        if max_file_count is not None and max_file_count < 1:
+            raise ValueError(f"max_file_count={max_file_count} should be at least 1")
+
+        self.ring_capacity = ring_capacity
+        self.max_file_count = max_file_count
+        self.writer_period_in_s = writer_period_in_s
+
+        record_size = sum(numpy.dtype(dtype).itemsize * int(numpy.prod(shape, dtype=numpy.int64))
+                          for _, dtype, shape in self.columns)
+        self.file_capacity = max((max_file_size_in_bytes - HEADER_SIZE) // record_size, 1)
+
+        self.ring = [numpy.zeros((ring_capacity,) + shape, dtype=dtype) for _, dtype, shape in self.columns]
+        self._head = 0
+        self._tail = 0
+        self.dropped_count = 0
+
+        self.file_index = 0
+        self.file = None
+        self.file_paths = []
+        self._file_record_count = 0
+
+        directory = os.path.dirname(os.path.abspath(file_prefix))
+        os.makedirs(directory, exist_ok=True)
+
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._writer, daemon=True)
+        self._thread.start()
+
+    def record(self, *values, timestamp_in_ns: int = None):
+        """Append one record, values are in the order of the columns given at construction."""
+        head = self._head
+        if head - self._tail >= self.ring_capacity:
+            self.dropped_count += 1
+            return
+
+        index = head % self.ring_capacity
+        ring = self.ring
+        ring[0][index] = time.time_ns() if timestamp_in_ns is None else timestamp_in_ns
+        for i, value in enumerate(values):
+            ring[i + 1][index] = value
+
+        # publish the slot to the writer thread
+        self._head = head + 1
+
+    def _open_next_file(self):
+        if self.file is not None:
+            self.file.flush()
+
+        file_path = f"{self.file_prefix}_{self.file_index:04d}.tlm"
+        self.file_index += 1
+
+        self.file = TelemetryFile(file_path, self.columns, capacity=self.file_capacity)
+        self.file_paths.append(file_path)
+        self._file_record_count = 0
+
+        # retention: delete the oldest files, the current one is always kept
+        if self.max_file_count is not None:
+            while len(self.file_paths) > self.max_file_count:
+                try:
+                    os.remove(self.file_paths.pop(0))
+                except FileNotFoundError:
+                    pass
+
+    def _write_pending(self):
+        head = self._head
+        tail = self._tail
+
+        while tail < head:
+            if self.file is None or self._file_record_count >= self.file_capacity:
+                self._open_next_file()
+
+            # contiguous run in the ring buffer and in the file
+            ring_index = tail % self.ring_capacity
+            count = min(head - tail,
+                        self.ring_capacity - ring_index,
+                        self.file_capacity - self._file_record_count)
+
+            file_index = self._file_record_count
+            for ring_column, (name, _, _) in zip(self.ring, self.columns):
+                self.file.columns[name][file_index:file_index + count] = ring_column[ring_index:ring_index + count]
+
+            self._file_record_count += count
+            self.file.header_record_count[0] = self._file_record_count
+
+            # release the slots to the producer
+            tail += count
+            self._tail = tail
+
+    def _writer(self):
+        while not self._stop_event.is_set():
+            self._write_pending()
+            self._stop_event.wait(self.writer_period_in_s)
+
+        self._write_pending()
+        if self.file is not None:
+            self.file.flush()
+
+    def close(self):
+        """Write the pending records and stop the writer thread."""
+        self._stop_event.set()
+        self._thread.join()
+
+
+if __name__ == "__main__":
+    import sys
+
+    # print a summary of telemetry files
+    for file_path in sys.argv[1:]:
+        records = read_telemetry(file_path)
+        timestamps = records["timestamp_in_ns"]
+        print(file_path, ": records = ", len(timestamps))
+        if len(timestamps) > 1:
+            period_in_ms = numpy.diff(timestamps) / 1e6
+            print("  period [ms] (mean / min / max) = ",
+                  numpy.round(period_in_ms.mean(), 3), "/",
+                  numpy.round(period_in_ms.min(), 3), "/",
+                  numpy.round(period_in_ms.max(), 3))
+        for name, column in records.items():
+            print("  ", name, column.dtype, column.shape)
@@ -1,5 +1,81 @@
+import functools
+
+import numpy
+
 from robot_rcs.tools.pd_conversion import *
 
+# joint names of the pd dicts, in JointIndex order (utils.py): index i of the gain arrays is joint JointIndex(i)
+JOINT_NAMES = [
+    "l_hip_roll", "l_hip_yaw", "l_hip_pitch", "l_knee_pitch", "l_ankle_pitch", "l_ankle_roll",
+    "r_hip_roll", "r_hip_yaw", "r_hip_pitch", "r_knee_pitch", "r_ankle_pitch", "r_ankle_roll",
+    "waist_yaw", "waist_pitch", "waist_roll",
+    "head_yaw", "head_pitch", "head_roll",
+    "l_shoulder_pitch", "l_shoulder_roll", "l_shoulder_yaw", "l_elbow_pitch", "l_wrist_yaw", "l_wrist_roll", "l_wrist_pitch",
+    "r_shoulder_pitch", "r_shoulder_roll", "r_shoulder_yaw", "r_elbow_pitch", "r_wrist_yaw", "r_wrist_roll", "r_wrist_pitch",
+]
+
+
+@functools.lru_cache(maxsize=None)
+def coefficient_tables() -> tuple[numpy.ndarray, numpy.ndarray]:
+    """
+    Coefficients of `pd_conversion` per FSAType value, computed once from it:
+    position_kp = position_coefficient * kp / kd, velocity_kp = velocity_coefficient * kd.
+    """
+    size = max(fsa_type.value for fsa_type in FSAType) + 1
+    position_coefficient = numpy.full(size, numpy.nan)
+    velocity_coefficient = numpy.full(size, numpy.nan)
+
+    for fsa_type in FSAType:
+        position_kp, velocity_kp = pd_conversion({"joint": [fsa_type, 1.0, 1.0]})["joint"]
+
+        # the tables only hold if the conversion is linear in kp / kd and kd
+        check = pd_conversion({"joint": [fsa_type, 3.0, 2.0]})["joint"]
+        if not numpy.allclose(check, (1.5 * position_kp, 2.0 * velocity_kp)):
+            raise ValueError(f"pd_conversion of {fsa_type.name} is not linear in kp / kd and kd")
+
+        position_coefficient[fsa_type.value] = position_kp
+        velocity_coefficient[fsa_type.value] = velocity_kp
+
+    position_coefficient.flags.writeable = False
+    velocity_coefficient.flags.writeable = False
+    return position_coefficient, velocity_coefficient
+
+
+def pd_conversion_array(fsa_type: numpy.ndarray,
+                        kp: numpy.ndarray,
+                        kd: numpy.ndarray,
+                        position_kp: numpy.ndarray = None,
+                        velocity_kp: numpy.ndarray = None) -> tuple[numpy.ndarray, numpy.ndarray]:
+    """
+    Same as `pd_conversion`, for whole arrays in one call: FSAType values, PD kp and kd (kd > 0)
+    -> position loop kp and velocity loop kp. With preallocated outputs, nothing is allocated.
+    """
+    position_coefficient, velocity_coefficient = coefficient_tables()
+    position_kp = numpy.divide(kp, kd, out=position_kp)
+    position_kp *= position_coefficient[fsa_type]
+    velocity_kp = numpy.multiply(velocity_coefficient[fsa_type], kd, out=velocity_kp)
+    return position_kp, velocity_kp
+
+
+def pd_arrays(pd_dict: dict) -> tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+    """
+    pd dict {name: [FSAType, kp, kd]} -> joints (JointIndex values of the dict joints),
+    and their FSAType values, kp and kd, in joint order.
+    """
+    unknown = [name for name in pd_dict if name not in JOINT_NAMES]
+    if unknown:
+        raise ValueError(f"unknown joint names {unknown}, expected names of {JOINT_NAMES}")
+
+    joints = numpy.array(sorted(JOINT_NAMES.index(name) for name in pd_dict), dtype=numpy.intp)
+    values = [pd_dict[JOINT_NAMES[joint]] for joint in joints]
+    fsa_type = numpy.array([value[0].value for value in values], dtype=numpy.intp)
+    kp = numpy.array([value[1] for value in values], dtype=numpy.float64)
+    kd = numpy.array([value[2] for value in values], dtype=numpy.float64)
+
+    if numpy.any(kd <= 0):
+        raise ValueError(f"kd should be positive, got {dict(zip(numpy.array(JOINT_NAMES)[joints], kd))}")
+    return joints, fsa_type, kp, kd
+
 
 def GR1T1_pd_dict() -> dict:
     pd_dict = {
@@ -102,7 +178,53 @@ def GR1T1_high_stiffness_pd_dict() -> dict:
     return pd_dict
 
 
+# gains profiles, converted by `converted_profile()`
+PD_PROFILES = {
+    "GR1T1": GR1T1_pd_dict,
+    "GR1T2": GR1T2_pd_dict,
+    "GR1T1_low_stiffness": GR1T1_low_stiffness_pd_dict,
+    "GR1T1_high_stiffness": GR1T1_high_stiffness_pd_dict,
+}
+
+
+@functools.lru_cache(maxsize=None)
+def converted_profile(name: str) -> tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+    """
+    Converted gains of a profile of `PD_PROFILES`, once per process (read-only arrays):
+    joints (JointIndex values), position loop kp and velocity loop kp of these joints.
+
+    To switch profile in the control loop, in position control mode:
+    `control_template.set_gains(kp=position_kp, kd=velocity_kp, indices=joints)`
+    """
+    joints, fsa_type, kp, kd = pd_arrays(PD_PROFILES[name]())
+    position_kp, velocity_kp = pd_conversion_array(fsa_type, kp, kd)
+    for array in (joints, position_kp, velocity_kp):
+        array.flags.writeable = False
+    return joints, position_kp, velocity_kp
+
+
 if __name__ == "__main__":
+    import timeit
+
     pid_dict_converted = pd_conversion(GR1T1_low_stiffness_pd_dict())
     for key, value in pid_dict_converted.items():
         print(key, numpy.array(value))
+
+    # batched conversion, against the conversion one joint at a time
+    for name, pd_dict_function in PD_PROFILES.items():
+        pd_dict = pd_dict_function()
+        joints, position_kp, velocity_kp = converted_profile(name)
+        expected = numpy.array([pd_conversion(pd_dict)[JOINT_NAMES[joint]] for joint in joints])
+        error = numpy.abs(numpy.stack([position_kp, velocity_kp], axis=-1) - expected).max()
+        print(f"{name:<24} {len(joints)} joints, max error against pd_conversion = {error:.3g}")
+
+    pd_dict = GR1T1_pd_dict()
+    joints, fsa_type, kp, kd = pd_arrays(pd_dict)
+    position_kp, velocity_kp = numpy.zeros(len(joints)), numpy.zeros(len(joints))
+
+    number = 1000
+    time_of_dict_in_s = timeit.timeit(lambda: pd_conversion(pd_dict), number=number) / number
+    time_of_array_in_s = timeit.timeit(lambda: pd_conversion_array(fsa_type, kp, kd, position_kp, velocity_kp),
+                                       number=number) / number
+    print("pd_conversion (dict, one joint at a time) = ", round(time_of_dict_in_s * 1e6, 1), "us")
+    print("pd_conversion_array (preallocated) = ", round(time_of_array_in_s * 1e6, 1), "us")
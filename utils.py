@@ -1,16 +1,18 @@
-from dataclasses import dataclass, asdict, replace
 from enum import IntEnum, Enum
 from typing import Any
 from collections import namedtuple
 
+import numpy
 
-def import_rcs(dev=True):
-    # version information
-    from robot_rcs.version.version import version as robot_rcs_version
-    from robot_rcs_gr.version.version import version as robot_rcs_gr_version
 
-    print("robot_rcs_version = ", robot_rcs_version)
-    print("robot_rcs_gr_version = ", robot_rcs_gr_version)
+def import_rcs(dev=True, print_version=False):
+    # version information, only imported when printed
+    if print_version:
+        from robot_rcs.version.version import version as robot_rcs_version
+        from robot_rcs_gr.version.version import version as robot_rcs_gr_version
+
+        print("robot_rcs_version = ", robot_rcs_version)
+        print("robot_rcs_gr_version = ", robot_rcs_gr_version)
 
     # import robot_rcs and robot_rcs_gr
     from robot_rcs.control_system.fi_control_system import ControlSystem
@@ -76,60 +78,230 @@ class PDModeKey(str, Enum):
     KD = "kd"
 
 
-# todo
-# @dataclass
-# class State:
-#     imu_quat: list
-#     imu_euler_angle: list
-#     imu_angular_velocity: list
-#     imu_acceleration: list
-#     joint_position: list
-#     joint_velocity: list
-#     joint_kinetic: list
-#     base_xyz: list
-#     base_vel_xyz: list
+class State:
+    """
+    Robot state backed by one contiguous float64 buffer, with a named zero-copy view per state item.
+
+    state items (in urdf):
+    - imu:
+      - quat (x, y, z, w)
+      - euler angle (rpy) [deg]
+      - angular velocity [deg/s]
+      - linear acceleration [m/s^2]
+    - joint:
+      - position [deg]
+      - velocity [deg/s]
+      - torque [Nm]
+    - base:
+      - position xyz [m]
+      - linear velocity xyz [m/s]
+    """
+
+    # (attribute name, key in the state dict of `robot_control_loop_get_state()`, size, size in joints)
+    LAYOUT = (
+        ("imu_quat", "imu_quat", 4, False),
+        ("imu_euler_angle", "imu_euler_angle", 3, False),
+        ("imu_angular_velocity", "imu_angular_velocity", 3, False),
+        ("imu_acceleration", "imu_acceleration", 3, False),
+        ("joint_position", "joint_position", 1, True),
+        ("joint_velocity", "joint_velocity", 1, True),
+        ("joint_kinetic", "joint_kinetic", 1, True),
+        ("base_xyz", "base_estimate_xyz", 3, False),
+        ("base_vel_xyz", "base_estimate_xyz_vel", 3, False),
+    )
+
+    __slots__ = ("num_joint", "buffer", "slices") + tuple(name for name, _, _, _ in LAYOUT)
+
+    def __init__(self, num_joint: int = len(JointIndex), buffer: numpy.ndarray = None):
+        self.num_joint = num_joint
+        self.slices = self.layout_slices(num_joint)
+
+        size = self.slices[-1].stop
+        if buffer is None:
+            buffer = numpy.zeros(size, dtype=numpy.float64)
+        elif buffer.shape != (size,) or buffer.dtype != numpy.float64 or not buffer.flags.c_contiguous:
+            raise ValueError(f"buffer should be a contiguous float64 array of shape ({size},)")
+        self.buffer = buffer
+
+        for (name, _, _, _), index in zip(self.LAYOUT, self.slices):
+            setattr(self, name, buffer[index])
+
+    @classmethod
+    def layout_slices(cls, num_joint: int) -> list[slice]:
+        slices = []
+        offset = 0
+        for _, _, size, in_joints in cls.LAYOUT:
+            size = size * num_joint if in_joints else size
+            slices.append(slice(offset, offset + size))
+            offset += size
+        return slices
+
+    @classmethod
+    def from_state_dict(cls, state_dict: dict, num_joint: int = len(JointIndex)):
+        """
+        Build a state from the dict returned by `robot_control_loop_get_state()`.
+
+        If the dict values are already views of one buffer with the state layout (e.g. from `as_state_dict()`),
+        the buffer is shared without copy, otherwise the values are copied into a new buffer.
+        """
+        buffer = cls._shared_buffer(state_dict, num_joint)
+        if buffer is not None:
+            return cls(num_joint, buffer=buffer)
+
+        state = cls(num_joint)
+        state.update(state_dict)
+        return state
+
+    @classmethod
+    def _shared_buffer(cls, state_dict: dict, num_joint: int):
+        first = state_dict.get(cls.LAYOUT[0][1])
+        if not isinstance(first, numpy.ndarray) or first.dtype != numpy.float64:
+            return None
+
+        buffer = first.base
+        slices = cls.layout_slices(num_joint)
+        if not isinstance(buffer, numpy.ndarray) \
+                or buffer.dtype != numpy.float64 \
+                or buffer.shape != (slices[-1].stop,) \
+                or not buffer.flags.c_contiguous:
+            return None
+
+        address = buffer.__array_interface__["data"][0]
+        for (_, key, _, _), index in zip(cls.LAYOUT, slices):
+            value = state_dict.get(key)
+            if not isinstance(value, numpy.ndarray) \
+                    or value.base is not buffer \
+                    or value.__array_interface__["data"][0] != address + index.start * buffer.itemsize \
+                    or value.shape != (index.stop - index.start,):
+                return None
+
+        return buffer
+
+    def update(self, state_dict: dict):
+        """Copy the dict returned by `robot_control_loop_get_state()` into the buffer, without allocation."""
+        for (name, key, _, _) in self.LAYOUT:
+            value = state_dict.get(key)
+            if value is not None:
+                numpy.copyto(getattr(self, name), value)
+
+    def as_state_dict(self) -> dict:
+        """Return a dict with the keys of `robot_control_loop_get_state()`, whose values are views of the buffer."""
+        return {key: getattr(self, name) for (name, key, _, _) in self.LAYOUT}
 
 
 ControlItem = namedtuple("ControlItem", ["control_mode", "kp", "kd", "position"])
 
 
-@dataclass
 class ControlDict:
-    # control mode:
-    # - 4: position control
-    # - 5: PD control
-    control_mode: list[ControlMode] = []
-    # kp, kd:
-    # - in position control mode: kp is position kp, kd is velocity kp
-    # - in PD control mode: kp is position kp, kd is velocity kd
-    kp: list[float] = []
-    kd: list[float] = []
-    # position (in urdf):
-    # - unit: degree
-    position: list[float] = []
-
-    def asdict(self):
-        return asdict(self)
+    """
+    Control command backed by contiguous arrays, with a named zero-copy view per command item:
+    - control_mode: int64 array
+    - kp, kd, position: views of one (3, num_joint) float64 buffer
+
+    control mode:
+    - 4: position control
+    - 5: PD control
+
+    kp, kd:
+    - in position control mode: kp is position kp, kd is velocity kp
+    - in PD control mode: kp is position kp, kd is velocity kd
+
+    position (in urdf):
+    - unit: degree
+    """
+
+    __slots__ = ("num_joint", "control_mode", "buffer", "kp", "kd", "position")
+
+    KEYS = ("control_mode", "kp", "kd", "position")
+
+    def __init__(self,
+                 control_mode: list[ControlMode] = None,
+                 kp: list[float] = None,
+                 kd: list[float] = None,
+                 position: list[float] = None,
+                 num_joint: int = len(JointIndex)):
+        self.num_joint = num_joint
+        self.control_mode = numpy.zeros(num_joint, dtype=numpy.int64)
+        self.buffer = numpy.zeros((3, num_joint), dtype=numpy.float64)
+        self.kp = self.buffer[0]
+        self.kd = self.buffer[1]
+        self.position = self.buffer[2]
+
+        for key, value in zip(self.KEYS, (control_mode, kp, kd, position)):
+            if value is not None:
+                getattr(self, key)[:] = value
+
+    def asdict(self) -> dict:
+        return {key: getattr(self, key).tolist() for key in self.KEYS}
 
     def update(self, **kwargs):
-        return replace(self, **kwargs)
-
-    def _set_key_by_index(self, key: str, indices: list[JointIndex], values: list[Any]):
-        if key == "control_mode":
-            for i, v in zip(indices, values):
-                self.control_mode[i] = v
-        elif key == "kp":
-            for i, v in zip(indices, values):
-                self.kp[i] = v
-        elif key == "kd":
-            for i, v in zip(indices, values):
-                self.kd[i] = v
-        elif key == "position":
-            for i, v in zip(indices, values):
-                self.position[i] = v
-        else:
+        """Return a copy of the command with the given items replaced."""
+        values = {key: getattr(self, key) for key in self.KEYS}
+        values.update(kwargs)
+        return ControlDict(num_joint=self.num_joint, **values)
+
+    def set_by_index(self, key: str, indices: list[JointIndex], values: list[Any]):
+        """Set the items of the given joints, values is one value per joint, or one value for all of them"""
+        if key not in self.KEYS:
             raise ValueError(f"key={key} is not supported")
 
-    def set_postion(self, indices: list[JointIndex], values: list[Any]):
+        getattr(self, key)[numpy.asarray(indices, dtype=numpy.intp)] = values
+
+    def set_position(self, indices: list[JointIndex], values: list[Any]):
         """Set joint positions"""
-        self._set_key_by_index("position", indices, values)
+        self.set_by_index("position", indices, values)
+
+    # kept for compatibility
+    set_postion = set_position
+
+
+class ControlTemplate:
+    """
+    Control command built once from a gains profile, reused every control cycle.
+
+    The command is a `ControlDict` backed by contiguous numpy arrays,
+    `control_dict` always returns the same dict of the same arrays, so a control cycle only rewrites `position`.
+    """
+
+    def __init__(self,
+                 control_mode: list[ControlMode],
+                 kp: list[float],
+                 kd: list[float],
+                 position: list[float] = None):
+        num_joint = len(control_mode)
+        if len(kp) != num_joint or len(kd) != num_joint:
+            raise ValueError(f"control_mode, kp and kd should have the same length, "
+                             f"got {num_joint}, {len(kp)}, {len(kd)}")
+
+        self.command = ControlDict(control_mode, kp, kd, position, num_joint=num_joint)
+
+        self._control_dict = {
+            "control_mode": self.command.control_mode,
+            "kp": self.command.kp,
+            "kd": self.command.kd,
+            "position": self.command.position,
+        }
+
+    @property
+    def control_dict(self) -> dict:
+        """Full command, for `ControlSystem().robot_control_loop_set_control()`."""
+        return self._control_dict
+
+    def set_position(self, position):
+        """Set all joint target positions [deg]."""
+        numpy.copyto(self.command.position, position)
+
+    def set_control_mode(self, control_mode, indices: list[JointIndex] = None):
+        self._set(self.command.control_mode, control_mode, indices)
+
+    def set_gains(self, kp=None, kd=None, indices: list[JointIndex] = None):
+        if kp is not None:
+            self._set(self.command.kp, kp, indices)
+        if kd is not None:
+            self._set(self.command.kd, kd, indices)
+
+    def _set(self, array: numpy.ndarray, values, indices: list[JointIndex] = None):
+        if indices is None:
+            array[:] = values
+        else:
+            array[numpy.asarray(indices, dtype=numpy.intp)] = values
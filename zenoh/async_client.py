@@ -0,0 +1,237 @@
+'''
+Asyncio front-end of RobotClient.
+
+One state poller per client fans the robot states out to any number of subscribers,
+blocking SDK calls run in worker threads (asyncio.to_thread), and the long activities (move, play, record)
+are asyncio tasks that can be cancelled. `abort()` cancels the running activities, then aborts the robot movement.
+
+Usage:
+    async with AsyncRobotClient(RobotClient(FREQ), FREQ) as robot:
+        async with robot.subscribe() as states:
+            async for state in states:
+                ...
+'''
+
+import asyncio
+import time
+
+import numpy as np
+from robot_rcs_gr.sdk import ControlGroup, RobotClient
+
+from playback import Playback
+from trajectory import TrajectoryWriter
+
+
+class StateSubscription:
+    '''
+    Stream of robot states for one observer.
+
+    The queue only keeps the latest `maxsize` states, a slow observer skips states instead of delaying the others.
+    '''
+
+    def __init__(self, robot, maxsize: int = 1):
+        self.robot = robot
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.dropped_count = 0
+
+    def put(self, state: dict):
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped_count += 1
+        self.queue.put_nowait(state)
+
+    async def get(self) -> dict:
+        return await self.queue.get()
+
+    def close(self):
+        self.robot.subscribers.discard(self)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> dict:
+        return await self.get()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        self.close()
+
+
+class AsyncRobotClient:
+    def __init__(self, client: RobotClient, freq: float):
+        self.client = client
+        self.freq = freq
+
+        self.subscribers = set()
+        self.activities = set()
+        self._poller = None
+
+    async def start(self):
+        '''Start polling the robot states.'''
+        if self._poller is None:
+            self._poller = asyncio.create_task(self._poll_states())
+
+    async def close(self):
+        await self.cancel_activities()
+        if self._poller is not None:
+            self._poller.cancel()
+            await asyncio.gather(self._poller, return_exceptions=True)
+            self._poller = None
+        await asyncio.to_thread(self.client.close)
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    # states
+
+    def snapshot(self) -> dict:
+        '''Copy of the current states (sensor_type -> sensor_name -> array), with the time it was taken.'''
+        state = {
+            sensor_type: {sensor_name: np.array(sensor_reading) for sensor_name, sensor_reading in sensor_data.items()}
+            for sensor_type, sensor_data in self.client.states.items()
+        }
+        state["timestamp"] = time.time()
+        return state
+
+    async def _poll_states(self):
+        period = 1 / self.freq
+        deadline = time.perf_counter()
+        while True:
+            if self.subscribers:
+                state = self.snapshot()
+                for subscriber in tuple(self.subscribers):
+                    subscriber.put(state)
+
+            deadline += period
+            await asyncio.sleep(max(deadline - time.perf_counter(), 0))
+
+    def subscribe(self, maxsize: int = 1) -> StateSubscription:
+        '''Subscribe to the robot states, use as `async with robot.subscribe() as states: async for state in states`.'''
+        subscription = StateSubscription(self, maxsize)
+        self.subscribers.add(subscription)
+        return subscription
+
+    # commands
+
+    async def set_enable(self, enable: bool):
+        await asyncio.to_thread(self.client.set_enable, enable)
+
+    async def update_pos(self):
+        await asyncio.to_thread(self.client.update_pos)
+
+    async def move_joints(self, group: ControlGroup, position, duration: float):
+        '''Move and wait for the end of the movement, cancelling it aborts the movement.'''
+        await self._run_activity(self._move_joints(group, position, duration))
+
+    async def _move_joints(self, group: ControlGroup, position, duration: float):
+        try:
+            await asyncio.to_thread(self.client.move_joints, group, position, duration, blocking=True)
+        except asyncio.CancelledError:
+            # the abort blocks in the SDK, not on the event loop
+            await asyncio.to_thread(self.client.abort)
+            raise
+
+    async def play(self, trajectory, rate: float = None, speed: float = 1.0, method: str = "cubic") -> Playback:
+        '''
+        Play a recorded trajectory on its timestamps (see play() in robot_client.py),
+        cancelling it stops the playback at the next sample.
+        '''
+        playback = Playback.from_trajectory(trajectory, self.freq, rate or self.freq, speed, method)
+        await self._run_activity(self._play(playback))
+        return playback
+
+    async def _play(self, playback: Playback):
+        await self.set_enable(True)
+        await asyncio.sleep(1)
+        await self._move_joints(ControlGroup.ALL, playback.positions[0], 2.0)
+
+        try:
+            await asyncio.to_thread(playback.run, self.client._move_to)
+        except asyncio.CancelledError:
+            # wait for the send thread, so no position is sent after the abort
+            playback.stop()
+            await asyncio.to_thread(playback.finished_event.wait, 1.0)
+            raise
+
+    async def record(self, path: str, stop: asyncio.Event, robot_type: str = "") -> int:
+        '''Record the joint positions into a trajectory file until `stop` is set (or cancelled), returns the sample count.'''
+        return await self._run_activity(self._record(path, stop, robot_type))
+
+    async def _record(self, path: str, stop: asyncio.Event, robot_type: str) -> int:
+        with TrajectoryWriter(path, len(self.client.joint_positions), self.freq, robot_type) as writer:
+            period = 1 / self.freq
+            deadline = time.perf_counter()
+            while not stop.is_set():
+                writer.append(self.client.joint_positions)
+
+                deadline += period
+                await asyncio.sleep(max(deadline - time.perf_counter(), 0))
+            return writer.sample_count
+
+    async def _run_activity(self, coroutine):
+        task = asyncio.ensure_future(coroutine)
+        self.activities.add(task)
+        try:
+            return await task
+        finally:
+            self.activities.discard(task)
+
+    async def cancel_activities(self):
+        for task in tuple(self.activities):
+            task.cancel()
+        await asyncio.gather(*self.activities, return_exceptions=True)
+
+    async def abort(self):
+        '''Cancel the running moves, plays and recordings, then stop the robot movement.'''
+        await self.cancel_activities()
+        await asyncio.to_thread(self.client.abort)
+
+
+if __name__ == "__main__":
+    # monitor the joint positions while playing the recorded trajectory, press enter to abort
+    import sys
+
+    from robot_client import FREQ, RECORD_PATH
+    from trajectory import load_trajectory
+
+    async def main():
+        async with AsyncRobotClient(RobotClient(FREQ), FREQ) as robot:
+            async def monitor():
+                async with robot.subscribe() as states:
+                    async for state in states:
+                        for sensor_name, sensor_reading in state["joint"].items():
+                            print("joint/" + sensor_name, np.round(sensor_reading, 3))
+                        await asyncio.sleep(1)
+
+            async def abort_on_enter():
+                # stdin is watched by the event loop: no worker thread is left blocked in input(),
+                # which would hold the executor shutdown at the end of asyncio.run()
+                loop = asyncio.get_running_loop()
+                entered = asyncio.Event()
+                loop.add_reader(sys.stdin, entered.set)
+                try:
+                    print("Press enter to abort")
+                    await entered.wait()
+                    sys.stdin.readline()
+                finally:
+                    loop.remove_reader(sys.stdin)
+                await robot.abort()
+
+            monitor_task = asyncio.create_task(monitor())
+            abort_task = asyncio.create_task(abort_on_enter())
+            try:
+                await robot.play(load_trajectory(RECORD_PATH))
+            except asyncio.CancelledError:
+                print("Play aborted")
+            finally:
+                monitor_task.cancel()
+                abort_task.cancel()
+                await robot.set_enable(False)
+
+    asyncio.run(main())
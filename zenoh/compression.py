@@ -0,0 +1,140 @@
+'''
+Trajectory compression (`.trajz`).
+
+Each joint is reduced to keyframes independently (Ramer-Douglas-Peucker on position over sample index),
+so stationary joints only keep their first and last sample.
+Keyframe positions are quantized, then sample indices, positions and timestamps are delta encoded,
+and the result is stored as a zlib compressed npz.
+
+Decoding interpolates each joint linearly between its keyframes, the position error is at most `tolerance`.
+'''
+
+import numpy as np
+
+VERSION = 1
+
+
+def keyframes(values: np.ndarray, tolerance: float) -> np.ndarray:
+    '''Indices of the samples to keep so that linear interpolation stays within tolerance of values.'''
+    count = len(values)
+    if count <= 2:
+        return np.arange(count)
+
+    keep = np.zeros(count, dtype=bool)
+    keep[0] = keep[-1] = True
+
+    stack = [(0, count - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+
+        # distance of the samples in between to the segment (start, end)
+        index = np.arange(start + 1, end)
+        line = values[start] + (values[end] - values[start]) * (index - start) / (end - start)
+        error = np.abs(values[start + 1:end] - line)
+
+        split = int(np.argmax(error))
+        if error[split] > tolerance:
+            split += start + 1
+            keep[split] = True
+            stack.append((start, split))
+            stack.append((split, end))
+
+    return np.flatnonzero(keep)
+
+
+class CompressedTrajectory:
+    '''
+    Decoded trajectory, with the same interface as TrajectoryReader (timestamps, positions, sequence of positions).
+    '''
+
+    def __init__(self, timestamps: np.ndarray, positions: np.ndarray, frequency: float, robot_type: str = ""):
+        self.timestamps = timestamps
+        self.positions = positions
+        self.frequency = frequency
+        self.robot_type = robot_type
+        self.num_joints = positions.shape[1]
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __getitem__(self, index):
+        return self.positions[index]
+
+    def __iter__(self):
+        return iter(self.positions)
+
+    def __repr__(self):
+        return (f"CompressedTrajectory(robot_type={self.robot_type!r}, num_joints={self.num_joints}, "
+                f"frequency={self.frequency}, sample_count={len(self)})")
+
+
+def compress(trajectory, path: str, tolerance: float = 1e-3, frequency: float = None):
+    '''
+    Compress a trajectory (TrajectoryReader, or any object with timestamps and positions) into a .trajz file.
+
+    tolerance: maximum position error after decoding, in the unit of the positions
+    '''
+    positions = np.asarray(trajectory.positions, dtype=np.float64)
+    timestamps = np.asarray(trajectory.timestamps, dtype=np.float64)
+    frequency = getattr(trajectory, "frequency", frequency)
+    robot_type = getattr(trajectory, "robot_type", "")
+
+    # half of the error budget for the keyframes, half for the quantization
+    quantum = tolerance
+    keyframe_tolerance = tolerance / 2
+
+    key_counts = []
+    key_index_deltas = []
+    key_value_deltas = []
+    for joint in range(positions.shape[1]):
+        values = positions[:, joint]
+        index = keyframes(values, keyframe_tolerance)
+        quantized = np.round(values[index] / quantum).astype(np.int64)
+
+        key_counts.append(len(index))
+        key_index_deltas.append(np.diff(index, prepend=0))
+        key_value_deltas.append(np.diff(quantized, prepend=0))
+
+    # timestamps in microseconds, nearly constant deltas
+    timestamps_in_us = np.round(timestamps * 1e6).astype(np.int64)
+
+    with open(path, "wb") as f:
+        np.savez_compressed(
+            f,
+            version=np.array(VERSION),
+            frequency=np.array(frequency if frequency is not None else 0.0),
+            robot_type=np.array(robot_type),
+            quantum=np.array(quantum),
+            sample_count=np.array(len(positions)),
+            timestamp_deltas=np.diff(timestamps_in_us, prepend=0),
+            key_counts=np.array(key_counts, dtype=np.int64),
+            key_index_deltas=np.concatenate(key_index_deltas).astype(np.int64),
+            key_value_deltas=np.concatenate(key_value_deltas).astype(np.int64),
+        )
+
+
+def decompress(path: str) -> CompressedTrajectory:
+    '''Reconstruct the full trajectory of a .trajz file, ready for play().'''
+    with np.load(path) as data:
+        if int(data["version"]) != VERSION:
+            raise ValueError(f"{path} compressed trajectory version {int(data['version'])} is not supported")
+
+        quantum = float(data["quantum"])
+        sample_count = int(data["sample_count"])
+        timestamps = np.cumsum(data["timestamp_deltas"]) / 1e6
+        key_counts = data["key_counts"]
+        key_index = np.split(data["key_index_deltas"], np.cumsum(key_counts)[:-1])
+        key_value = np.split(data["key_value_deltas"], np.cumsum(key_counts)[:-1])
+        frequency = float(data["frequency"])
+        robot_type = str(data["robot_type"])
+
+    samples = np.arange(sample_count)
+    positions = np.empty((sample_count, len(key_counts)), dtype=np.float64)
+    for joint in range(len(key_counts) if sample_count else 0):
+        index = np.cumsum(key_index[joint])
+        values = np.cumsum(key_value[joint]) * quantum
+        positions[:, joint] = np.interp(samples, index, values)
+
+    return CompressedTrajectory(timestamps, positions, frequency, robot_type)
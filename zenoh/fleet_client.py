@@ -0,0 +1,240 @@
+'''
+Fleet client: several robots over one zenoh session.
+
+The states of all robots are aggregated into one stacked array (one row per robot, same flat layout for every robot),
+and commands can be broadcast to all robots (or a subset) in one call.
+
+Each robot server is addressed by its key prefix, with the key expressions of the robot client (see `wire.py`):
+- state: one message per sensor on `{prefix}/{sensor_type}/{sensor_name}`, msgpack or binary wire message
+- command: joint positions for all joints on `{prefix}/control/joints`, msgpack `{"position": array}`
+  (the robot server only decodes msgpack there, so commands are never binary)
+'''
+
+import functools
+import struct
+import threading
+import time
+
+import numpy as np
+import zenoh
+from robot_rcs_gr.sdk import ControlGroup
+
+import wire
+from playback import Playback
+
+# Set control frequency
+FREQ = 150
+
+# Joint positions in the state
+JOINT_POSITION_FIELD = ("joint", "position")
+
+
+class FleetClient:
+    def __init__(self,
+                 names: list[str],
+                 freq: float = FREQ,
+                 session=None,
+                 num_joints: int = 32,
+                 state_schemas: list[wire.WireSchema] = ()):
+        '''
+        names: key prefix of each robot server
+        state_schemas: schemas of the binary state messages the robots may send
+        '''
+        self.names = list(names)
+        self.freq = freq
+        self.state_schemas = {schema.schema_id: schema for schema in state_schemas}
+
+        # one session for the whole fleet, only closed here if it was opened here
+        self._owns_session = session is None
+        self.session = zenoh.open(zenoh.Config()) if session is None else session
+
+        # stacked states, same layout for all robots, as a float64 wire schema
+        self.layout = wire.WireSchema(wire.STATE, wire.state_fields(num_joints), np.float64)
+        self.states = np.zeros((len(self.names), self.layout.count))
+        self.timestamps = np.zeros(len(self.names))
+        # the joint positions of a robot are zeros until received, no movement starts from them
+        self.joint_position_received = np.zeros(len(self.names), dtype=bool)
+        # undecodable state messages, e.g. a binary schema not in state_schemas
+        self.dropped_count = 0
+        self._lock = threading.Lock()
+        self._received = threading.Event()
+
+        self.subscribers = [
+            self.session.declare_subscriber(wire.STATE_KEY.format(prefix=name, sensor_type=sensor_type),
+                                            functools.partial(self._on_state, index))
+            for index, name in enumerate(self.names)
+            for sensor_type in wire.SENSOR_TYPES
+        ]
+        self.publishers = [
+            self.session.declare_publisher(wire.COMMAND_KEY.format(prefix=name))
+            for name in self.names
+        ]
+
+        self.playback = None
+
+    def close(self):
+        self.abort()
+        for subscriber in self.subscribers:
+            subscriber.undeclare()
+        for publisher in self.publishers:
+            publisher.undeclare()
+        if self._owns_session:
+            self.session.close()
+
+    # states
+
+    def _on_state(self, index: int, sample):
+        # zenoh callback thread: never raise here
+        try:
+            value = wire.decode(bytes(sample.payload), self.state_schemas)
+        except (ValueError, struct.error):
+            with self._lock:
+                self.dropped_count += 1
+            return
+
+        with self._lock:
+            row = self.states[index]
+            if isinstance(value, wire.WireMessage):
+                if value.schema.fields == self.layout.fields:
+                    # whole state with the same layout, one copy of the payload
+                    row[:] = value.values
+                else:
+                    for key, field in value.schema.slices.items():
+                        if key in self.layout.slices:
+                            row[self.layout.slices[key]] = value.values[field]
+                if JOINT_POSITION_FIELD in value.schema.slices:
+                    self.joint_position_received[index] = True
+            else:
+                # one sensor, as the robot server publishes them
+                key = wire.sensor_of_key(sample.key_expr)
+                field = self.layout.slices.get(key)
+                if field is None:
+                    return
+                row[field] = np.ravel(value)
+                if key == JOINT_POSITION_FIELD:
+                    self.joint_position_received[index] = True
+            self.timestamps[index] = time.time()
+
+        self._received.set()
+
+    def wait_for_states(self, timeout: float = None, robots: list[str] = None) -> bool:
+        '''Wait until the joint positions of every robot (or of the given robots) have been received once.'''
+        indices = self._robot_indices(robots)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                if np.all(self.joint_position_received[indices]):
+                    return True
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return False
+            self._received.clear()
+            self._received.wait(0.1 if remaining is None else min(remaining, 0.1))
+
+    def snapshot(self) -> tuple[np.ndarray, np.ndarray]:
+        '''Consistent copy of the stacked states (robots x state size), and the time each row was received.'''
+        with self._lock:
+            return self.states.copy(), self.timestamps.copy()
+
+    def field(self, states: np.ndarray, sensor_type: str, sensor_name: str) -> np.ndarray:
+        '''View of one field in stacked states, e.g. field(states, "joint", "position") -> (robots x joints)'''
+        return states[:, self.layout.slices[(sensor_type, sensor_name)]]
+
+    @property
+    def joint_positions(self) -> np.ndarray:
+        states, _ = self.snapshot()
+        return self.field(states, *JOINT_POSITION_FIELD)
+
+    # commands
+
+    def _robot_indices(self, robots: list[str] = None) -> list[int]:
+        return list(range(len(self.names))) if robots is None else [self.names.index(name) for name in robots]
+
+    def _check_joint_positions(self, indices: list[int]):
+        with self._lock:
+            missing = [self.names[index] for index in indices if not self.joint_position_received[index]]
+        if missing:
+            raise RuntimeError(f"joint positions of {', '.join(missing)} not received yet, "
+                               f"no command is sent (see wait_for_states())")
+
+    def send_positions(self, positions: np.ndarray, robots: list[str] = None):
+        '''Send joint positions, one row per robot (or one row for all robots).'''
+        indices = self._robot_indices(robots)
+        self._check_joint_positions(indices)
+        num_joints = np.shape(positions)[-1]
+        positions = np.broadcast_to(positions, (len(indices), num_joints))
+
+        for row, index in enumerate(indices):
+            self.publishers[index].put(wire.encode_msgpack({"position": np.ascontiguousarray(positions[row])}))
+
+    def move_joints(self,
+                    group: ControlGroup,
+                    positions: np.ndarray,
+                    duration: float,
+                    robots: list[str] = None,
+                    blocking: bool = True) -> Playback:
+        '''
+        Move a joint group of the robots to the target positions in `duration` seconds, all robots in sync.
+
+        positions: target of the group joints, one row per robot (or one row for all robots)
+        Raises RuntimeError if the joint positions of a robot have not been received yet (the start of the ramp).
+        The movement is interpolated once for all robots, then sent on absolute deadlines,
+        when blocking is False, it runs in a thread and can be stopped with abort().
+        '''
+        self.abort()
+
+        indices = self._robot_indices(robots)
+        self._check_joint_positions(indices)
+        start = self.joint_positions[indices]
+
+        target = start.copy()
+        target[:, group.slice] = positions
+
+        # smooth (cubic) ramp from the current positions to the target
+        count = max(int(round(duration * self.freq)), 1)
+        times = np.arange(1, count + 1) / self.freq
+        u = (times / times[-1])[:, None, None]
+        ramp = 3 * u ** 2 - 2 * u ** 3
+        trajectory = start + (target - start) * ramp
+
+        num_joints = start.shape[1]
+        self.playback = Playback(times, trajectory.reshape(count, -1))
+
+        def send(flat_positions):
+            self.send_positions(flat_positions.reshape(len(indices), num_joints), [self.names[i] for i in indices])
+
+        if blocking:
+            self.playback.run(send)
+        else:
+            threading.Thread(target=self.playback.run, args=(send,), daemon=True).start()
+        return self.playback
+
+    def abort(self):
+        '''Stop the running fleet movement.'''
+        if self.playback is not None:
+            self.playback.stop()
+            self.playback.finished_event.wait(1.0)
+            self.playback = None
+
+
+if __name__ == "__main__":
+    import sys
+
+    from rich.console import Console
+
+    console = Console()
+
+    # usage: python fleet_client.py robot_prefix_1 robot_prefix_2 ...
+    fleet = FleetClient(sys.argv[1:] or [wire.DEFAULT_PREFIX])
+    if not fleet.wait_for_states(timeout=5.0):
+        console.log("Not all robots are publishing their joint positions")
+
+    try:
+        while True:
+            states, timestamps = fleet.snapshot()
+            positions = fleet.field(states, *JOINT_POSITION_FIELD)
+            for name, position, timestamp in zip(fleet.names, positions, timestamps):
+                console.print(name, f"age {time.time() - timestamp:.3f}s", np.round(position, 3))
+            time.sleep(1)
+    finally:
+        fleet.close()
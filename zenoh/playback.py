@@ -0,0 +1,177 @@
+'''
+Timestamp-accurate trajectory playback.
+
+The recorded trajectory is resampled once before playing (linear or cubic Hermite interpolation, vectorized over samples and joints),
+at the target rate and speed factor. The send loop then only waits for the absolute deadline of each sample and sends it,
+so the playback timing does not depend on the send latency and does not drift.
+'''
+
+import threading
+import time
+
+import numpy as np
+
+
+def trajectory_timestamps(trajectory, frequency: float) -> np.ndarray:
+    '''Timestamps of a trajectory, from the file if it has them, otherwise from its recording frequency.'''
+    timestamps = getattr(trajectory, "timestamps", None)
+    if timestamps is not None:
+        return np.asarray(timestamps, dtype=np.float64)
+    return np.arange(len(trajectory), dtype=np.float64) / frequency
+
+
+def resample(timestamps: np.ndarray,
+             positions: np.ndarray,
+             rate: float,
+             speed: float = 1.0,
+             method: str = "cubic") -> tuple[np.ndarray, np.ndarray]:
+    '''
+    Resample a trajectory at `rate` [Hz], played `speed` times faster than recorded.
+
+    Returns (times, positions): play times [s] from the start of the playback, and the positions at these times.
+    - linear: piecewise linear interpolation
+    - cubic: cubic Hermite interpolation, with finite difference tangents (no overshoot on stationary joints)
+    '''
+    if method not in ("linear", "cubic"):
+        raise ValueError(f"method={method} is not supported, should be linear or cubic")
+    if rate <= 0 or speed <= 0:
+        raise ValueError("rate and speed should be positive")
+
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    positions = np.asarray(positions, dtype=np.float64)
+    if len(timestamps) != len(positions):
+        raise ValueError(f"{len(timestamps)} timestamps for {len(positions)} positions")
+
+    # empty or single sample trajectory: nothing to interpolate, played as is
+    if len(timestamps) < 2:
+        return np.zeros(len(timestamps)), positions.copy()
+
+    # drop samples with repeated timestamps, the interpolation needs strictly increasing times
+    keep = np.ones(len(timestamps), dtype=bool)
+    keep[1:] = np.diff(timestamps) > 0
+    timestamps = timestamps[keep] - timestamps[0]
+    positions = positions[keep]
+
+    if len(timestamps) < 2:
+        return np.zeros(1), positions.copy()
+
+    duration = timestamps[-1] / speed
+    times = np.arange(int(np.floor(duration * rate)) + 1, dtype=np.float64) / rate
+
+    # recorded time of each sample, and the segment it falls into
+    source_times = np.minimum(times * speed, timestamps[-1])
+    index = np.clip(np.searchsorted(timestamps, source_times, side="right") - 1, 0, len(timestamps) - 2)
+
+    t0 = timestamps[index]
+    dt = timestamps[index + 1] - t0
+    u = ((source_times - t0) / dt)[:, None]
+
+    p0 = positions[index]
+    p1 = positions[index + 1]
+
+    if method == "linear":
+        return times, p0 + (p1 - p0) * u
+
+    # tangents (per unit of recorded time), central differences inside, one-sided at the ends
+    tangents = np.empty_like(positions)
+    tangents[1:-1] = (positions[2:] - positions[:-2]) / (timestamps[2:] - timestamps[:-2])[:, None]
+    tangents[0] = (positions[1] - positions[0]) / (timestamps[1] - timestamps[0])
+    tangents[-1] = (positions[-1] - positions[-2]) / (timestamps[-1] - timestamps[-2])
+
+    m0 = tangents[index] * dt[:, None]
+    m1 = tangents[index + 1] * dt[:, None]
+
+    u2 = u * u
+    u3 = u2 * u
+    h00 = 2 * u3 - 3 * u2 + 1
+    h10 = u3 - 2 * u2 + u
+    h01 = -2 * u3 + 3 * u2
+    h11 = u3 - u2
+
+    return times, h00 * p0 + h10 * m0 + h01 * p1 + h11 * m1
+
+
+class Playback:
+    '''
+    Send a resampled trajectory on absolute deadlines.
+
+    The deadline of sample i is start + times[i]. If sending falls behind by more than `max_lateness_in_s`,
+    the late samples are skipped to catch up with the time, so the timing error stays bounded.
+    '''
+
+    def __init__(self,
+                 times: np.ndarray,
+                 positions: np.ndarray,
+                 spin_window_in_s: float = 0.0005,
+                 max_lateness_in_s: float = None):
+        self.times = times
+        self.positions = positions
+        self.spin_window_in_s = spin_window_in_s
+
+        period = times[1] - times[0] if len(times) > 1 else 0.0
+        self.max_lateness_in_s = period if max_lateness_in_s is None else max_lateness_in_s
+
+        self.stop_event = threading.Event()
+        self.finished_event = threading.Event()
+
+        self.sent_count = 0
+        self.skipped_count = 0
+        self.max_error_in_s = 0.0
+
+    @classmethod
+    def from_trajectory(cls, trajectory, frequency: float, rate: float, speed: float = 1.0, method: str = "cubic",
+                        **kwargs):
+        times, positions = resample(trajectory_timestamps(trajectory, frequency),
+                                    np.asarray(trajectory[:]),
+                                    rate, speed, method)
+        return cls(times, positions, **kwargs)
+
+    @property
+    def duration_in_s(self) -> float:
+        return float(self.times[-1]) if len(self.times) else 0.0
+
+    def stop(self):
+        self.stop_event.set()
+
+    def run(self, send):
+        '''Call send(position) for every sample at its deadline, returns False if stopped before the end.'''
+        try:
+            return self._run(send)
+        finally:
+            self.finished_event.set()
+
+    def _run(self, send):
+        times = self.times
+        positions = self.positions
+        count = len(times)
+
+        i = 0
+        start = time.perf_counter()
+        while i < count:
+            if self.stop_event.is_set():
+                return False
+
+            deadline = start + times[i]
+
+            # sleep until shortly before the deadline (woken up by stop()), then spin
+            remaining = deadline - time.perf_counter()
+            if remaining > self.spin_window_in_s and self.stop_event.wait(remaining - self.spin_window_in_s):
+                return False
+            while time.perf_counter() < deadline:
+                pass
+
+            # skip the samples whose deadline has already passed
+            lateness = time.perf_counter() - deadline
+            if lateness > self.max_lateness_in_s:
+                skip_to = min(int(np.searchsorted(times, times[i] + lateness, side="right")) - 1, count - 1)
+                if skip_to > i:
+                    self.skipped_count += skip_to - i
+                    i = skip_to
+                    deadline = start + times[i]
+
+            self.max_error_in_s = max(self.max_error_in_s, time.perf_counter() - deadline)
+            send(positions[i])
+            self.sent_count += 1
+            i += 1
+
+        return True
@@ -1,37 +1,56 @@
+import functools
+import os
 import threading
 import time
 
 import msgpack_numpy as m
 import numpy as np
-import zenoh
-from rich.console import Console
-from rich.pretty import pprint
-from rich.prompt import Confirm, Prompt
-from rich.table import Table
 from robot_rcs_gr.sdk import ControlGroup, RobotClient
 
+from compression import compress
+from playback import Playback
+from trajectory import TrajectoryWriter, load_trajectory
+
 m.patch() # Patch msgpack_numpy to handle numpy arrays
-zenoh.init_logger()  # Initialize zenoh logger
 
-# Initialize console for rich logging and printing
-console = Console() 
-log = console.log
-print = console.print
+# rich is imported on first use (prompts and printing), not when a script imports FREQ or RECORD_PATH from here,
+# and zenoh only in __main__ for its logger (RobotClient imports it anyway)
+
+
+@functools.lru_cache(maxsize=None)
+def get_console():
+    # Initialize console for rich logging and printing
+    from rich.console import Console
+
+    return Console()
+
+
+def log(*objects, **kwargs):
+    # the location of the caller is logged, not this function
+    get_console().log(*objects, _stack_offset=2, **kwargs)
+
+
+def print(*objects, **kwargs):
+    get_console().print(*objects, **kwargs)
+
 
 # Set control frequency
 FREQ = 150
 
+# Recorded trajectory file, and its compressed version
+RECORD_PATH = "record.traj"
+COMPRESSED_RECORD_PATH = "record.trajz"
+
 
-def record(client: RobotClient):
+def record(client: RobotClient, path: str = RECORD_PATH, robot_type: str = ""):
     '''
     How to use the record function:
     1. Move to the start position and press enter to set the start position.
     2. Press enter to start recording; robot arms can move freely.
     3. Move to the final position and press enter again to finish recording.
-    4. The trajectory will be stored as a npy file; use play to replay it.
+    4. The trajectory is streamed into a .traj file while recording; use play to replay it.
     '''
-
-    traj = []
+    from rich.prompt import Confirm, Prompt
 
     # Disable the force applied to the motor so the robot can move freely
     client.set_enable(False) 
@@ -64,7 +83,7 @@ def record(client: RobotClient):
 
     '''
     Two threads aiming to:
-    1. Keep adding the joint positions to the traj list.
+    1. Keep appending the joint positions to the trajectory file.
     2. Prompt the user to stop recording.
     '''
 
@@ -73,10 +92,13 @@ def record(client: RobotClient):
     time.sleep(1)
     event = threading.Event()
 
+    # Samples are written to the memory-mapped file as they are recorded, nothing is kept in memory
+    writer = TrajectoryWriter(path, len(client.joint_positions), FREQ, robot_type)
+
     def task():
         while not event.is_set():
             client.loop_manager.start()
-            traj.append(client.joint_positions.copy())
+            writer.append(client.joint_positions)
             client.loop_manager.end()
             client.loop_manager.sleep()
 
@@ -95,30 +117,39 @@ def record(client: RobotClient):
         time.sleep(0.1)
         client.set_enable(True)
 
-        # Save recorded trajectory
-        np.save("record.npy", traj)
-        return traj
+        # Finish the recorded trajectory file
+        writer.close()
+        return load_trajectory(path)
 
 
-def play(recorded_traj: list[np.ndarray], client: RobotClient):
+def play(recorded_traj, client: RobotClient, rate: float = FREQ, speed: float = 1.0, method: str = "cubic"):
     '''
     Move_joint function:
     Three argument: joint position, time duration for movement, and blocking
     Notice: Could access other funciton while blcoking = True
     time duration will change the robot moving speed, it means the time that robot take to finish the task
+
+    recorded_traj: sequence of joint positions, or a TrajectoryReader (played with its recorded timestamps)
+    rate: playback send rate [Hz], speed: playback speed factor, method: "linear" or "cubic" interpolation
     '''
 
+    # Resample the whole trajectory before moving, the send loop only waits for the deadlines
+    playback = Playback.from_trajectory(recorded_traj, FREQ, rate, speed, method)
+    if len(playback.positions) == 0:
+        log("Empty trajectory, nothing to play")
+        return
+
     client.set_enable(True)
     time.sleep(1)
 
     # Move to the first position
-    first = recorded_traj[0]
+    first = playback.positions[0]
     client.move_joints(ControlGroup.ALL, first, 2.0, blocking=True)
 
-    # Move along the trajectory stored in the list
-    for pos in recorded_traj[1:]:
-        client._move_to(pos)
-        time.sleep(1 / FREQ)
+    # Move along the trajectory, each position is sent at its deadline
+    playback.run(client._move_to)
+    log(f"Played {playback.sent_count} positions in {playback.duration_in_s:.2f}s, "
+        f"skipped {playback.skipped_count}, max timing error {playback.max_error_in_s * 1000:.2f}ms")
     time.sleep(1)
 
     # Disable the force applied into motor
@@ -127,6 +158,13 @@ def play(recorded_traj: list[np.ndarray], client: RobotClient):
 
 
 if __name__ == "__main__":
+    import zenoh
+    from rich.pretty import pprint
+    from rich.prompt import Prompt
+    from rich.table import Table
+
+    zenoh.init_logger()  # Initialize zenoh logger
+
     client = RobotClient(FREQ)
     time.sleep(0.5)
     while True:
@@ -139,8 +177,10 @@ if __name__ == "__main__":
                 "set_zero", # Reboot all the motor and go back to zero position
                 "print_states", # Print out the motor status and information
                 "move_to_default", # Move to default position
-                "record", # Recording the movement of the robot joint as a npy file
-                "play", # Replay the task recorded in the record.npy
+                "record", # Recording the movement of the robot joint as a traj file
+                "play", # Replay the task recorded in the record.traj
+                "compress", # Compress record.traj into record.trajz, with keyframes within a position tolerance
+                "play_compressed", # Replay the task compressed in the record.trajz
                 "abort", # Stop any movement that robot is doing right now
                 "exit", # Exit the robot client control
             ],
@@ -191,7 +231,16 @@ if __name__ == "__main__":
             pprint(traj)
         
         elif task == "play": 
-            rec = np.load("record.npy", allow_pickle=True)
+            rec = load_trajectory(RECORD_PATH)
+            play(rec, client)
+
+        elif task == "compress":
+            compress(load_trajectory(RECORD_PATH), COMPRESSED_RECORD_PATH)
+            log(f"Compressed {RECORD_PATH} ({os.path.getsize(RECORD_PATH)} bytes) "
+                f"into {COMPRESSED_RECORD_PATH} ({os.path.getsize(COMPRESSED_RECORD_PATH)} bytes)")
+
+        elif task == "play_compressed":
+            rec = load_trajectory(COMPRESSED_RECORD_PATH)
             play(rec, client)
         
         elif task == "exit": 
@@ -1,16 +1,37 @@
 import argparse
 from robot_rcs_gr.sdk.server import RobotServer
 
+from topics import TopicSpec
+
 
 # Define the main function with parameters for configuration, frequency, debug interval, and verbosity
-def main(config: str, freq: int, debug_interval: int, verbose: bool):
+def main(config: str, freq: int, debug_interval: int, verbose: bool,
+         topics: list[TopicSpec] = (), prefix: str = "gr", encoding: str = "msgpack"):
     if not verbose:
         from robot_rcs.logger.fi_logger import Logger
 
         Logger().state = Logger().STATE_OFF
 
+    # Republish the state as per-topic rates and fields, next to the full rate state of the server
+    relay = None
+    if topics:
+        import zenoh
+
+        from topics import TopicRelay
+
+        session = zenoh.open(zenoh.Config())
+        relay = TopicRelay(session, prefix, topics, freq, encoding)
+        for topic in relay.topics:
+            print(f"topic {topic.key}: rate = {topic.rate}Hz, fields = {topic.spec.fields or 'all'}")
+
     robot = RobotServer(config, freq, debug_interval)
-    robot.spin()
+    try:
+        robot.spin()
+    finally:
+        if relay is not None:
+            relay.close()
+            session.close()
+            print(f"topics: dropped {relay.dropped_count} undecodable sensor messages")
 
 
 if __name__ == "__main__":
@@ -22,8 +43,15 @@ if __name__ == "__main__":
     parser.add_argument('--freq', type = int, default=500, help="Main loop frequency in hz. defaults to 400hz.")
     parser.add_argument('--debug_interval', type = int, default=0, help="Debug loop print interval")
     parser.add_argument('--verbose',  action='store_true', default=True, help="Print internal debug info, default = True")
+    parser.add_argument('--topic', type = TopicSpec.parse, action='append', default=[],
+                        help="Extra state topic name:rate:fields, rate > 0 or empty for --freq, "
+                             "e.g. monitor:50:imu,joint/position (repeatable)")
+    parser.add_argument('--prefix', type = str, default="gr",
+                        help="Key prefix of the robot server, the topics are published on <prefix>/topics/<name>")
+    parser.add_argument('--encoding', type = str, choices=["msgpack", "binary"], default="msgpack",
+                        help="Encoding of the topics, the schema of binary topics is published and queryable on <topic>/schema")
 
     args = parser.parse_args()
 
     # Call the main function with the parsed arguments
-    main(args.config, args.freq, args.debug_interval, args.verbose)
+    main(args.config, args.freq, args.debug_interval, args.verbose, args.topic, args.prefix, args.encoding)
@@ -0,0 +1,112 @@
+'''
+Loopback server of the simulated robot (`SimControlSystem`, `sim.py` of the repository root), to run the zenoh clients without the robot.
+
+It serves the same key expressions as the robot server (see `wire.py`):
+- each item of the simulated state is published on `{prefix}/{sensor_type}/{sensor_name}` (msgpack) at the loop rate
+- the joint positions received on `{prefix}/control/joints` (msgpack `{"position": array}`) are the new position targets
+
+Only the state and the joint commands are served, not the other services of the robot_rcs_gr RobotServer
+(enable, control mode, PID, set home, ...): the simulated robot is servo on in position control mode from the start,
+holding its initial positions. This is enough for `fleet_client.py` and the topics of `topics.py`, not for `robot_client.py`.
+
+Unlike the other scripts of this directory, it is not self-contained: it imports `sim.py` from the repository root.
+'''
+
+import argparse
+import os
+import struct
+import sys
+import threading
+import time
+
+import numpy as np
+import zenoh
+
+import wire
+
+# sim.py and its imports are in the repository root, after this directory in the path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from sim import CONTROL_MODE_POSITION, SimControlSystem  # noqa: E402
+
+
+class SimServer:
+    def __init__(self, session, prefix: str = wire.DEFAULT_PREFIX, freq: float = 500):
+        self.freq = freq
+        self.robot = SimControlSystem()
+
+        # servo on, position control mode, holding the initial positions
+        self.robot.developer_mode(servo_on=True)
+        state = self.robot.robot_control_loop_get_state()
+        self.robot.robot_control_loop_set_control({
+            "control_mode": np.full(self.robot.num_joint, CONTROL_MODE_POSITION),
+            "position": state["joint_position"],
+        })
+
+        # undecodable or invalid commands
+        self.dropped_count = 0
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+
+        # the state dict key split at its first "_", as the robot server
+        self.publishers = {
+            key: session.declare_publisher(f"{prefix}/{key.replace('_', '/', 1)}")
+            for key in state
+        }
+        self.subscriber = session.declare_subscriber(wire.COMMAND_KEY.format(prefix=prefix), self._on_command)
+
+    def _on_command(self, sample):
+        # zenoh callback thread: never raise here
+        try:
+            position = np.asarray(wire.decode(bytes(sample.payload))["position"], dtype=np.float64)
+        except (ValueError, TypeError, KeyError, struct.error):
+            position = None
+        if position is None or position.shape != (self.robot.num_joint,):
+            with self._lock:
+                self.dropped_count += 1
+            return
+
+        with self._lock:
+            self.robot.robot_control_loop_set_control({"position": position})
+
+    def spin(self):
+        '''Publish the simulated state at the loop rate, on absolute deadlines, until stop().'''
+        period = 1 / self.freq
+        next_time = time.perf_counter()
+        while not self._stop_event.is_set():
+            with self._lock:
+                state = self.robot.robot_control_loop_get_state()
+            for key, value in state.items():
+                self.publishers[key].put(wire.encode_msgpack(value))
+
+            next_time += period
+            self._stop_event.wait(max(next_time - time.perf_counter(), 0))
+
+    def stop(self):
+        self._stop_event.set()
+
+    def close(self):
+        self.stop()
+        self.subscriber.undeclare()
+        for publisher in self.publishers.values():
+            publisher.undeclare()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Run a loopback server of the simulated robot')
+
+    parser.add_argument('--freq', type = int, default=500, help="State publish frequency in hz. defaults to 500hz.")
+    parser.add_argument('--prefix', type = str, default=wire.DEFAULT_PREFIX, help="Key prefix of the robot server")
+
+    args = parser.parse_args()
+
+    session = zenoh.open(zenoh.Config())
+    server = SimServer(session, args.prefix, args.freq)
+    print(f"simulated robot on {args.prefix}/*, {server.robot.num_joint} joints, {args.freq}Hz")
+    try:
+        server.spin()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        print(f"dropped commands: {server.dropped_count}")
+        session.close()
@@ -0,0 +1,244 @@
+'''
+Per-topic publish rates and field subscriptions of the robot states.
+
+The robot server publishes every sensor at its loop rate on `<prefix>/<sensor_type>/<sensor_name>` (see `wire.py`).
+A TopicRelay runs next to it (same host), keeps the latest value of the sensors it needs,
+and publishes one message per topic on `<prefix>/topics/<topic name>`, each with its own rate and its own subset of fields,
+so a monitoring client can receive only what it needs, e.g. the IMU at 50Hz, while the control client still uses the full state.
+
+Topic spec (command line): `name:rate:fields`
+- rate [Hz], positive, empty for the server loop rate
+- fields: comma separated `sensor_type` (all its sensors) or `sensor_type/sensor_name`, empty for all fields
+e.g. `monitor:50:imu,joint/position`
+
+Binary topics: the schema is published on `<topic>/schema` when it changes, and replied to queries on the same key,
+so a subscriber started after the relay gets it too: TopicSubscriber queries it once on startup,
+then follows the updates.
+'''
+
+import math
+import struct
+import threading
+import time
+
+import numpy as np
+import zenoh
+
+import wire
+
+# Key expression of the topics, published by the relay
+TOPIC_KEY = "{prefix}/topics/{name}"
+
+
+class TopicSpec:
+    def __init__(self, name: str, rate: float = None, fields: list[str] = ()):
+        '''rate: [Hz], None for the server loop rate'''
+        if rate is not None and not (math.isfinite(rate) and rate > 0):
+            raise ValueError(f"topic {name}: rate={rate} should be a positive number of Hz")
+
+        self.name = name
+        self.rate = rate
+        self.fields = [field for field in fields if field]
+
+    @classmethod
+    def parse(cls, spec: str):
+        parts = spec.split(":")
+        if not 1 <= len(parts) <= 3 or not parts[0]:
+            raise ValueError(f"topic spec {spec} should be name:rate:fields")
+
+        rate = float(parts[1]) if len(parts) > 1 and parts[1] else None
+        fields = parts[2].split(",") if len(parts) > 2 else []
+        return cls(parts[0], rate, fields)
+
+    def selects(self, sensor_type: str, sensor_name: str) -> bool:
+        if not self.fields:
+            return True
+        return sensor_type in self.fields or f"{sensor_type}/{sensor_name}" in self.fields
+
+    def __repr__(self):
+        return f"TopicSpec(name={self.name!r}, rate={self.rate}, fields={self.fields})"
+
+
+class Topic:
+    def __init__(self, session, key: str, spec: TopicSpec, rate: float, encoding: str):
+        if not rate > 0:
+            raise ValueError(f"topic {key}: rate={rate} should be positive")
+
+        self.key = key
+        self.spec = spec
+        self.rate = rate
+        self.encoding = encoding
+        self.publisher = session.declare_publisher(key)
+        self.schema_publisher = None
+        self.schema_queryable = None
+        if encoding == "binary":
+            self.schema_publisher = session.declare_publisher(key + "/schema")
+            self.schema_queryable = session.declare_queryable(key + "/schema", self._on_schema_query)
+
+        self.period = 1 / rate
+        self.next_time = 0.0
+
+        self.schema = None
+        self._schema_key = None
+        self._description = None
+        self.published_count = 0
+
+    def due(self, now: float) -> bool:
+        '''Decimation on a fixed time grid, re-anchored if the relay falls behind by more than a period.'''
+        if now < self.next_time:
+            return False
+        self.next_time = self.next_time + self.period if now - self.next_time < self.period else now + self.period
+        return True
+
+    def publish(self, latest: dict, sequence: int):
+        selected = {}
+        for (sensor_type, sensor_name), sensor_reading in latest.items():
+            if self.spec.selects(sensor_type, sensor_name):
+                selected.setdefault(sensor_type, {})[sensor_name] = sensor_reading
+        if not selected:
+            return
+
+        if self.encoding == "binary":
+            # new schema when the selected sensors change (e.g. a sensor received for the first time)
+            schema_key = tuple(sorted((key, np.size(value)) for key, value in latest.items()
+                                      if self.spec.selects(*key)))
+            if schema_key != self._schema_key:
+                self._schema_key = schema_key
+                self.schema = wire.WireSchema.from_message(selected)
+                self._description = self.schema.describe()
+                self.schema_publisher.put(self._description)
+            payload = self.schema.encode(selected, sequence)
+        else:
+            payload = wire.encode_msgpack(selected)
+
+        self.publisher.put(payload)
+        self.published_count += 1
+
+    def _on_schema_query(self, query):
+        # zenoh callback thread: no reply until the first message, the subscriber gets the schema when it is published
+        description = self._description
+        if description is not None:
+            query.reply(zenoh.Sample(self.key + "/schema", description))
+
+    def undeclare(self):
+        self.publisher.undeclare()
+        if self.schema_publisher is not None:
+            self.schema_publisher.undeclare()
+            self.schema_queryable.undeclare()
+
+
+class TopicRelay:
+    '''Republish the sensors of the robot server `prefix` as decimated, field filtered topics.'''
+
+    def __init__(self, session, prefix: str, specs: list[TopicSpec], freq: float, encoding: str = "msgpack"):
+        '''freq: server loop rate, used for the topics without rate'''
+        if encoding not in ("msgpack", "binary"):
+            raise ValueError(f"encoding={encoding} is not supported, should be msgpack or binary")
+
+        self.topics = [
+            Topic(session, TOPIC_KEY.format(prefix=prefix, name=spec.name), spec,
+                  freq if spec.rate is None else spec.rate, encoding)
+            for spec in specs
+        ]
+
+        # latest value of each sensor needed by a topic
+        self.latest = {}
+        self.sequence = 0
+        # undecodable sensor messages, e.g. a binary message from another relay
+        self.dropped_count = 0
+        self._lock = threading.Lock()
+
+        self.subscribers = [
+            session.declare_subscriber(wire.STATE_KEY.format(prefix=prefix, sensor_type=sensor_type), self._on_sensor)
+            for sensor_type in wire.SENSOR_TYPES
+        ] if self.topics else []
+
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._publish_loop, daemon=True)
+        if self.topics:
+            self._thread.start()
+
+    def _on_sensor(self, sample):
+        key = wire.sensor_of_key(sample.key_expr)
+        if not any(topic.spec.selects(*key) for topic in self.topics):
+            # not needed by any topic, not even decoded
+            return
+
+        # zenoh callback thread: never raise here
+        try:
+            value = np.asarray(wire.decode(bytes(sample.payload)))
+        except (ValueError, struct.error):
+            with self._lock:
+                self.dropped_count += 1
+            return
+
+        with self._lock:
+            self.latest[key] = value
+
+    def _publish_loop(self):
+        while not self._stop_event.is_set():
+            now = time.perf_counter()
+            due = [topic for topic in self.topics if topic.due(now)]
+            if due:
+                with self._lock:
+                    latest = dict(self.latest)
+                for topic in due:
+                    topic.publish(latest, self.sequence)
+                self.sequence += 1
+
+            # wait for the next topic deadline
+            next_time = min(topic.next_time for topic in self.topics)
+            self._stop_event.wait(max(next_time - time.perf_counter(), 0))
+
+    def close(self):
+        self._stop_event.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        for subscriber in self.subscribers:
+            subscriber.undeclare()
+        for topic in self.topics:
+            topic.undeclare()
+
+
+class TopicSubscriber:
+    '''
+    Receive a topic of the relay, msgpack or binary, as nested dicts (sensor_type -> sensor_name -> array).
+
+    The schema of a binary topic is queried once on startup, then updated from `<topic>/schema`,
+    binary messages received before their schema are dropped (counted in dropped_count).
+    '''
+
+    def __init__(self, session, prefix: str, name: str, callback):
+        '''callback(message: dict), called in the zenoh callback thread'''
+        self.key = TOPIC_KEY.format(prefix=prefix, name=name)
+        self.callback = callback
+        self.schemas = {}
+        self.dropped_count = 0
+        self._lock = threading.Lock()
+
+        # subscribed to the updates first, so that no schema is missed between the query and the subscription
+        self.schema_subscriber = session.declare_subscriber(self.key + "/schema", self._on_schema)
+        for reply in session.get(self.key + "/schema", zenoh.Queue()):
+            self._on_schema(reply.ok)
+        self.subscriber = session.declare_subscriber(self.key, self._on_message)
+
+    def _on_schema(self, sample):
+        schema = wire.WireSchema.from_description(bytes(sample.payload))
+        with self._lock:
+            # replaced, not updated: _on_message reads it without the lock
+            schemas = dict(self.schemas)
+            schemas[schema.schema_id] = schema
+            self.schemas = schemas
+
+    def _on_message(self, sample):
+        try:
+            message = wire.decode(bytes(sample.payload), self.schemas)
+        except ValueError:
+            with self._lock:
+                self.dropped_count += 1
+            return
+        self.callback(message.to_dict() if isinstance(message, wire.WireMessage) else message)
+
+    def close(self):
+        self.subscriber.undeclare()
+        self.schema_subscriber.undeclare()
@@ -0,0 +1,180 @@
+'''
+Trajectory file format (`.traj`), append-only and memory-mapped:
+
+- header (HEADER_DTYPE, 64 bytes):
+    magic, version, joint count, frequency [Hz], sample count, robot type
+- samples (sample_dtype(num_joints)), one after the other:
+    timestamp [s] since the start of the recording, joint positions
+
+The file grows by chunks of samples while recording, and the sample count in the header is updated after every sample,
+so a recording interrupted by a crash can still be read up to its last sample.
+'''
+
+import os
+import time
+
+import numpy as np
+
+from compression import decompress
+
+MAGIC = b"GRXTRAJ"
+VERSION = 1
+
+HEADER_DTYPE = np.dtype([
+    ("magic", "S8"),
+    ("version", "<u4"),
+    ("num_joints", "<u4"),
+    ("frequency", "<f8"),
+    ("sample_count", "<u8"),
+    ("robot_type", "S32"),
+])
+
+
+def sample_dtype(num_joints: int) -> np.dtype:
+    return np.dtype([
+        ("timestamp", "<f8"),
+        ("position", "<f8", (num_joints,)),
+    ])
+
+
+class TrajectoryWriter:
+    '''
+    Stream samples into a trajectory file while recording.
+
+    Usage:
+        with TrajectoryWriter("record.traj", num_joints, FREQ) as writer:
+            writer.append(client.joint_positions)
+    '''
+
+    def __init__(self, path: str, num_joints: int, frequency: float, robot_type: str = "", chunk_size: int = 4096):
+        self.path = path
+        self.num_joints = num_joints
+        self.chunk_size = chunk_size
+        self.dtype = sample_dtype(num_joints)
+
+        # write the header, then map the header and the first chunk
+        header = np.zeros(1, dtype=HEADER_DTYPE)
+        header["magic"] = MAGIC
+        header["version"] = VERSION
+        header["num_joints"] = num_joints
+        header["frequency"] = frequency
+        header["robot_type"] = robot_type.encode()[:32]
+
+        with open(path, "wb") as f:
+            f.write(header.tobytes())
+
+        self.sample_count = 0
+        self.capacity = 0
+        self._grow()
+
+        self.start_time = None
+
+    def _grow(self):
+        self.capacity += self.chunk_size
+        with open(self.path, "r+b") as f:
+            f.truncate(HEADER_DTYPE.itemsize + self.capacity * self.dtype.itemsize)
+
+        self.header = np.memmap(self.path, dtype=HEADER_DTYPE, mode="r+", shape=(1,))
+        self.samples = np.memmap(self.path, dtype=self.dtype, mode="r+", offset=HEADER_DTYPE.itemsize,
+                                 shape=(self.capacity,))
+
+    def append(self, position: np.ndarray, timestamp: float = None):
+        '''Append one sample, the timestamp defaults to the time since the first sample.'''
+        if timestamp is None:
+            now = time.perf_counter()
+            if self.start_time is None:
+                self.start_time = now
+            timestamp = now - self.start_time
+
+        if self.sample_count >= self.capacity:
+            self.samples.flush()
+            self._grow()
+
+        sample = self.samples[self.sample_count]
+        sample["timestamp"] = timestamp
+        sample["position"] = position
+
+        self.sample_count += 1
+        self.header["sample_count"] = self.sample_count
+
+    def close(self):
+        '''Flush the samples and trim the unused part of the last chunk.'''
+        if self.samples is None:
+            return
+
+        self.samples.flush()
+        self.header.flush()
+        self.samples = None
+        self.header = None
+
+        with open(self.path, "r+b") as f:
+            f.truncate(HEADER_DTYPE.itemsize + self.sample_count * self.dtype.itemsize)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class TrajectoryReader:
+    '''
+    Memory-map a trajectory file, samples are only read from disk when accessed.
+
+    It behaves as a sequence of joint positions, so it can be used in place of a list of positions:
+        trajectory[0], trajectory[1:], len(trajectory), for position in trajectory
+    '''
+
+    def __init__(self, path: str):
+        self.path = path
+
+        header = np.fromfile(path, dtype=HEADER_DTYPE, count=1)
+        if len(header) != 1 or header["magic"][0] != MAGIC:
+            raise ValueError(f"{path} is not a trajectory file")
+        if header["version"][0] != VERSION:
+            raise ValueError(f"{path} trajectory version {header['version'][0]} is not supported")
+
+        self.num_joints = int(header["num_joints"][0])
+        self.frequency = float(header["frequency"][0])
+        self.robot_type = header["robot_type"][0].decode()
+        self.dtype = sample_dtype(self.num_joints)
+
+        # the sample count may be larger than the file if the recording was interrupted during a chunk growth
+        file_sample_count = (os.path.getsize(path) - HEADER_DTYPE.itemsize) // self.dtype.itemsize
+        self.sample_count = min(int(header["sample_count"][0]), file_sample_count)
+
+        if self.sample_count > 0:
+            self.samples = np.memmap(path, dtype=self.dtype, mode="r", offset=HEADER_DTYPE.itemsize,
+                                     shape=(self.sample_count,))
+        else:
+            self.samples = np.zeros(0, dtype=self.dtype)
+
+    @property
+    def timestamps(self) -> np.ndarray:
+        return self.samples["timestamp"]
+
+    @property
+    def positions(self) -> np.ndarray:
+        return self.samples["position"]
+
+    def __len__(self):
+        return self.sample_count
+
+    def __getitem__(self, index):
+        return self.positions[index]
+
+    def __iter__(self):
+        return iter(self.positions)
+
+    def __repr__(self):
+        return (f"TrajectoryReader(path={self.path!r}, robot_type={self.robot_type!r}, "
+                f"num_joints={self.num_joints}, frequency={self.frequency}, sample_count={self.sample_count})")
+
+
+def load_trajectory(path: str):
+    '''Open a trajectory file, a compressed `.trajz` trajectory (decoded in memory), or a legacy `.npy` recording.'''
+    if path.endswith(".npy"):
+        return np.load(path, allow_pickle=True)
+    if path.endswith(".trajz"):
+        return decompress(path)
+    return TrajectoryReader(path)
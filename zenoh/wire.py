@@ -0,0 +1,208 @@
+'''
+Binary wire schema of the state messages, with msgpack as fallback.
+
+Binary message:
+- header (HEADER, 32 bytes, little endian):
+    magic, version, message type, payload dtype, reserved, schema id, sequence, payload count, timestamp [s]
+- payload: `payload count` float32 or float64 values, the fields of the schema one after the other
+
+A schema is the ordered list of fields (sensor_type, sensor_name, size) of a message,
+both ends build the same schema (or exchange it once with `describe()` / `WireSchema.from_description()`),
+its id (crc32 of the description) is checked on decode.
+Decoding does not copy: the fields are numpy views of the received payload.
+
+Any payload that does not start with MAGIC is decoded as msgpack (with numpy arrays), so both encodings can be mixed.
+The encoding is not negotiated: the receiver only tells them apart by the MAGIC of each payload,
+and decodes a binary message only if it already knows its schema (given to the receiver, or queried,
+see `topics.py`), else decode() raises ValueError.
+
+Only the state and topic messages can be binary: the robot server decodes the commands
+on `{prefix}/control/joints` as msgpack only.
+'''
+
+import json
+import struct
+import time
+import zlib
+
+import msgpack
+import msgpack_numpy as m
+import numpy as np
+
+MAGIC = b"GRXW"
+VERSION = 1
+
+HEADER = struct.Struct("<4sHHHHIIId")
+
+# Key expressions of the robot server (robot_rcs_gr.sdk), `{prefix}` is the robot prefix ("gr" by default):
+# each item of `robot_control_loop_get_state()` is published on `{prefix}/{sensor_type}/{sensor_name}`
+# (the state dict key split at its first "_", e.g. joint_position -> gr/joint/position),
+# the joint commands are received on `{prefix}/control/joints`
+DEFAULT_PREFIX = "gr"
+SENSOR_TYPES = ("imu", "joint", "base")
+STATE_KEY = "{prefix}/{sensor_type}/*"
+COMMAND_KEY = "{prefix}/control/joints"
+
+# message types
+STATE = 1
+
+DTYPE_CODES = {np.dtype(np.float32): 1, np.dtype(np.float64): 2}
+CODE_DTYPES = {code: dtype for dtype, code in DTYPE_CODES.items()}
+
+
+class WireMessage:
+    '''Decoded binary message, `values` and `fields` are views of the received payload.'''
+
+    __slots__ = ("schema", "sequence", "timestamp", "values")
+
+    def __init__(self, schema, sequence: int, timestamp: float, values: np.ndarray):
+        self.schema = schema
+        self.sequence = sequence
+        self.timestamp = timestamp
+        self.values = values
+
+    def __getitem__(self, key: tuple) -> np.ndarray:
+        return self.values[self.schema.slices[key]]
+
+    def to_dict(self) -> dict:
+        '''Nested dict (sensor_type -> sensor_name -> array), same as the msgpack message.'''
+        message = {}
+        for (sensor_type, sensor_name), field in self.schema.slices.items():
+            message.setdefault(sensor_type, {})[sensor_name] = self.values[field]
+        return message
+
+
+class WireSchema:
+    def __init__(self, message_type: int, fields: list[tuple], dtype=np.float32):
+        '''fields: [(sensor_type, sensor_name, size), ...]'''
+        self.message_type = message_type
+        self.fields = [(str(sensor_type), str(sensor_name), int(size)) for sensor_type, sensor_name, size in fields]
+        self.dtype = np.dtype(dtype)
+        if self.dtype not in DTYPE_CODES:
+            raise ValueError(f"dtype={self.dtype} is not supported, should be float32 or float64")
+
+        self.slices = {}
+        offset = 0
+        for sensor_type, sensor_name, size in self.fields:
+            self.slices[(sensor_type, sensor_name)] = slice(offset, offset + size)
+            offset += size
+        self.count = offset
+
+        self.schema_id = zlib.crc32(self.describe())
+        self.size = HEADER.size + self.count * self.dtype.itemsize
+
+        # preallocated message, fields are written in place by encode()
+        self._buffer = bytearray(self.size)
+        self._values = np.frombuffer(self._buffer, dtype=self.dtype, count=self.count, offset=HEADER.size)
+
+    @classmethod
+    def from_message(cls, message: dict, message_type: int = STATE, dtype=np.float32):
+        '''Schema of a nested dict message (sensor_type -> sensor_name -> array), fields in sorted order.'''
+        fields = [
+            (sensor_type, sensor_name, np.size(value))
+            for sensor_type, sensor_data in sorted(message.items())
+            for sensor_name, value in sorted(sensor_data.items())
+        ]
+        return cls(message_type, fields, dtype)
+
+    def describe(self) -> bytes:
+        return json.dumps({
+            "message_type": self.message_type,
+            "dtype": self.dtype.str,
+            "fields": self.fields,
+        }, separators=(",", ":")).encode()
+
+    @classmethod
+    def from_description(cls, description: bytes):
+        description = json.loads(description)
+        return cls(description["message_type"], description["fields"], description["dtype"])
+
+    def encode(self, message, sequence: int = 0, timestamp: float = None) -> bytes:
+        '''Encode a nested dict message, or a flat array of the schema values.'''
+        values = self._values
+        if isinstance(message, dict):
+            for (sensor_type, sensor_name), field in self.slices.items():
+                values[field] = np.ravel(message[sensor_type][sensor_name])
+        else:
+            values[:] = message
+
+        HEADER.pack_into(self._buffer, 0,
+                         MAGIC, VERSION, self.message_type, DTYPE_CODES[self.dtype], 0,
+                         self.schema_id, sequence & 0xFFFFFFFF, self.count,
+                         time.time() if timestamp is None else timestamp)
+        return bytes(self._buffer)
+
+    def decode(self, payload) -> WireMessage:
+        magic, version, message_type, dtype_code, _, schema_id, sequence, count, timestamp = \
+            HEADER.unpack_from(payload, 0)
+
+        if magic != MAGIC:
+            raise ValueError("not a binary wire message")
+        if version != VERSION:
+            raise ValueError(f"wire version {version} is not supported")
+        if schema_id != self.schema_id or count != self.count or CODE_DTYPES.get(dtype_code) != self.dtype:
+            raise ValueError(f"wire message schema {schema_id} does not match the schema {self.schema_id}")
+
+        values = np.frombuffer(payload, dtype=self.dtype, count=count, offset=HEADER.size)
+        return WireMessage(self, sequence, timestamp, values)
+
+
+def state_fields(num_joints: int = 32) -> list[tuple]:
+    '''Fields (sensor_type, sensor_name, size) of the state published by the robot server.'''
+    return [
+        ("imu", "quat", 4),
+        ("imu", "euler_angle", 3),
+        ("imu", "angular_velocity", 3),
+        ("imu", "acceleration", 3),
+        ("joint", "position", num_joints),
+        ("joint", "velocity", num_joints),
+        ("joint", "kinetic", num_joints),
+        ("base", "estimate_xyz", 3),
+        ("base", "estimate_xyz_vel", 3),
+    ]
+
+
+def sensor_of_key(key_expr) -> tuple[str, str]:
+    '''(sensor_type, sensor_name) of a state key expression, e.g. gr/joint/position -> (joint, position)'''
+    sensor_type, sensor_name = str(key_expr).split("/")[-2:]
+    return sensor_type, sensor_name
+
+
+def is_binary(payload) -> bool:
+    return bytes(payload[:len(MAGIC)]) == MAGIC
+
+
+def encode_msgpack(message) -> bytes:
+    return msgpack.packb(message, default=m.encode)
+
+
+def decode(payload, schemas: dict = None):
+    '''
+    Decode a binary message with the schema of its id (schemas: schema id -> WireSchema), returns a WireMessage,
+    or a msgpack message, returned as is.
+    '''
+    if is_binary(payload):
+        schema_id = HEADER.unpack_from(payload, 0)[5]
+        schema = (schemas or {}).get(schema_id)
+        if schema is None:
+            raise ValueError(f"wire message schema {schema_id} is unknown")
+        return schema.decode(payload)
+
+    return msgpack.unpackb(bytes(payload), object_hook=m.decode)
+
+
+if __name__ == "__main__":
+    # compare the message size and the decode time of both encodings, on the whole state of the robot server
+    import timeit
+
+    state = {}
+    for sensor_type, sensor_name, size in state_fields():
+        state.setdefault(sensor_type, {})[sensor_name] = np.zeros(size)
+
+    schema = WireSchema.from_message(state)
+    schemas = {schema.schema_id: schema}
+    number = 10000
+
+    for name, payload in (("msgpack", encode_msgpack(state)), ("binary", schema.encode(state))):
+        decode_in_s = timeit.timeit(lambda: decode(payload, schemas), number=number) / number
+        print(f"{name:<10}{len(payload):>8} bytes{decode_in_s * 1e6:>10.2f} us decode")